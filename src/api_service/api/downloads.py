@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+
+# The kinds of resources scrape_link knows how to extract text from, or skips
+HTML = "html"
+PDF = "pdf"
+BINARY = "binary"
+
+
+def classify_resource(content_type: str, link: str) -> str:
+    """
+    Classifies a resource by its Content-Type, before any of its body is read.
+
+    Args:
+        content_type (str): The Content-Type header of the response, possibly empty.
+        link (str): The URL of the resource, used when the Content-Type is missing or generic.
+
+    Returns:
+        str: PDF, HTML for any textual type (HTML, XML, plain text, JSON, or no type at all), or BINARY for
+             types text can't be extracted from, such as images, videos, audio, fonts and archives.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    is_pdf_link = link.lower().split('?')[0].endswith('.pdf')
+    if content_type == 'application/pdf' or (is_pdf_link and content_type in ('', 'application/octet-stream')):
+        return PDF
+    if not content_type or content_type.startswith('text/') or any(
+            marker in content_type for marker in ('html', 'xml', 'json')):
+        return HTML
+    return BINARY
+
+
+def read_capped(response, max_bytes: int, chunk_size: int = 65536):
+    """
+    Reads the body of a streamed response in chunks, stopping at a size cap.
+
+    Args:
+        response (requests.Response): The response, requested with stream=True.
+        max_bytes (int): The maximum number of bytes read.
+        chunk_size (int): The size of the chunks read.
+
+    Returns:
+        tuple: The body (at most `max_bytes` bytes) and whether it was truncated.
+    """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if size + len(chunk) > max_bytes:
+            chunks.append(chunk[:max_bytes - size])
+            return b''.join(chunks), True
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks), False
+
+
+def spool_to_file(response, max_bytes: int, chunk_size: int = 65536):
+    """
+    Writes the body of a streamed response to a temporary file in chunks, so it never sits in memory whole.
+
+    Args:
+        response (requests.Response): The response, requested with stream=True.
+        max_bytes (int): The maximum size of the body. A larger body is abandoned.
+        chunk_size (int): The size of the chunks read.
+
+    Returns:
+        str: The path of the temporary file, to be removed by the caller, or None if the body was larger
+             than `max_bytes`.
+    """
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.download') as file:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            file.write(chunk)
+    if size > max_bytes:
+        os.remove(file.name)
+        return None
+    return file.name
+
+
+class DownloadStats:
+    """
+    A class for counting the resources scrape_link truncated or skipped because of their type or size.
+
+    Attributes:
+        _truncated (dict): The number of truncated resources per kind.
+        _skipped (dict): The number of skipped resources per reason ('type' or 'size').
+        _lock (threading.Lock): A lock protecting the counters, since pages are scraped concurrently.
+    """
+
+    def __init__(self):
+        self._truncated = {}
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    def record_truncated(self, kind: str):
+        """Counts a resource whose body was cut at the cap of its kind."""
+        with self._lock:
+            self._truncated[kind] = self._truncated.get(kind, 0) + 1
+
+    def record_skipped(self, reason: str):
+        """Counts a resource left out because of its type or its size."""
+        with self._lock:
+            self._skipped[reason] = self._skipped.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters.
+
+        Returns:
+            dict: The truncated resources per kind and the skipped resources per reason.
+        """
+        with self._lock:
+            return {"truncated": dict(self._truncated), "skipped": dict(self._skipped)}
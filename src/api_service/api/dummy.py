@@ -1,3 +1,6 @@
+import time
+from types import SimpleNamespace
+
 DUMMY_DATA = ["1 of 123: https://www.chooch.com/",
 "2 of 123: https://www.chooch.com/solutions/manufacturing/",
 "3 of 123: https://www.chooch.com/solutions/retail-analytics/",
@@ -120,4 +123,41 @@ DUMMY_DATA = ["1 of 123: https://www.chooch.com/",
 "120 of 123: https://www.chooch.com/blog/what-is-computer-vision/",
 "121 of 123: https://www.chooch.com/blog/what-is-imagechat/",
 "122 of 123: https://www.chooch.com/blog/when-is-the-right-time-to-deploy-edge-computing/",
-"123 of 123: https://www.chooch.com/blog/new-release-chooch-inference-engine-v8/"]
\ No newline at end of file
+"123 of 123: https://www.chooch.com/blog/new-release-chooch-inference-engine-v8/"]
+
+
+class FakeVertexEndpoint:
+    """
+    A local stand-in for the Vertex AI sentiment endpoint, used to test prediction batching offline.
+
+    Each call to `predict` sleeps for a fixed round trip latency plus a small cost per instance, then
+    returns deterministic predictions in the same shape as the deployed BERT endpoint: a list holding the
+    predicted classes and the class probabilities, one entry per instance.
+
+    Attributes:
+        call_latency (float): The number of seconds spent per call, whatever the batch size.
+        instance_latency (float): The number of seconds spent per instance.
+        calls (int): The number of calls made to `predict`.
+    """
+
+    def __init__(self, call_latency: float = 0.2, instance_latency: float = 0.002):
+        """Initializes the fake endpoint with the given latencies."""
+        self.call_latency = call_latency
+        self.instance_latency = instance_latency
+        self.calls = 0
+
+    def predict(self, instances):
+        """
+        Returns fake sentiment predictions for a batch of texts.
+
+        Args:
+            instances (list): The texts to classify.
+
+        Returns:
+            An object with a 'predictions' attribute holding the classes and probabilities of the instances.
+        """
+        self.calls += 1
+        time.sleep(self.call_latency + self.instance_latency * len(instances))
+        classes = [len(text) % 3 for text in instances]
+        probabilities = [[0.8 if label == cls else 0.1 for label in range(3)] for cls in classes]
+        return SimpleNamespace(predictions=[classes, probabilities])
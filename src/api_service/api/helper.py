@@ -9,42 +9,65 @@ from llama_index.prompts import PromptTemplate
 from llama_index.node_parser import SimpleNodeParser
 import time
 import pandas as pd
-from bs4 import BeautifulSoup
 import requests
 from selenium import webdriver
 from selenium.webdriver.chrome.options import ChromiumOptions
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import os
 from pathlib import Path
 from google.cloud import storage
 import re
+import io
+import json
+import hashlib
+import uuid
 import fitz  # PyMuPDF
-
-
-def query_weaviate(client, website, timestamp, query):
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from api.browser_pool import BrowserPool
+from api.http_client import HttpClient
+from api.sitemap import SitemapCache, SitemapResolver
+from api import downloads, extraction, snapshots
+from api.ingestion import BatchIngestor, IngestionPipeline
+from api.render_strategy import RenderStrategyLearner, RENDER_FIRST, REQUESTS_ONLY, REQUESTS_THEN_RENDER
+from urllib.parse import urlparse
+from lxml import etree
+
+
+# Custom prompt to exclude out of context answers
+QA_TEMPLATE = ("We have provided context information below. If the answer to a query is not contained in this context, "
+               "please explain that the context does not include the information. If the information IS included in the context, "
+               "please answer the question using the context provided below. If the answer is "
+               "financial in nature then please append QQ to the end of the response."
+               "Here are some examples: "
+               "The location of this company is not provided in the given context.\n"
+               "The company's profits were very high that year. QQ \n"
+               "The CEO's salary was $14 million. QQ \n"
+               "The company has made money for it's clients. QQ \n"
+               "The company is located in Grand Rapids, Michigan.\n"
+               "A language model is a type of machine learning model.\n"
+               "James founded the company in 2015.\n"
+               "James founded the company in 2015 with an initial seed round of $15 million. QQ \n"
+               "\n---------------------\n"
+               "{context_str}"
+               "\n---------------------\n"
+               "Given this information, please answer the question: {query_str}\n"
+)
+
+def build_weaviate_index(client):
     """
-    Executes a query against the Weaviate vector store with specific filters and returns a streaming response.
+    Builds a LlamaIndex index on top of the 'Pages' class of the Weaviate vector store.
 
-    This function sets up a vector store and an index for querying, applies exact match filters for the
-    website address and timestamp, and uses a custom prompt template for question-answering. The query is executed
-    against the Weaviate vector store, and the response is streamed back.
+    The returned index holds no per-query state, so it can be built once and shared by every
+    query engine created for the application.
 
     Args:
         client: A Weaviate client instance used to interact with the Weaviate vector store.
-        website (str): The website address to be used as a filter for the query.
-        timestamp (str): The timestamp to be used as a filter for the query.
-        query (str): The query string for the question-answering.
 
     Returns:
-        A streaming response object containing the results of the executed query.
-
-    Note:
-        The function measures the execution time of the query and prints it. The prompt template includes
-        a specific format for handling financial information in the query response.
+        VectorStoreIndex: An index backed by the Weaviate vector store.
     """
-
     # construct vector store
     vector_store = WeaviateVectorStore(weaviate_client=client, index_name="Pages", text_key="text")
 
@@ -52,8 +75,33 @@ def query_weaviate(client, website, timestamp, query):
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
     # setup an index for the Vector Store
-    index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+    return VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+
+def build_qa_template():
+    """
+    Builds the question-answering prompt template used for every RAG query.
+
+    Returns:
+        PromptTemplate: The prompt template built from QA_TEMPLATE.
+    """
+    return PromptTemplate(QA_TEMPLATE)
 
+def build_query_engine(index, qa_template, website, timestamp):
+    """
+    Creates a streaming query engine restricted to a single website snapshot.
+
+    Exact match filters are applied on the 'websiteAddress' and 'timestamp' metadata so that only
+    chunks from the requested snapshot are retrieved.
+
+    Args:
+        index (VectorStoreIndex): The index to query, usually built with `build_weaviate_index`.
+        qa_template (PromptTemplate): The prompt template used for question-answering.
+        website (str): The website address to be used as a filter for the query.
+        timestamp (str): The timestamp to be used as a filter for the query.
+
+    Returns:
+        A query engine that returns streaming responses for the given snapshot.
+    """
     # Create exact match filters for websiteAddress
     # value = website
     website_address_filter = ExactMatchFilter(key="websiteAddress", value=website)
@@ -62,34 +110,25 @@ def query_weaviate(client, website, timestamp, query):
     # Create a metadata filters instance with the above filters
     metadata_filters = MetadataFilters(filters=[website_address_filter, timestamp_filter])
 
-    # Custom prompt to exclude out of context answers
-    template = ("We have provided context information below. If the answer to a query is not contained in this context, "
-                "please explain that the context does not include the information. If the information IS included in the context, "
-                "please answer the question using the context provided below. If the answer is "
-                "financial in nature then please append QQ to the end of the response."
-                "Here are some examples: "
-                "The location of this company is not provided in the given context.\n"
-                "The company's profits were very high that year. QQ \n"
-                "The CEO's salary was $14 million. QQ \n"
-                "The company has made money for it's clients. QQ \n"
-                "The company is located in Grand Rapids, Michigan.\n"
-                "A language model is a type of machine learning model.\n"
-                "James founded the company in 2015.\n"
-                "James founded the company in 2015 with an initial seed round of $15 million. QQ \n"
-                "\n---------------------\n"
-                "{context_str}"
-                "\n---------------------\n"
-                "Given this information, please answer the question: {query_str}\n"
-    )
+    # Create a query engine with the filters
+    return index.as_query_engine(text_qa_template=qa_template,
+                                 streaming=True,
+                                 filters=metadata_filters)
 
-    qa_template = PromptTemplate(template)
+def execute_query(query_engine, query):
+    """
+    Executes a query with the given query engine and returns the streaming response.
 
-    # Create a query engine with the filters
-    query_engine = index.as_query_engine(text_qa_template=qa_template,
-                                         streaming=True,
-                                         filters=metadata_filters)
+    Args:
+        query_engine: A query engine created with `build_query_engine`.
+        query (str): The query string for the question-answering.
 
+    Returns:
+        A streaming response object containing the results of the executed query.
 
+    Note:
+        The function measures the execution time of the query and prints it.
+    """
     # Start timer
     start_time = time.time()
     # Execute the query
@@ -104,64 +143,114 @@ def query_weaviate(client, website, timestamp, query):
 
     return streaming_response
 
-def get_website_addresses(client):
+def query_weaviate(client, website, timestamp, query):
     """
-    Queries a Weaviate database to retrieve all unique website addresses stored in the Pages class.
+    Executes a query against the Weaviate vector store with specific filters and returns a streaming response.
+
+    This function sets up a vector store and an index for querying, applies exact match filters for the
+    website address and timestamp, and uses a custom prompt template for question-answering. The query is executed
+    against the Weaviate vector store, and the response is streamed back.
+
+    Args:
+        client: A Weaviate client instance used to interact with the Weaviate vector store.
+        website (str): The website address to be used as a filter for the query.
+        timestamp (str): The timestamp to be used as a filter for the query.
+        query (str): The query string for the question-answering.
+
+    Returns:
+        A streaming response object containing the results of the executed query.
+
+    Note:
+        Everything is rebuilt on each call. The API service keeps these pieces alive between
+        requests in a `QueryEngineRegistry` instead; this function is kept for one-off use.
+    """
+    index = build_weaviate_index(client)
+    query_engine = build_query_engine(index, build_qa_template(), website, timestamp)
+    return execute_query(query_engine, query)
+
+# Upper bound on the number of groups returned by an Aggregate groupBy query.
+# Weaviate caps query results at QUERY_MAXIMUM_RESULTS (10,000 by default).
+AGGREGATE_GROUP_LIMIT = 10000
 
-    This function constructs and executes a GraphQL query to fetch the 'websiteAddress' field from
-    all entries in the 'Pages' class of a Weaviate database. It ensures the uniqueness of the website
-    addresses by storing them in a set before converting them back to a sorted list for the return value.
+def get_distinct_page_values(client, property_name, website_address=None):
+    """
+    Retrieves the distinct values of a property of the 'Pages' class with an Aggregate groupBy query.
+
+    Unlike a 'Get' query, Aggregate returns one group per distinct value instead of one object per chunk,
+    so the result doesn't grow with the number of chunks and isn't truncated by QUERY_DEFAULTS_LIMIT.
 
     Args:
         client: A Weaviate client instance used to execute the GraphQL query.
+        property_name (str): The property to group by, e.g. 'websiteAddress' or 'timestamp'.
+        website_address (str, optional): If given, only the pages of this website address are aggregated.
 
     Returns:
-        list: A sorted list of unique website addresses retrieved from the Weaviate database.
+        set: The distinct non-empty values of the property.
 
     Raises:
-        HTTPException: If any error occurs during the query execution or data processing,
-                       an HTTPException with status code 500 is raised.
+        Exception: If Weaviate returns errors for the query.
     """
+    where_clause = ""
+    if website_address is not None:
+        where_clause = f'''
+                where: {{
+                    operator: Equal
+                    path: ["websiteAddress"]
+                    valueString: {json.dumps(website_address)}
+                }}'''
 
-    # Construct the GraphQL query to fetch all websiteAddress values from the Pages class
-    graphql_query = '''
-    {
-        Get {
-            Pages {
-                websiteAddress
-            }
-        }
-    }
+    graphql_query = f'''
+    {{
+        Aggregate {{
+            Pages(
+                groupBy: ["{property_name}"]
+                limit: {AGGREGATE_GROUP_LIMIT}{where_clause}
+            ) {{
+                groupedBy {{
+                    value
+                }}
+            }}
+        }}
+    }}
     '''
 
-    # Initialize a set to collect unique website addresses
-    website_addresses_set = set()
+    result = client.query.raw(graphql_query)
+    if result.get('errors'):
+        raise Exception(result['errors'])
 
-    try:
-        # Perform the query
-        result = client.query.raw(graphql_query)
+    groups = result.get('data', {}).get('Aggregate', {}).get('Pages') or []
+    return {group['groupedBy']['value'] for group in groups
+            if group.get('groupedBy') and group['groupedBy'].get('value')}
+
+def get_website_addresses(client):
+    """
+    Queries a Weaviate database to retrieve all unique website addresses stored in the Pages class.
 
-        # Extract website addresses from the 'Pages' class results
-        pages = result.get('data', {}).get('Get', {}).get('Pages', [])
-        for page in pages:
-            if 'websiteAddress' in page and page['websiteAddress']:
-                # Add to set to ensure uniqueness
-                website_addresses_set.add(page['websiteAddress'])
+    This function runs an Aggregate query grouped by the 'websiteAddress' field of the 'Pages' class
+    of a Weaviate database, which returns each website address once, and sorts the result.
 
-        # Convert the set back to a list to return
-        return sorted(list(website_addresses_set))
+    Args:
+        client: A Weaviate client instance used to execute the GraphQL query.
 
+    Returns:
+        list: A sorted list of unique website addresses retrieved from the Weaviate database.
+
+    Raises:
+        HTTPException: If any error occurs during the query execution or data processing,
+                       an HTTPException with status code 500 is raised.
+    """
+    try:
+        return sorted(get_distinct_page_values(client, "websiteAddress"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-        return []
 
 def get_all_timestamps_for_website(client, website_address: str):
     """
     Fetches all unique timestamps for a specified website address from a Weaviate database.
 
-    This function constructs a GraphQL query to retrieve the 'timestamp' field from entries
-    in the 'Pages' class that match a given website address. It ensures the uniqueness of
-    timestamps by using a set, and returns them as a sorted list in reverse order (most recent first).
+    This function runs an Aggregate query grouped by the 'timestamp' field over the entries
+    in the 'Pages' class that match a given website address, and returns the timestamps as a
+    sorted list in reverse order (most recent first).
 
     Args:
         client: A Weaviate client instance for executing the GraphQL query.
@@ -174,44 +263,28 @@ def get_all_timestamps_for_website(client, website_address: str):
         HTTPException: If any error occurs during the query execution or data processing,
                        an HTTPException with status code 500 is raised, including the error details.
     """
-
-    # GraphQL query that fetches timestamps for a particular websiteAddress
-    graphql_query = f'''
-    {{
-        Get {{
-            Pages(
-                where: {{
-                    operator: Equal
-                    path: ["websiteAddress"]
-                    valueString: "{website_address}"
-                }}
-            ) {{
-                timestamp
-            }}
-        }}
-    }}
-    '''
-    
-    # Initialize a set to collect unique timestamps
-    timestamps_set = set()
-
     try:
-        # Perform the query
-        result = client.query.raw(graphql_query)
+        return sorted(get_distinct_page_values(client, "timestamp", website_address), reverse=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Extract timestamps from the 'Pages' class results
-        pages = result.get('data', {}).get('Get', {}).get('Pages', [])
-        for page in pages:
-            if 'timestamp' in page and page['timestamp']:
-                # Add to set to ensure uniqueness
-                timestamps_set.add(page['timestamp'])
+def get_snapshot_catalog(client):
+    """
+    Builds the map of every website address to its snapshot timestamps.
 
-        # Convert the set back to a list to return
-        return sorted(list(timestamps_set), reverse=True)
+    One Aggregate query lists the website addresses, then one Aggregate query per website lists its
+    timestamps, so the cost depends on the number of snapshots rather than on the number of chunks.
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-        return []
+    Args:
+        client: A Weaviate client instance for executing the GraphQL queries.
+
+    Returns:
+        dict: A dictionary mapping each website address to its timestamps, most recent first.
+    """
+    catalog = {}
+    for website_address in get_distinct_page_values(client, "websiteAddress"):
+        catalog[website_address] = sorted(get_distinct_page_values(client, "timestamp", website_address), reverse=True)
+    return catalog
 
 def extract_document_urls(streaming_response):
     """
@@ -235,6 +308,21 @@ def extract_document_urls(streaming_response):
                 urls.append(related_node_info.node_id)
     return urls
 
+def extract_unique_document_urls(streaming_response):
+    """
+    Extracts the document URLs from a streaming response, without duplicates.
+
+    Several chunks of the same page are often retrieved together, so the same URL can appear more than once
+    in the source nodes. Duplicates are dropped in linear time and the order of first appearance is kept.
+
+    Args:
+        streaming_response: A streaming response object that contains source nodes with relationship information.
+
+    Returns:
+        list: The unique URLs (node IDs) of the document nodes, in order of first appearance.
+    """
+    return list(dict.fromkeys(extract_document_urls(streaming_response)))
+
 
 #Scraper code
 #defines a header, that is required for scraping with selenium.
@@ -242,6 +330,10 @@ headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
 }
 
+# The HTTP client shared by every request of the scraper, keeping connections alive per host
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+http_client = HttpClient(headers, pool_maxsize=HTTP_POOL_SIZE)
+
 #google cloud bucket name where csv's for company data are stored
 bucket_name = "ac215_scraper_bucket"
 
@@ -263,6 +355,50 @@ def set_chrome_options() -> ChromiumOptions:
 
 options = set_chrome_options()
 
+# Warm headless Chrome sessions shared by the Selenium fallback of scrape_link. Each session takes a few
+# hundred MB, so BROWSER_POOL_SIZE should follow the memory of the container.
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+BROWSER_MAX_PAGES = int(os.environ.get("BROWSER_MAX_PAGES", 50))
+browser_pool = BrowserPool(options, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES)
+
+# Text extraction (HTML parsing and PDF text) runs in EXTRACT_WORKERS processes. They are spawned rather
+# than forked, since the API process runs many threads. With a single CPU a pool only adds overhead, so
+# extraction then runs in the scraping threads.
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+extraction_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")) \
+    if EXTRACT_WORKERS > 1 else None
+
+# Size caps of the resources scrape_link downloads. Pages are cut at HTML_MAX_BYTES, and PDFs larger than
+# PDF_MAX_BYTES are skipped. PDFs above PDF_IN_MEMORY_BYTES, or of unknown size, are spooled to disk.
+HTML_MAX_BYTES = int(os.environ.get("HTML_MAX_BYTES", 5 * 1024 * 1024))
+PDF_MAX_BYTES = int(os.environ.get("PDF_MAX_BYTES", 50 * 1024 * 1024))
+PDF_IN_MEMORY_BYTES = int(os.environ.get("PDF_IN_MEMORY_BYTES", 5 * 1024 * 1024))
+download_stats = downloads.DownloadStats()
+
+# Learns per website whether pages need rendering, from the first RENDER_STRATEGY_SAMPLE pages of a crawl.
+# The decisions are kept in the bucket, so later snapshots of a website start with them, and are learned
+# again once older than RENDER_STRATEGY_MAX_AGE seconds.
+RENDER_STRATEGY_SAMPLE = int(os.environ.get("RENDER_STRATEGY_SAMPLE", 10))
+RENDER_STRATEGY_MAX_AGE = float(os.environ.get("RENDER_STRATEGY_MAX_AGE", 30 * 24 * 3600))
+RENDER_STRATEGIES_BLOB = "render_strategies.json"
+render_strategies = RenderStrategyLearner(sample_size=RENDER_STRATEGY_SAMPLE, max_age=RENDER_STRATEGY_MAX_AGE)
+
+# Resolves sitemaps and sitemap indexes, fetching up to SITEMAP_WORKERS nested sitemaps at once
+SITEMAP_WORKERS = int(os.environ.get("SITEMAP_WORKERS", 8))
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.svg']
+# Parsed sitemaps are reused for SITEMAP_CACHE_TTL seconds, then revalidated with conditional GETs
+SITEMAP_CACHE_SIZE = int(os.environ.get("SITEMAP_CACHE_SIZE", 256))
+SITEMAP_CACHE_TTL = float(os.environ.get("SITEMAP_CACHE_TTL", 600))
+sitemap_cache = SitemapCache(max_size=SITEMAP_CACHE_SIZE, ttl=SITEMAP_CACHE_TTL)
+sitemap_resolver = SitemapResolver(http_client, max_workers=SITEMAP_WORKERS,
+                                   skip_url=lambda link: is_image_url(link, IMAGE_EXTENSIONS),
+                                   cache=sitemap_cache)
+
+# A rendered page is read once it has been quiet (no DOM or network activity) for RENDER_QUIET_PERIOD
+# seconds, or after RENDER_TIMEOUT seconds at the latest
+RENDER_QUIET_PERIOD = float(os.environ.get("RENDER_QUIET_PERIOD", 0.5))
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 10))
+
 def extract_error_message_from_exception(exception):
     """
     Extracts the detailed error message found between ">:" and "([Errno" from an exception object.
@@ -280,12 +416,43 @@ def extract_error_message_from_exception(exception):
     match = re.search(r">: (.*?) \(\[Errno", message)
     return match.group(1) if match else message
 
+def normalize_sitemap_url(website):
+    """
+    Turns the website given by a user into the URL of its sitemap.
+
+    The input can be a simple website name, a fully qualified URL, a direct link to a sitemap (useful when
+    the sitemap is not located in its default location), or a website URL ending with a slash. The same
+    website always gives the same URL, which is also the key of its entry in `sitemap_cache`.
+
+    Args:
+        website (str): The website or sitemap given by the user.
+
+    Returns:
+        str: The URL of the sitemap, '[website]/sitemap.xml' unless a sitemap was given.
+
+    Example usage:
+        normalize_sitemap_url("ai21.com")                        # https://ai21.com/sitemap.xml
+        normalize_sitemap_url("https://ai21.com/")               # https://ai21.com/sitemap.xml
+        normalize_sitemap_url("https://ai21.com/sitemap.xml")    # https://ai21.com/sitemap.xml
+    """
+    sitemap = website.strip()
+    if "https://" not in sitemap:
+        sitemap = f"https://{sitemap}"
+    if "sitemap.xml" not in sitemap:
+        if sitemap[-1] != '/':
+            sitemap = f"{sitemap}/sitemap.xml"
+        else:
+            sitemap = f"{sitemap}sitemap.xml"
+    return sitemap
+
 def get_sitemap_attributes(url):
     """
     Extracts attributes from a sitemap URL, including nested sitemaps.
 
     This function processes a given sitemap URL to extract URLs and identify if the sitemap is nested.
-    It filters out image URLs and checks for nested sitemaps, making additional requests as necessary.
+    It filters out image URLs and follows nested sitemaps to any depth through `sitemap_resolver`, which
+    fetches them concurrently and parses them incrementally. Use `sitemap_resolver.resolve` directly to
+    consume the URLs as they are found.
     The function returns a dictionary with the status of the operation, a pandas Series of URLs, a flag
     indicating if the sitemap is nested, and a message describing the outcome.
 
@@ -297,12 +464,11 @@ def get_sitemap_attributes(url):
               a nested flag (1 for nested sitemap, 0 otherwise), and a message detailing the process or errors.
 
     Raises:
-        requests.RequestException: If a request to fetch a URL fails, the error is caught and
-                                   details are included in the returned dictionary.
+        requests.RequestException: If the request to fetch the sitemap fails, the error is caught and
+                                   details are included in the returned dictionary. Failing nested
+                                   sitemaps are skipped.
     """
 
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.svg']
-
     print("Inside get_sitemap_attributes")
     attribute_dict = {
         'status':0,
@@ -310,57 +476,27 @@ def get_sitemap_attributes(url):
         'nested_flag': 0,
         'message': ""
     }
-    error_message= ""
-    nested_sitemap_flag = False
     try:
-        with requests.get(url, headers=headers) as response:
-            soup = BeautifulSoup(response.text, 'lxml-xml')
-            urls = [link.text.strip() for link in soup.find_all('loc') if link]
+        stats = {}
+        urls = list(sitemap_resolver.resolve(url, stats))
 
         if not urls:
-            attribute_dict['status'] =1
-            attribute_dict['message'] = f'No urls found were found on {url}'
-            return attribute_dict  # Return status =0
-
-        extended_urls = []
-        for link in urls:
-            print(link)
-            if is_image_url(link, image_extensions): # Ensure we're not scraping an image
-                print(f"Skipping image URL: {link}")
-                continue
-            if link.endswith('xml'):
-                nested_sitemap_flag = True
-                try:
-                    with requests.get(link, headers=headers) as response:
-                        response.raise_for_status()  # Check if the request was successful
-                        nested_soup = BeautifulSoup(response.text, 'lxml-xml')
-                        nested_urls = [url.text.strip() for url in nested_soup.find_all('loc') if url]
-
-                        for nested_link in nested_urls:
-                            # yield f"Checking sitemap {nested_link}.\n"
-                            if is_image_url(nested_link, image_extensions):
-                                print(f"Skipping image URL in nested sitemap: {nested_link}")
-                                continue
-                            extended_urls.append(nested_link)
-                except requests.RequestException as e:
-                    print(f"Error occurred while processing {link}: {e}")
-            else:
-                extended_urls.append(link)
-
-        if not extended_urls:
             attribute_dict['status'] =1 # return status =1 (i.e. some failure happened)
-            attribute_dict['message'] = f"The sitemap URL {url} refers to a nested link of sitemaps. However, the scraper either did not find any links, or some unexpected error occured. "
+            if stats['nested']:
+                attribute_dict['message'] = f"The sitemap URL {url} refers to a nested link of sitemaps. However, the scraper either did not find any links, or some unexpected error occured. "
+            else:
+                attribute_dict['message'] = f'No urls found were found on {url}'
             return attribute_dict
 
-        attribute_dict['df'] = pd.Series(extended_urls).drop_duplicates().str.strip()
-        if nested_sitemap_flag:
-            attribute_dict['message'] = f"The sitemap URL {url} refers to a nested sitemap with {len(urls)} sitemap links."
+        attribute_dict['df'] = pd.Series(urls).str.strip().drop_duplicates()
+        if stats['nested']:
+            attribute_dict['message'] = f"The sitemap URL {url} refers to a nested sitemap with {stats['sitemaps'] - 1} sitemap links."
             attribute_dict['nested_flag'] = 1
         else:
             attribute_dict['message'] = f"The sitemap URL {url} refers to a single sitemap."
         return attribute_dict
 
-    except requests.RequestException as e:
+    except (requests.RequestException, etree.XMLSyntaxError) as e:
         print(f"Error occurred: {e}")
         attribute_dict['status'] =1
         attribute_dict['message'] = extract_error_message_from_exception(e)
@@ -382,17 +518,69 @@ def is_image_url(url, image_extensions):
     """
     return any(url.lower().endswith(ext) for ext in image_extensions)
 
-def scrape_link(link):
+def run_extraction(extract, *args):
+    """
+    Runs a text extraction function of api.extraction in the extraction process pool.
+
+    Parsing is CPU-bound, so running it in the scraping threads would serialize them behind the GIL. The
+    calling thread waits for the result without holding the GIL. Without a pool, or if the pool broke, e.g.
+    because a worker was killed, the extraction runs in the calling thread instead.
+
+    Args:
+        extract (Callable): The extraction function, e.g. extraction.extract_html_text.
+        *args: Its arguments.
+
+    Returns:
+        str: The extracted text.
+    """
+    if extraction_pool is None:
+        return extract(*args)
+    try:
+        return extraction_pool.submit(extract, *args).result()
+    except BrokenProcessPool:
+        print("The extraction process pool is broken, extracting in the calling thread")
+        return extract(*args)
+
+def render_page_text(link):
+    """
+    Renders a page with Chrome and extracts its text.
+
+    Args:
+        link (str): The URL of the page.
+
+    Returns:
+        str: The text of the rendered page without its header, navigation and footer, or an empty string
+             if rendering failed.
+    """
+    try:
+        # Render the page in a warm Chrome session of the pool, and read it once it has settled
+        page_source = browser_pool.render(link, RENDER_QUIET_PERIOD, RENDER_TIMEOUT)
+        return run_extraction(extraction.extract_html_text, page_source)
+
+    except Exception as e:
+        print(f"Error occurred while processing {link} in selenium: {e}")
+        return ""
+
+def scrape_link(link, page_info=None):
     """
     Scrapes text content from a given URL, handling both HTML and PDF formats.
 
     This function attempts to scrape text from the provided URL. For PDF content, it extracts text using PyMuPDF.
-    For HTML content, it uses BeautifulSoup for initial scraping. If the content is too short, it then attempts
-    scraping with Selenium to render JavaScript-based pages. The function returns a dictionary mapping the URL to
-    the scraped text.
+    For HTML content, it extracts the text with a direct lxml tree walk giving the same text as BeautifulSoup.
+    Both run in the `extraction_pool` processes, so parsing doesn't hold the GIL of the scraping threads.
+    The response is classified by its Content-Type before its body is read: types without text (images,
+    videos, archives...) are skipped, HTML is read in chunks up to HTML_MAX_BYTES, and PDFs over PDF_MAX_BYTES
+    are skipped while large ones are spooled to disk and extracted page by page. If the
+    content is too short, it then attempts scraping with Selenium to render JavaScript-based pages. The function
+    returns a dictionary mapping the URL to the scraped text.
 
     Args:
        link (str): The URL of the webpage or PDF to be scraped.
+       page_info (dict, optional): The 'etag' and 'last_modified' validators of a previous scrape of the page.
+                                   They are sent as a conditional GET, and the dictionary is updated with
+                                   the validators of the response, 'not_modified' (True on a 304, in which
+                                   case the returned text is empty), the 'render_strategy' used, and the
+                                   'extraction' method and 'byte_size' of the body for the snapshot.
 
     Returns:
        dict: A dictionary with the URL as the key and the scraped text as the value. If an error occurs,
@@ -403,72 +591,278 @@ def scrape_link(link):
 
     Note:
     Selenium is used as a fallback for pages that require JavaScript rendering or if the initial scrape does
-    not return sufficient content. The function handles headers, footers, and navigational elements by removing
-    them from the scraped text.
+    not return sufficient content. The page is rendered in its own tab of a warm session checked out of
+    `browser_pool`, so Chrome isn't started for every page. The HTTP request goes through the shared
+    `http_client`, reusing the keep-alive connections to the host.
+
+    How a page is fetched follows the strategy `render_strategies` learned for its website: requests with
+    the Selenium fallback while learning, then possibly render-first (no requests attempt, except for
+    PDFs) or requests-only (thin pages are kept as they are). Pages scraped while learning are recorded. The
+    function handles headers, footers, and navigational elements by removing them from the scraped text.
     """
     print(link)
     text_dict = {}
-    wait_condition = (By.TAG_NAME, ['html', 'div', 'body'])
-    browser = None  # Initialize browser to avoid crash
+
+    conditional_headers = {}
+    if page_info:
+        if page_info.get('etag'):
+            conditional_headers['If-None-Match'] = page_info['etag']
+        if page_info.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = page_info['last_modified']
+
+    domain = urlparse(link).netloc
+    strategy = render_strategies.strategy_for(domain)
+    if page_info is not None:
+        page_info['render_strategy'] = strategy
+    if strategy == RENDER_FIRST and not link.lower().endswith('.pdf'):
+        # Pages of this website are rendered client-side, requests would only find an empty shell
+        text_dict[link] = render_page_text(link)
+        if page_info is not None:
+            page_info['extraction'] = 'rendered'
+        return text_dict
 
     try:
-        with requests.get(link, headers=headers, stream=True) as response:
+        with http_client.get(link, stream=True, headers=conditional_headers) as response:
+            if page_info is not None:
+                page_info['not_modified'] = response.status_code == 304
+                if page_info['not_modified']:
+                    text_dict[link] = ""
+                    return text_dict
+                page_info['etag'] = response.headers.get('ETag')
+                page_info['last_modified'] = response.headers.get('Last-Modified')
             content_type = response.headers.get('Content-Type', '')
-            if 'application/pdf' in content_type:
+            kind = downloads.classify_resource(content_type, link)
+            content_length = int(response.headers.get('Content-Length') or 0)
+            byte_size = None
+            if kind == downloads.BINARY:
+                # Images, videos, archives... have no text, so their body isn't downloaded at all
+                print(f"Skipping {link}: {content_type} can't be extracted")
+                download_stats.record_skipped('type')
+                text_dict[link] = ""
+                extraction_method = 'none'
+            elif kind == downloads.PDF:
+                extraction_method = 'pdf'
+                path = None
                 try:
-                    # Handle PDF content
-                    with fitz.open(stream=response.content, filetype="pdf") as doc:
-                        text_from_pdf = ''.join([page.get_text() for page in doc])
-                        text_dict[link] = text_from_pdf
+                    if content_length and content_length <= PDF_IN_MEMORY_BYTES:
+                        body, truncated = downloads.read_capped(response, PDF_IN_MEMORY_BYTES)
+                    else:
+                        # Large or of unknown size: spooled to disk, unless over the cap, and extracted page by page
+                        body, truncated = None, content_length > PDF_MAX_BYTES
+                        if not truncated:
+                            path = downloads.spool_to_file(response, PDF_MAX_BYTES)
+                            truncated = path is None
+                    if truncated:
+                        # A truncated PDF can't be parsed
+                        print(f"Skipping {link}: the PDF is larger than its size cap")
+                        download_stats.record_skipped('size')
+                        text_dict[link] = ""
+                        extraction_method = 'none'
+                    elif path is not None:
+                        byte_size = os.path.getsize(path)
+                        text_dict[link] = run_extraction(extraction.extract_pdf_file, path)
+                    else:
+                        byte_size = len(body)
+                        text_dict[link] = run_extraction(extraction.extract_pdf_text, body)
+                except requests.RequestException:
+                    raise
                 except Exception as e:
                     print(f"Error occurred while processing PDF at {link}: {e}")
                     text_dict[link] = ""
+                finally:
+                    if path is not None:
+                        cleanup_files(path)
             else:
+                text_only_requests = ""
                 if response.status_code == 200:
                     try:
-                        soup = BeautifulSoup(response.text, 'lxml')
-                        [tag.decompose() for tag in soup.find_all(['header', 'nav', 'footer'])]
-                        text_only_requests = soup.get_text(separator=' ', strip=True)
+                        body, truncated = downloads.read_capped(response, HTML_MAX_BYTES)
+                        byte_size = len(body)
+                        if truncated:
+                            print(f"Truncated {link} to {HTML_MAX_BYTES} bytes")
+                            download_stats.record_truncated(kind)
+                        text_only_requests = run_extraction(extraction.extract_html_text, body, content_type)
                         text_dict[link] = text_only_requests
                     except Exception as e:
                         print(f"Error occurred while processing HTML at {link}: {e}")
                         text_dict[link] = ""
-                if response.status_code != 200 or len(text_only_requests.split()) <50:
-                    # print("scraping with selenium")
-                    try:
-                        # print("calling browser = webdriver.Chrome(options)")
-                        browser = webdriver.Chrome(options)
-                        # print("calling browser.implicitly_wait(30)")
-                        browser.implicitly_wait(30)
-                        # print("calling  browser.get(link)")
-                        browser.get(link)
-
-                        soup_selenium = BeautifulSoup(browser.page_source, 'lxml')
-
-                        [tag.decompose() for tag in soup_selenium.find_all(['header', 'nav', 'footer'])]
-                        text_only_selenium = soup_selenium.get_text(separator=' ', strip=True)
-                        text_dict[link] = text_only_selenium
-                        # print(f"{link}: {text_only_selenium}")
-
-                    except Exception as e:
-                        print(f"Error occurred while processing {link} in selenium: {e.with_traceback}")
-                        text_dict[link] = ""
-                    finally:
-                        if browser: browser.close()
-                else:
+                requests_words = len(text_only_requests.split())
+                extraction_method = 'requests'
+                if response.status_code == 200 and requests_words >= 50:
                     text_dict[link] = text_only_requests
+                    if strategy == REQUESTS_THEN_RENDER:
+                        render_strategies.record(domain, requests_words)
+                elif response.status_code == 200 and strategy == REQUESTS_ONLY:
+                    # Rendering rarely finds more on this website, so a thin page stays as it is
+                    text_dict[link] = text_only_requests
+                else:
+                    text_dict[link] = render_page_text(link)
+                    extraction_method = 'rendered'
+                    if strategy == REQUESTS_THEN_RENDER:
+                        render_strategies.record(domain, requests_words, len(text_dict[link].split()))
+            if page_info is not None:
+                page_info['extraction'] = extraction_method
+                page_info['byte_size'] = byte_size
 
     except requests.RequestException as e:
         print(f"Error occurred while processing {link}: {e}")
 
     return text_dict
 
+# Columns of a snapshot file besides 'key' and 'text', describing the scraped version of each page: its
+# sitemap <lastmod>, its HTTP validators, the hash of its text, when it was fetched, how its text was extracted
+# ('requests', 'rendered', 'pdf' or 'none') and the size of its body in bytes
+PAGE_STATE_COLUMNS = snapshots.SNAPSHOT_SCHEMA.names[2:]
+
+def content_hash(text):
+    """
+    Returns the hash of the extracted text of a page, used to tell whether it changed between snapshots.
+
+    Args:
+        text (str): The extracted text.
+
+    Returns:
+        str: The SHA-256 hex digest of the text.
+    """
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+def load_snapshot_pages(website_name, timestamp):
+    """
+    Loads the pages of a previous snapshot of a website, to compare a new scrape against.
+
+    The snapshot file is downloaded from the Google Cloud bucket and read a row group at a time: the Parquet
+    file, or the CSV file of a snapshot written before the Parquet format. Files written before incremental
+    scraping only have the 'key' and 'text' columns; their content hash is computed from the text and the
+    other page state columns are left empty.
+
+    Args:
+        website_name (str): The website address of the snapshot.
+        timestamp (str): The timestamp of the snapshot.
+
+    Returns:
+        dict: The pages keyed by URL, each a dictionary with 'text' and the PAGE_STATE_COLUMNS, or an empty
+              dictionary if the snapshot file can't be loaded.
+    """
+    pages = {}
+    # Snapshots are Parquet files since the columnar format, CSV files before
+    for extension in (snapshots.SNAPSHOT_EXTENSION, snapshots.LEGACY_SNAPSHOT_EXTENSION):
+        filename = snapshots.snapshot_filename(website_name, timestamp, extension)
+        if not download_blob_from_gcloud(filename):
+            continue
+        file_loc = f"/home/downloads/{filename}"
+        try:
+            for rows in snapshots.iter_snapshot_batches(file_loc, ['key', 'text'] + PAGE_STATE_COLUMNS):
+                for row in rows:
+                    page = {column: row.get(column) or None for column in PAGE_STATE_COLUMNS}
+                    page['text'] = row.get('text') or ''
+                    page['content_hash'] = page['content_hash'] or content_hash(page['text'])
+                    pages[row['key']] = page
+        except Exception as e:
+            print(f"Error while reading the snapshot {filename}", e)
+            return {}
+        finally:
+            cleanup_files(file_loc)
+        break
+    return pages
+
+def scrape_link_incremental(link, previous=None, lastmod=None):
+    """
+    Scrapes a page unless it is known to be unchanged since the previous snapshot.
+
+    The page is skipped without any request when its sitemap <lastmod> is the same as in the previous
+    snapshot. Otherwise it is fetched with a conditional GET using the previous validators, and skipped on a
+    304 Not Modified. A fetched page whose extracted text has the same hash as before is skipped as well.
+    Skipped pages keep the text of the previous snapshot and are carried forward instead of re-embedded.
+
+    Args:
+        link (str): The URL of the page.
+        previous (dict, optional): The page in the previous snapshot, as returned by load_snapshot_pages.
+        lastmod (str, optional): The <lastmod> of the page in the sitemap.
+
+    A page in the previous snapshot that can't be fetched this time is carried forward as well, rather than
+    dropped from the new snapshot.
+
+    Returns:
+        dict: The 'status' of the page ('new', 'changed' or 'skipped'), its 'text' and its PAGE_STATE_COLUMNS.
+
+    Raises:
+        KeyError: If a page that isn't in the previous snapshot couldn't be fetched, as scrape_link then
+                  returns no text for it.
+    """
+    if previous is not None and lastmod and previous.get('lastmod') == lastmod:
+        return {**previous, 'status': 'skipped'}
+
+    page_info = {'etag': previous.get('etag'), 'last_modified': previous.get('last_modified')} if previous else {}
+    text = scrape_link(link, page_info).get(link)
+    if text is None:
+        if previous is None:
+            raise KeyError(link)
+        print(f"Couldn't fetch {link}, keeping it from the previous snapshot")
+        return {**previous, 'status': 'skipped'}
+    if previous is not None and page_info.get('not_modified'):
+        return {**previous, 'lastmod': lastmod or previous.get('lastmod'), 'status': 'skipped'}
+
+    page = {
+        'text': text,
+        'lastmod': lastmod,
+        'etag': page_info.get('etag'),
+        'last_modified': page_info.get('last_modified'),
+        'content_hash': content_hash(text),
+        'fetched_at': datetime.now(timezone.utc),
+        'extraction': page_info.get('extraction'),
+        'byte_size': page_info.get('byte_size'),
+    }
+    if previous is None:
+        page['status'] = 'new'
+    elif previous.get('content_hash') == page['content_hash']:
+        page['status'] = 'skipped'
+    else:
+        page['status'] = 'changed'
+    return page
+
+def load_render_strategies():
+    """
+    Loads the rendering strategies learned for websites in earlier crawls from the Google Cloud bucket.
+
+    Returns:
+        bool: True if saved strategies were loaded, False if there are none or they couldn't be read.
+    """
+    try:
+        storage_client = storage.Client()
+        blob = storage_client.bucket(bucket_name).blob(RENDER_STRATEGIES_BLOB)
+        if not blob.exists():
+            return False
+        render_strategies.load(blob.download_as_text())
+        return True
+    except Exception as e:
+        print("Error while loading the rendering strategies", e)
+        return False
+
+def save_render_strategies():
+    """
+    Saves the rendering strategies learned so far to the Google Cloud bucket, if any changed.
+
+    Returns:
+        bool: True if the strategies were saved, False if nothing changed or they couldn't be written.
+    """
+    if not render_strategies.dirty:
+        return False
+    try:
+        storage_client = storage.Client()
+        blob = storage_client.bucket(bucket_name).blob(RENDER_STRATEGIES_BLOB)
+        blob.upload_from_string(render_strategies.save(), content_type='application/json')
+        return True
+    except Exception as e:
+        print("Error while saving the rendering strategies", e)
+        return False
+
 def save_to_gcloud(df, filename):
     """
-    Saves a pandas DataFrame to Google Cloud Storage as a CSV file.
+    Saves a pandas DataFrame to Google Cloud Storage as a Parquet snapshot or a CSV file.
 
     This function attempts to save the provided DataFrame to a specified bucket in Google Cloud Storage.
-    It converts the DataFrame into CSV format and uploads it using the given filename. The function
+    It converts the DataFrame into a Parquet snapshot when the filename ends with SNAPSHOT_EXTENSION, into
+    CSV format otherwise, and uploads it using the given filename. The function
     returns a boolean flag indicating the success or failure of the operation.
 
     Args:
@@ -491,9 +885,39 @@ def save_to_gcloud(df, filename):
         storage_client = storage.Client()
         bucket = storage_client.bucket(bucket_name)
         if bucket:
-            csv_data = df.to_csv(index=False)
             blob = bucket.blob(f'data/{filename}')
-            blob.upload_from_string(csv_data, content_type='text/csv')
+            if filename.endswith(snapshots.SNAPSHOT_EXTENSION):
+                buffer = io.BytesIO()
+                snapshots.write_snapshot(df, buffer)
+                blob.upload_from_string(buffer.getvalue(), content_type='application/vnd.apache.parquet')
+            else:
+                csv_data = df.to_csv(index=False)
+                blob.upload_from_string(csv_data, content_type='text/csv')
+            flag = True
+    except Exception as e:
+        print(f"Could not write to gcp bucket. {e}")
+
+    return flag
+
+def save_file_to_gcloud(path, filename, content_type='text/csv'):
+    """
+    Uploads a local file to the data folder of the Google Cloud Storage bucket.
+
+    Args:
+       path (str): The path of the local file.
+       filename (str): The name of the file in the storage bucket.
+       content_type (str): The content type of the file.
+
+    Returns:
+       bool: True if the file is successfully uploaded, False otherwise.
+    """
+    flag = False
+    try:
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+        if bucket:
+            blob = bucket.blob(f'data/{filename}')
+            blob.upload_from_filename(path, content_type=content_type)
             flag = True
     except Exception as e:
         print(f"Could not write to gcp bucket. {e}")
@@ -539,84 +963,279 @@ def download_blob_from_gcloud(filename):
 
 
 # Write to weaviate part
-def store_to_weaviate(filename):
-    """
-    Stores documents into a Weaviate vector store and yields progress updates.
 
-    This function reads a CSV file specified by the filename, extracts documents, and stores them
-    into a Weaviate vector store. It uses the filename to extract metadata (websiteAddress and timestamp)
-    for each document. The function yields updates on the number of documents inserted into the vector store.
+# Current Weaviate IP
+INGEST_WEAVIATE_IP_ADDRESS = "34.42.138.162"
+
+# Batching of the ingestion: the texts per embedding request and the embedding requests sent at once, then the
+# objects per Weaviate batch request and the batch requests sent at once
+INGEST_EMBED_BATCH_SIZE = int(os.environ.get("INGEST_EMBED_BATCH_SIZE", 100))
+INGEST_EMBED_WORKERS = int(os.environ.get("INGEST_EMBED_WORKERS", 4))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 100))
+INGEST_BATCH_WORKERS = int(os.environ.get("INGEST_BATCH_WORKERS", 2))
+# The capacity of the queues between the stages of the ingestion pipeline of /scrape_sitemap, and the idle time
+# after which partial batches are sent, so pages become queryable while the crawl is still going
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 8))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 2.0))
+# Unchanged pages are carried forward CARRY_FORWARD_PAGES_PER_QUERY pages per query, their chunks read
+# CARRY_FORWARD_PAGE_SIZE at a time. Weaviate caps the results of a query, offset included, at its
+# QUERY_MAXIMUM_RESULTS setting, mirrored by WEAVIATE_QUERY_MAXIMUM_RESULTS.
+CARRY_FORWARD_PAGES_PER_QUERY = int(os.environ.get("CARRY_FORWARD_PAGES_PER_QUERY", 50))
+CARRY_FORWARD_PAGE_SIZE = int(os.environ.get("CARRY_FORWARD_PAGE_SIZE", 500))
+WEAVIATE_QUERY_MAXIMUM_RESULTS = int(os.environ.get("WEAVIATE_QUERY_MAXIMUM_RESULTS", 10000))
+
+def build_batch_ingestor(client):
+    """
+    Builds a BatchIngestor writing to the 'Pages' class of the Weaviate vector store.
 
     Args:
-       filename (str): The name of the CSV file containing documents to be stored.
+        client: A Weaviate client instance used to write to the vector store.
 
-    Yields:
-       str: Progress updates on the number of documents inserted into the vector store.
+    Returns:
+        BatchIngestor: An ingestor using the INGEST_* batch settings.
+    """
+    # Update index with llamaindex
+    vector_store = WeaviateVectorStore(
+        weaviate_client=client,
+        index_name="Pages",
+        text_key="text"
+    )
+    index = VectorStoreIndex.from_vector_store(
+        vector_store=vector_store,
+        service_context=None
+    )
+    return BatchIngestor(client, index,
+                         embed_batch_size=INGEST_EMBED_BATCH_SIZE, embed_workers=INGEST_EMBED_WORKERS,
+                         batch_size=INGEST_BATCH_SIZE, batch_workers=INGEST_BATCH_WORKERS)
 
-    Raises:
-       Exception: Catches any exceptions that occur during the process and prints an error message.
+def build_ingestion_pipeline():
+    """
+    Builds and starts an IngestionPipeline, for ingesting the pages of a website while it is being scraped.
 
-    Note:
-       The function expects the Weaviate instance to be accessible at the given IP address and the
-       OpenAI API key to be set as an environment variable.
+    Returns:
+        IngestionPipeline: A started pipeline with INGEST_QUEUE_SIZE batches per queue.
     """
-    success = False
+    client = weaviate.Client(url="http://" + INGEST_WEAVIATE_IP_ADDRESS + ":8080")
+    pipeline = IngestionPipeline(build_batch_ingestor(client), queue_size=INGEST_QUEUE_SIZE,
+                                 flush_interval=INGEST_FLUSH_INTERVAL)
+    pipeline.start()
+    return pipeline
 
-    # Retrieve the OpenAI API key from the environment variables
-    OPENAI_APIKEY = os.getenv("OPENAI_APIKEY")
-    print(OPENAI_APIKEY)
+def make_document(key, text, websiteAddress, timestamp):
+    """
+    Makes the llama_index Document of a scraped page.
 
-    # Set the OpenAI key as an Environment Variable (for when it's run on GCS)
-    os.environ["OPENAI_APIKEY"] = OPENAI_APIKEY
-    print("Ending at OPENAI key part")
-    # Current Weaviate IP
-    WEAVIATE_IP_ADDRESS = "34.42.138.162"
+    Args:
+        key (str): The URL of the page, used as the id of the document.
+        text (str): The text of the page.
+        websiteAddress (str): The website address of the snapshot.
+        timestamp (str): The timestamp of the snapshot.
 
-    print("Starting to insert into Weaviate")
+    Returns:
+        Document: The document, with the websiteAddress and timestamp as metadata.
+    """
+    document = Document (
+        text = text or "",
+        metadata={
+            'websiteAddress': websiteAddress,
+            'timestamp': timestamp
+        }
+    )
+    document.doc_id = key
+    return document
+
+def store_to_weaviate(filename, keys=None):
+    """
+    Stores the documents of a snapshot file into a Weaviate vector store and yields progress updates.
+
+    This function reads the snapshot file specified by the filename from /home/downloads, Parquet or CSV, a
+    row group at a time, and streams its pages into an ingestion pipeline (see build_ingestion_pipeline), so
+    the file is never loaded whole. It uses the filename to extract metadata (websiteAddress and timestamp)
+    for each document.
+
+    Args:
+       filename (str): The name of the snapshot file containing documents to be stored.
+       keys (set, optional): The pages (keys) to insert. Defaults to all the pages of the file.
+
+    Yields:
+       str: Progress updates on the number of documents inserted into the vector store, then the outcome of
+            the ingestion (see describe_ingestion_result).
+
+    Raises:
+       Exception: Catches any exceptions that occur during the process, prints an error message and reports
+                  the failure.
+    """
+    file_loc = f"/home/downloads/{filename}"
     try:
-        client = weaviate.Client(url="http://" + WEAVIATE_IP_ADDRESS + ":8080")
         websiteAddress, timestamp = filename.rsplit('.', 1)[0].split('_')
-        print(websiteAddress, timestamp)
-        file_loc = f"/home/downloads/{filename}"
-        df = pd.read_csv(file_loc)
-
-        documents = []
-        for _, row in df.iterrows():
-            document = Document (
-                text = row['text'],
-                metadata={
-                    'websiteAddress': websiteAddress,
-                    'timestamp': timestamp
-                }
-            )
-            document.doc_id = row['key']
-            documents.append(document)
-
-        index_count = 0
-        total_documents = len(documents)
-
-        # Update index with llamaindex
-        vector_store = WeaviateVectorStore(
-            weaviate_client=client,
-            index_name="Pages",
-            text_key="text"
-        )
-        index = VectorStoreIndex.from_vector_store(
-            vector_store=vector_store,
-            service_context=None
-        )
-        for document in documents:
-            index.insert(document)
-            index_count += 1
-            # Yield progress update
-            yield f"Inserted {index_count} of {total_documents} documents into vector store.\n"
-
+        pipeline = build_ingestion_pipeline()
+        try:
+            for rows in snapshots.iter_snapshot_batches(file_loc, ['key', 'text']):
+                for row in rows:
+                    if keys is None or row['key'] in keys:
+                        pipeline.put(make_document(row['key'], row['text'], websiteAddress, timestamp))
+                yield f"Inserted {pipeline.inserted} of {pipeline.documents} documents into vector store.\n"
+            while not pipeline.finish(timeout=5):
+                yield f"Inserted {pipeline.inserted} of {pipeline.documents} documents into vector store.\n"
+            yield f"Inserted {pipeline.inserted} of {pipeline.documents} documents into vector store.\n"
+        finally:
+            pipeline.stop(timeout=0)
         cleanup_files(file_loc)
-
+        yield describe_ingestion_result(pipeline)
     except Exception as e:
         print("Error with storing to vector store method",e)
+        yield f"Failed to insert the documents into vector store: {extract_error_message_from_exception(e)}\n"
+
+def describe_ingestion_result(pipeline):
+    """
+    Describes the outcome of a finished ingestion for the progress stream.
+
+    Args:
+        pipeline (IngestionPipeline): The finished pipeline.
+
+    Returns:
+        str: A success line if every document was inserted, or the documents that failed and the chunks the
+             vector store refused.
+    """
+    if not pipeline.failed and not pipeline.refused:
+        return "All documents inserted successfully.\n"
+    return (f"Partially inserted: {pipeline.failed} of {pipeline.documents} documents failed and "
+            f"{pipeline.refused} chunks were refused by the vector store.\n")
+
+def delete_snapshot_objects(website_name, timestamp):
+    """
+    Deletes the vector store objects of a snapshot, when its ingestion was abandoned or left it incomplete.
+
+    Weaviate deletes at most its QUERY_MAXIMUM_RESULTS objects per request, so the request is repeated until
+    no object is left.
+
+    Args:
+        website_name (str): The website address of the snapshot.
+        timestamp (str): The timestamp of the snapshot.
+
+    Returns:
+        int: The number of objects deleted.
 
-    yield "All documents inserted successfully.\n"
+    Raises:
+        Exception: Any error deleting from Weaviate.
+    """
+    client = weaviate.Client(url="http://" + INGEST_WEAVIATE_IP_ADDRESS + ":8080")
+    where = {"operator": "And", "operands": [
+        {"path": ["websiteAddress"], "operator": "Equal", "valueString": website_name},
+        {"path": ["timestamp"], "operator": "Equal", "valueString": timestamp},
+    ]}
+    deleted = 0
+    while True:
+        results = client.batch.delete_objects("Pages", where=where)['results']
+        deleted += results['successful']
+        if results['matches'] < results['limit'] or not results['successful']:
+            return deleted
+
+def _snapshot_chunks(client, properties, snapshot_filter, keys):
+    """
+    Reads the chunks of some pages of a snapshot from Weaviate, with their vectors, a page of results at a time.
+
+    The results of one query are capped at WEAVIATE_QUERY_MAXIMUM_RESULTS, offset included, so a group of
+    pages with more chunks than that is counted first and split in two, rather than read truncated.
+
+    Args:
+        client (weaviate.Client): The Weaviate client.
+        properties (list): The properties of the Pages class to read.
+        snapshot_filter (list): The where operands selecting the snapshot.
+        keys (list): The pages (keys) whose chunks are read.
+
+    Yields:
+        dict: The chunks, with their vector under '_additional'.
+    """
+    page_filter = [{"path": ["ref_doc_id"], "operator": "Equal", "valueString": key} for key in keys]
+    if len(page_filter) > 1:
+        page_filter = [{"operator": "Or", "operands": page_filter}]
+    where = {"operator": "And", "operands": snapshot_filter + page_filter}
+
+    response = client.query.aggregate("Pages").with_where(where).with_meta_count().do()
+    count = response['data']['Aggregate']['Pages'][0]['meta']['count']
+    if count > WEAVIATE_QUERY_MAXIMUM_RESULTS and len(keys) > 1:
+        middle = len(keys) // 2
+        yield from _snapshot_chunks(client, properties, snapshot_filter, keys[:middle])
+        yield from _snapshot_chunks(client, properties, snapshot_filter, keys[middle:])
+        return
+
+    for offset in range(0, count, CARRY_FORWARD_PAGE_SIZE):
+        response = client.query.get("Pages", properties) \
+            .with_additional(["vector"]) \
+            .with_where(where) \
+            .with_sort({"path": ["_id"], "order": "asc"}) \
+            .with_limit(CARRY_FORWARD_PAGE_SIZE) \
+            .with_offset(offset) \
+            .do()
+        if 'errors' in response:
+            raise RuntimeError(f"Error reading the chunks of the snapshot: {response['errors']}")
+        yield from response['data']['Get']['Pages']
+
+def carry_forward_pages(website_name, previous_timestamp, timestamp, keys):
+    """
+    Copies the vector store objects of unchanged pages from a previous snapshot into a new one.
+
+    The chunks of the pages are read from Weaviate with their vectors and written back with the new
+    timestamp, so the new snapshot is complete without fetching or embedding them again. The copies get new
+    ids, and the node metadata stored with them is updated to the new timestamp. The function yields
+    progress updates.
+
+    Args:
+        website_name (str): The website address of the snapshots.
+        previous_timestamp (str): The timestamp of the snapshot the pages are copied from.
+        timestamp (str): The timestamp of the new snapshot.
+        keys (set): The pages (keys) to carry forward.
+
+    Yields:
+        str: Progress updates on the number of pages carried forward.
+
+    Raises:
+        RuntimeError: If Weaviate refused some of the copies, in which case the new snapshot is incomplete.
+        Exception: Any error reading from or writing to Weaviate, which the caller reports.
+    """
+    if not keys:
+        return
+    client = weaviate.Client(url="http://" + INGEST_WEAVIATE_IP_ADDRESS + ":8080")
+    properties = [prop['name'] for prop in client.schema.get("Pages")['properties']]
+    snapshot_filter = [
+        {"path": ["websiteAddress"], "operator": "Equal", "valueString": website_name},
+        {"path": ["timestamp"], "operator": "Equal", "valueString": previous_timestamp},
+    ]
+
+    # The batch API doesn't raise the objects Weaviate refused, they are only in the results
+    failed = []
+
+    def check_results(results):
+        for result in results or []:
+            errors = result.get('result', {}).get('errors')
+            if errors:
+                failed.append(result.get('id'))
+                print(f"Error carrying {result.get('id')} forward in the vector store: {errors}")
+
+    copied_pages = set()
+    copied_chunks = 0
+    keys = sorted(keys)
+    with client.batch(batch_size=100, callback=check_results) as batch:
+        for start in range(0, len(keys), CARRY_FORWARD_PAGES_PER_QUERY):
+            for obj in _snapshot_chunks(client, properties, snapshot_filter,
+                                        keys[start:start + CARRY_FORWARD_PAGES_PER_QUERY]):
+                additional = obj.pop('_additional')
+                new_id = str(uuid.uuid4())
+                obj['timestamp'] = timestamp
+                if obj.get('_node_content'):
+                    node_content = json.loads(obj['_node_content'])
+                    node_content['id_'] = new_id
+                    node_content.setdefault('metadata', {})['timestamp'] = timestamp
+                    obj['_node_content'] = json.dumps(node_content)
+                batch.add_data_object(obj, "Pages", uuid=new_id, vector=additional['vector'])
+                copied_pages.add(obj.get('ref_doc_id'))
+                copied_chunks += 1
+            yield f"Carried forward {len(copied_pages)} of {len(keys)} unchanged pages.\n"
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {copied_chunks} chunks couldn't be carried forward")
+    yield f"Carried forward {len(copied_pages)} unchanged pages ({copied_chunks} chunks) without re-embedding.\n"
 
 def cleanup_files(filewithpath):
     """
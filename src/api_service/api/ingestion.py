@@ -0,0 +1,488 @@
+import queue
+import threading
+import time
+
+from llama_index.schema import MetadataMode
+from llama_index.vector_stores.weaviate_utils import add_node
+
+
+class BatchIngestor:
+    """
+    A class for inserting documents into the vector store in batches instead of one by one.
+
+    `index.insert(document)` chunks, embeds and writes each document on its own, so a website costs one
+    embedding request and one Weaviate write per page, one after the other. This class holds the settings an
+    IngestionPipeline batches with: the chunks are sent to the embedding model in batches of
+    `embed_batch_size` texts with up to `embed_workers` requests in flight, and written through Weaviate's
+    batch API. The objects written are the same as `index.insert` writes.
+
+    Attributes:
+        _client (weaviate.Client): The Weaviate client the objects are written with.
+        _index (VectorStoreIndex): The index, providing the node parser and the embedding model.
+        _class_name (str): The Weaviate class the objects are written to.
+        _text_key (str): The property holding the text of the chunks.
+        _embed_batch_size (int): The number of texts per embedding request.
+        _embed_workers (int): The number of embedding requests sent concurrently.
+        _batch_size (int): The number of objects per Weaviate batch request.
+        _batch_workers (int): The number of Weaviate batch requests sent concurrently.
+        _lock (threading.Lock): A lock protecting the error counter, updated by the batch threads.
+        _failed (int): The number of objects Weaviate refused.
+    """
+
+    def __init__(self, client, index, class_name: str = "Pages", text_key: str = "text",
+                 embed_batch_size: int = 100, embed_workers: int = 4, batch_size: int = 100, batch_workers: int = 2):
+        """
+        Initializes the ingestor.
+
+        Args:
+            client (weaviate.Client): The Weaviate client the objects are written with.
+            index (VectorStoreIndex): The index on top of the Weaviate class, built with `from_vector_store`.
+            class_name (str): The Weaviate class the objects are written to.
+            text_key (str): The property holding the text of the chunks.
+            embed_batch_size (int): The number of texts per embedding request.
+            embed_workers (int): The number of embedding requests sent concurrently.
+            batch_size (int): The number of objects per Weaviate batch request.
+            batch_workers (int): The number of Weaviate batch requests sent concurrently.
+        """
+        self._client = client
+        self._index = index
+        self._class_name = class_name
+        self._text_key = text_key
+        self._embed_batch_size = embed_batch_size
+        self._embed_workers = embed_workers
+        self._batch_size = batch_size
+        self._batch_workers = batch_workers
+        self._lock = threading.Lock()
+        self._failed = 0
+
+    @property
+    def embed_batch_size(self) -> int:
+        """The number of texts per embedding request."""
+        return self._embed_batch_size
+
+    @property
+    def embed_workers(self) -> int:
+        """The number of embedding requests sent concurrently."""
+        return self._embed_workers
+
+    @property
+    def failed(self) -> int:
+        """The number of objects Weaviate refused."""
+        return self._failed
+
+    def chunk(self, document):
+        """
+        Splits a document into chunks with the node parser of the index.
+
+        Args:
+            document (Document): The llama_index Document.
+
+        Returns:
+            list: The chunks, as nodes whose ref_doc_id is the doc_id of the document.
+        """
+        return self._index.service_context.node_parser.get_nodes_from_documents([document])
+
+    def embed(self, nodes):
+        """Embeds a batch of nodes with a single request to the embedding model, and returns them."""
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = self._index.service_context.embed_model.get_text_embedding_batch(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        return nodes
+
+    def open_batch(self, on_results=None):
+        """
+        Opens a Weaviate batch to write embedded nodes to with `write`.
+
+        Args:
+            on_results (Callable, optional): A function called with the results of every batch request once
+                                             they were checked, each a dict with the 'id' of an object (the
+                                             node_id of its node) and its 'result', holding any 'errors'.
+
+        Returns:
+            weaviate.batch.Batch: The batch, a context manager sending the rest of the objects on exit. The
+                                  objects Weaviate refuses are counted in `failed`.
+        """
+        def callback(results):
+            self._check_results(results)
+            if on_results is not None:
+                on_results(results or [])
+
+        return self._client.batch(batch_size=self._batch_size, num_workers=self._batch_workers,
+                                  dynamic=False, callback=callback)
+
+    def write(self, batch, node):
+        """
+        Adds an embedded node to a batch opened with `open_batch`.
+
+        Args:
+            batch (weaviate.batch.Batch): The batch.
+            node (BaseNode): The node, with its embedding.
+        """
+        add_node(self._client, node, self._class_name, batch, text_key=self._text_key)
+
+    def _check_results(self, results):
+        """Counts and prints the objects of a Weaviate batch that failed, which the batch API doesn't raise."""
+        for result in results or []:
+            errors = result.get('result', {}).get('errors')
+            if errors:
+                with self._lock:
+                    self._failed += 1
+                print(f"Error writing {result.get('id')} to the vector store: {errors}")
+
+
+# Marks the end of the items of a pipeline queue
+_END = object()
+
+
+class StageStats:
+    """
+    The counters of one stage of an IngestionPipeline.
+
+    Attributes:
+        queue (queue.Queue): The bounded queue feeding the stage.
+        processed (int): The number of items the stage processed, documents for the chunk stage and chunks
+                         for the others.
+        failed (int): The number of documents the stage failed on, which are left out of the vector store.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+
+
+class IngestionPipeline:
+    """
+    A class for ingesting documents while they are still being scraped, in concurrent stages.
+
+    Documents are put into the pipeline one by one, and go through three stages connected by bounded queues:
+        - chunk: a thread splitting the documents into chunks with the node parser of the index, and grouping
+          the chunks into batches of `embed_batch_size`;
+        - embed: `embed_workers` threads sending the batches to the embedding model;
+        - insert: a thread writing the embedded chunks through Weaviate's batch API.
+    When a queue is full, the stage before it waits, up to the caller of `put`, so a site of any size only
+    holds a few batches in memory and the scraper slows down to the pace of the embedding. Partial batches
+    are sent after `flush_interval` seconds without new documents, so the pages of a slow crawl become
+    queryable as they are scraped rather than at the end. `stop` ends the stages without waiting for the
+    documents still queued, and unblocks a caller waiting in `put`.
+
+    A document counts as inserted only once Weaviate confirmed all its chunks written, in the results of the
+    batch requests, so it is queryable by then. A document whose chunking, embedding or writing fails, or one
+    of whose chunks Weaviate refused, counts as failed in the stage it failed in; chunks of it in other
+    batches may still be written. A document put again with the same doc_id is ignored.
+
+    Attributes:
+        _ingestor (BatchIngestor): The ingestor chunking, embedding and writing the documents.
+        _flush_interval (float): The idle time after which partial batches are sent, in seconds.
+        _stages (dict): The StageStats of the chunk, embed and insert stages.
+        _remaining (dict): The number of chunks of each document not confirmed written yet.
+        _pending (dict): The doc_id of each chunk handed to the Weaviate batch and not confirmed yet, by node_id.
+        _seen (set): The doc_ids of the documents put into the pipeline.
+        _lock (threading.Lock): A lock protecting the counters, updated by the stage threads.
+        _threads (list): The threads of the stages.
+        _started (float): The time the pipeline was started at, for the throughputs.
+        _closed (bool): Whether the end of the documents was signalled to the chunk stage.
+        _stopped (threading.Event): Set by `stop`, for the stages to end without emptying their queues.
+        documents (int): The number of documents put into the pipeline.
+        inserted (int): The number of documents whose chunks Weaviate all confirmed written.
+    """
+
+    def __init__(self, ingestor: BatchIngestor, queue_size: int = 8, flush_interval: float = 2.0):
+        """
+        Initializes a pipeline, started with `start`.
+
+        Args:
+            ingestor (BatchIngestor): The ingestor chunking, embedding and writing the documents.
+            queue_size (int): The capacity of each queue, in documents for the chunk stage and in batches of
+                              chunks for the others.
+            flush_interval (float): The idle time after which partial batches are sent, in seconds.
+        """
+        self._ingestor = ingestor
+        self._flush_interval = flush_interval
+        self._stages = {name: StageStats(queue_size) for name in ("chunk", "embed", "insert")}
+        self._remaining = {}
+        self._pending = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = None
+        self._closed = False
+        self._stopped = threading.Event()
+        self.documents = 0
+        self.inserted = 0
+
+    def start(self):
+        """Starts the threads of the stages."""
+        self._started = time.perf_counter()
+        self._threads = [threading.Thread(target=self._chunk, name="ingest-chunk", daemon=True)]
+        self._threads += [threading.Thread(target=self._embed, name=f"ingest-embed-{i}", daemon=True)
+                          for i in range(self._ingestor.embed_workers)]
+        self._threads.append(threading.Thread(target=self._insert, name="ingest-insert", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, document) -> bool:
+        """
+        Adds a document to the pipeline, waiting while the chunk queue is full.
+
+        Args:
+            document (Document): The llama_index Document, with its doc_id set to its key.
+
+        Returns:
+            bool: Whether the document was added, False if it was already put or the pipeline was stopped.
+        """
+        with self._lock:
+            if document.doc_id in self._seen:
+                print(f"Ignoring {document.doc_id}, already put into the pipeline")
+                return False
+            self._seen.add(document.doc_id)
+            self.documents += 1
+        return self._put(self._stages["chunk"].queue, document)
+
+    def finish(self, timeout: float = None) -> bool:
+        """
+        Closes the pipeline to new documents and waits for the stages to write everything.
+
+        It can be called again after a timeout, to keep reporting the progress while waiting.
+
+        Args:
+            timeout (float, optional): The maximum time to wait, in seconds. Defaults to waiting until the end.
+
+        Returns:
+            bool: Whether all the stages are done.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        if not self._closed:
+            # The chunk queue may be full: the end is signalled by a later call if it doesn't fit in time
+            try:
+                if deadline is None:
+                    self._closed = self._put(self._stages["chunk"].queue, _END)
+                else:
+                    self._stages["chunk"].queue.put(_END, timeout=timeout)
+                    self._closed = True
+            except queue.Full:
+                return False
+        return self._join(deadline)
+
+    def stop(self, timeout: float = None) -> bool:
+        """
+        Stops the stages without waiting for the documents still queued, when the ingestion is abandoned.
+
+        The chunks already handed to the Weaviate batch are still sent as the insert stage ends.
+
+        Args:
+            timeout (float, optional): The maximum time to wait for the stages to end, in seconds. Defaults to
+                                       waiting until they do.
+
+        Returns:
+            bool: Whether all the stages ended.
+        """
+        self._stopped.set()
+        return self._join(None if timeout is None else time.perf_counter() + timeout)
+
+    def _join(self, deadline: float = None) -> bool:
+        """Waits for the stages until a time.perf_counter deadline, and returns whether they all ended."""
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.perf_counter()))
+            if thread.is_alive():
+                return False
+        return True
+
+    def _put(self, stage_queue: queue.Queue, item) -> bool:
+        """Puts an item into a queue, waiting while it is full unless stopped. Returns whether it was put."""
+        while not self._stopped.is_set():
+            try:
+                stage_queue.put(item, timeout=self._flush_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _chunk(self):
+        """The chunk stage: splits the documents into chunks and groups them into embedding batches."""
+        batch_size = self._ingestor.embed_batch_size
+        stage = self._stages["chunk"]
+        pending = []
+        while not self._stopped.is_set():
+            try:
+                document = stage.queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                # No new document for a while: send what is pending, so it becomes queryable
+                if pending:
+                    self._put(self._stages["embed"].queue, pending)
+                    pending = []
+                continue
+            if document is _END:
+                break
+            try:
+                nodes = self._ingestor.chunk(document)
+            except Exception as e:
+                print(f"Error chunking {document.doc_id}: {e}")
+                with self._lock:
+                    stage.failed += 1
+                continue
+            with self._lock:
+                stage.processed += 1
+                if nodes:
+                    self._remaining[document.doc_id] = len(nodes)
+                else:
+                    # Nothing to embed in a page without text
+                    self.inserted += 1
+            pending.extend(nodes)
+            while len(pending) >= batch_size:
+                self._put(self._stages["embed"].queue, pending[:batch_size])
+                pending = pending[batch_size:]
+        if pending:
+            self._put(self._stages["embed"].queue, pending)
+        for _ in range(self._ingestor.embed_workers):
+            self._put(self._stages["embed"].queue, _END)
+
+    def _embed(self):
+        """The embed stage: sends batches of chunks to the embedding model."""
+        stage = self._stages["embed"]
+        while not self._stopped.is_set():
+            try:
+                nodes = stage.queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                continue
+            if nodes is _END:
+                self._put(self._stages["insert"].queue, _END)
+                return
+            try:
+                self._put(self._stages["insert"].queue, self._ingestor.embed(nodes))
+            except Exception as e:
+                print(f"Error embedding {len(nodes)} chunks: {e}")
+                self._lost(stage, [node.ref_doc_id for node in nodes])
+                continue
+            with self._lock:
+                stage.processed += len(nodes)
+
+    def _insert(self):
+        """The insert stage: writes the embedded chunks through Weaviate's batch API."""
+        ingestor = self._ingestor
+        stage = self._stages["insert"]
+        ends = 0
+        unflushed = False
+        nodes = []
+        try:
+            with ingestor.open_batch(on_results=self._confirm) as batch:
+                while ends < ingestor.embed_workers and not self._stopped.is_set():
+                    try:
+                        nodes = stage.queue.get(timeout=self._flush_interval)
+                    except queue.Empty:
+                        # Write what is pending rather than waiting for a full Weaviate batch
+                        if unflushed:
+                            batch.flush()
+                            unflushed = False
+                        continue
+                    if nodes is _END:
+                        ends += 1
+                        continue
+                    for node in nodes:
+                        with self._lock:
+                            self._pending[node.node_id] = node.ref_doc_id
+                        ingestor.write(batch, node)
+                    unflushed = True
+        except Exception as e:
+            print(f"Error writing to the vector store: {e}")
+            if nodes is not _END:
+                self._lost(stage, [node.ref_doc_id for node in nodes])
+            # Keep draining the queue, so the stages before this one and the scraper aren't blocked forever
+            while ends < ingestor.embed_workers and not self._stopped.is_set():
+                try:
+                    nodes = stage.queue.get(timeout=self._flush_interval)
+                except queue.Empty:
+                    continue
+                if nodes is _END:
+                    ends += 1
+                else:
+                    self._lost(stage, [node.ref_doc_id for node in nodes])
+        # The batch sent everything it could on exit: the chunks it never confirmed weren't written
+        with self._lock:
+            unconfirmed, self._pending = list(self._pending.values()), {}
+        self._lost(stage, unconfirmed)
+
+    def _confirm(self, results):
+        """
+        Counts the chunks of a Weaviate batch request written, and their documents once all their chunks are.
+
+        Args:
+            results (list): The results of the request, as passed to the batch callback.
+        """
+        stage = self._stages["insert"]
+        with self._lock:
+            for result in results:
+                doc_id = self._pending.pop(result.get('id'), None)
+                if doc_id is None:
+                    continue
+                stage.processed += 1
+                # A document that failed in another batch is no longer counted
+                if doc_id not in self._remaining:
+                    continue
+                if result.get('result', {}).get('errors'):
+                    del self._remaining[doc_id]
+                    stage.failed += 1
+                    continue
+                self._remaining[doc_id] -= 1
+                if self._remaining[doc_id] == 0:
+                    del self._remaining[doc_id]
+                    self.inserted += 1
+
+    def _lost(self, stage: StageStats, doc_ids):
+        """Counts the documents of chunks a stage failed on as failed in it, each document once."""
+        with self._lock:
+            for doc_id in doc_ids:
+                if self._remaining.pop(doc_id, None) is not None:
+                    stage.failed += 1
+
+    @property
+    def failed(self) -> int:
+        """The number of documents that failed in any stage."""
+        with self._lock:
+            return sum(stage.failed for stage in self._stages.values())
+
+    @property
+    def refused(self) -> int:
+        """The number of chunks Weaviate refused, whose documents count as failed in the insert stage."""
+        return self._ingestor.failed
+
+    def progress(self) -> dict:
+        """
+        Returns the progress of the stages.
+
+        Returns:
+            dict: For each stage, the items waiting in its queue, the items it processed, the documents it
+                  failed on and its throughput in items per second, plus the documents put into the pipeline,
+                  the documents Weaviate confirmed written and the chunks it refused.
+        """
+        elapsed = max(time.perf_counter() - self._started, 1e-9) if self._started else None
+        with self._lock:
+            stages = {
+                name: {
+                    "queued": stage.queue.qsize(),
+                    "processed": stage.processed,
+                    "failed": stage.failed,
+                    "per_second": round(stage.processed / elapsed, 1) if elapsed else 0.0,
+                }
+                for name, stage in self._stages.items()
+            }
+            return {"stages": stages, "documents": self.documents, "inserted": self.inserted,
+                    "refused": self._ingestor.failed}
+
+    def describe(self) -> str:
+        """
+        Describes the progress of the stages for the progress stream.
+
+        Returns:
+            str: The queue depth and throughput of each stage, the documents that failed in it if any, and the
+                 number of documents confirmed written.
+        """
+        progress = self.progress()
+        stages = ", ".join(f"{name} {stage['queued']} queued ({stage['per_second']}/s"
+                           + (f", {stage['failed']} failed" if stage['failed'] else "") + ")"
+                           for name, stage in progress["stages"].items())
+        description = f"Pipeline: {stages}; {progress['inserted']} of {progress['documents']} pages queryable"
+        if progress["refused"]:
+            description += f", {progress['refused']} chunks refused by the vector store"
+        return description
@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+
+# Fetch with requests, and render with Chrome only when the text is too short
+REQUESTS_THEN_RENDER = "requests_then_render"
+# Render every page with Chrome, without trying requests first
+RENDER_FIRST = "render_first"
+# Never render, keeping whatever text requests got
+REQUESTS_ONLY = "requests_only"
+
+
+class DomainObservations:
+    """
+    What the first pages of a domain showed about the need for rendering.
+
+    Attributes:
+        pages (int): The number of pages observed.
+        fallbacks (int): The number of pages whose requests text was too short, so they were rendered.
+        useful_renders (int): The number of renders that found substantially more text than requests.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.fallbacks = 0
+        self.useful_renders = 0
+
+
+class RenderStrategyLearner:
+    """
+    A class for learning, per domain, whether pages need to be rendered with Chrome.
+
+    Every domain starts with requests-then-render. Over its first `sample_size` pages, the learner records
+    how often the requests text was too short and whether rendering then found substantially more text.
+    It then commits to one strategy for the rest of the crawl:
+        - render-first, when most pages needed rendering and it helped, so pages don't pay for both attempts;
+        - requests-only, when pages were rendered but rendering rarely found more text, so thin pages don't
+          launch a browser;
+        - requests-then-render otherwise.
+    The decisions are saved with `save` and loaded with `load`, so later snapshots of the same website start
+    with the strategy learned before. A decision older than `max_age` seconds is dropped and learned again,
+    since websites change how they serve their pages.
+
+    Attributes:
+        _sample_size (int): The number of pages observed before committing to a strategy.
+        _render_first_rate (float): The minimum rate of useful renders for render-first.
+        _requests_only_rate (float): The maximum rate of useful renders among rendered pages for requests-only.
+        _max_age (float): The number of seconds a committed strategy is kept before it is learned again.
+        _observations (dict): The DomainObservations of the domains still being learned.
+        _strategies (dict): The committed strategy of each domain.
+        _learned_at (dict): The time each strategy was committed at, in seconds since the epoch.
+        _lock (threading.Lock): A lock protecting the observations, since pages are scraped concurrently.
+        _dirty (bool): Whether a strategy was committed since the last save.
+    """
+
+    def __init__(self, sample_size: int = 10, render_first_rate: float = 0.8, requests_only_rate: float = 0.1,
+                 max_age: float = 30 * 24 * 3600):
+        """
+        Initializes a learner without any decision.
+
+        Args:
+            sample_size (int): The number of pages observed before committing to a strategy.
+            render_first_rate (float): The minimum rate of useful renders for render-first.
+            requests_only_rate (float): The maximum rate of useful renders among rendered pages for requests-only.
+            max_age (float): The number of seconds a committed strategy is kept before it is learned again.
+        """
+        self._sample_size = sample_size
+        self._render_first_rate = render_first_rate
+        self._requests_only_rate = requests_only_rate
+        self._max_age = max_age
+        self._observations = {}
+        self._strategies = {}
+        self._learned_at = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def strategy_for(self, domain: str) -> str:
+        """
+        Returns the strategy to scrape a page of a domain with.
+
+        Args:
+            domain (str): The domain of the page.
+
+        Returns:
+            str: The committed strategy of the domain, or REQUESTS_THEN_RENDER while it is being learned.
+        """
+        with self._lock:
+            return self._committed(domain) or REQUESTS_THEN_RENDER
+
+    def is_committed(self, domain: str) -> bool:
+        """Returns whether a strategy was committed for a domain."""
+        with self._lock:
+            return self._committed(domain) is not None
+
+    def _committed(self, domain: str):
+        """
+        Returns the committed strategy of a domain, dropping it if it expired. The lock must be held.
+
+        Args:
+            domain (str): The domain.
+
+        Returns:
+            str: The strategy, or None if the domain has none or it is older than `max_age`, in which case
+                 the domain is learned again from its next pages.
+        """
+        strategy = self._strategies.get(domain)
+        if strategy is not None and time.time() - self._learned_at.get(domain, 0) > self._max_age:
+            print(f"Rendering strategy for {domain} expired, learning it again")
+            del self._strategies[domain]
+            self._learned_at.pop(domain, None)
+            self._observations.pop(domain, None)
+            return None
+        return strategy
+
+    def record(self, domain: str, requests_words: int, rendered_words: int = None):
+        """
+        Records how a page of a domain scraped with requests-then-render went.
+
+        Args:
+            domain (str): The domain of the page.
+            requests_words (int): The number of words requests got.
+            rendered_words (int, optional): The number of words rendering got, if the page was rendered.
+        """
+        with self._lock:
+            if self._committed(domain) is not None:
+                return
+            observations = self._observations.setdefault(domain, DomainObservations())
+            observations.pages += 1
+            if rendered_words is not None:
+                observations.fallbacks += 1
+                # Worth a browser only if it found a real page, not a few more words
+                if rendered_words >= max(50, 2 * requests_words):
+                    observations.useful_renders += 1
+            if observations.pages < self._sample_size:
+                return
+
+            # Render-first pays off when most pages need a browser; requests-only when the pages that were
+            # rendered rarely gained from it. Without any render there is no evidence against rendering.
+            if observations.useful_renders / observations.pages >= self._render_first_rate:
+                strategy = RENDER_FIRST
+            elif (observations.fallbacks > 0
+                  and observations.useful_renders / observations.fallbacks <= self._requests_only_rate):
+                strategy = REQUESTS_ONLY
+            else:
+                strategy = REQUESTS_THEN_RENDER
+            self._strategies[domain] = strategy
+            self._learned_at[domain] = time.time()
+            self._dirty = True
+            print(f"Rendering strategy for {domain}: {strategy} after {observations.pages} pages, "
+                  f"{observations.fallbacks} rendered, {observations.useful_renders} usefully")
+
+    def describe(self, domain: str) -> str:
+        """
+        Describes the strategy of a domain for the progress stream.
+
+        Args:
+            domain (str): The domain.
+
+        Returns:
+            str: The strategy and, if it was learned during this crawl, the observations behind it.
+        """
+        with self._lock:
+            strategy = self._strategies.get(domain, REQUESTS_THEN_RENDER)
+            observations = self._observations.get(domain)
+        description = strategy.replace("_", " ")
+        if observations is not None:
+            description += (f" ({observations.fallbacks} of {observations.pages} sampled pages needed rendering, "
+                            f"{observations.useful_renders} found more text)")
+        return description
+
+    def load(self, data: str):
+        """
+        Loads the strategies saved by `save`, on top of the ones committed so far.
+
+        Strategies saved without the time they were learned at, by earlier versions, are ignored so that
+        their domains are learned again.
+
+        Args:
+            data (str): The saved strategies, as JSON.
+        """
+        saved = json.loads(data)
+        with self._lock:
+            for domain, entry in saved.items():
+                if isinstance(entry, dict) and "strategy" in entry:
+                    self._strategies[domain] = entry["strategy"]
+                    self._learned_at[domain] = entry.get("learned_at", 0)
+
+    def save(self) -> str:
+        """
+        Returns the committed strategies for persisting them, and marks them as saved.
+
+        Returns:
+            str: The strategy of each domain and the time it was learned at, keyed by domain, as JSON.
+        """
+        with self._lock:
+            self._dirty = False
+            saved = {domain: {"strategy": strategy, "learned_at": self._learned_at.get(domain, 0)}
+                     for domain, strategy in self._strategies.items()}
+            return json.dumps(saved, indent=2, sort_keys=True)
+
+    @property
+    def dirty(self) -> bool:
+        """Whether a strategy was committed since the last save."""
+        return self._dirty
+
+    def stats(self) -> dict:
+        """
+        Returns the strategies of the learner.
+
+        Returns:
+            dict: The committed strategy of each domain and the number of domains still being learned.
+        """
+        with self._lock:
+            return {
+                "strategies": dict(self._strategies),
+                "learning": len([domain for domain in self._observations if domain not in self._strategies]),
+            }
@@ -1,18 +1,27 @@
 # You need to have the OPENAI_APIKEY environment variable set for this.
 # As well, ml-workflow.ml has to be placed in the /secrets folder of the repo
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, File, Query
+from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, Query
 from fastapi.responses import StreamingResponse, JSONResponse
 from starlette.middleware.cors import CORSMiddleware
-import pandas as pd
 from datetime import datetime
 import os
-from typing import Dict, List
-from api import helper, dummy
-from typing import List
+from typing import Callable, Dict, List
+from api import helper, dummy, snapshots
+from api.scraping import ConcurrentScraper
+import requests
+from lxml import etree
+from urllib.parse import urlparse
 import asyncio 
-from asyncio import Lock
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import weaviate
 import uuid
+import time
+import json
+import math
+import re
+import tempfile
 from google.cloud import aiplatform
 from google.auth import exceptions
 from google.oauth2 import service_account
@@ -22,15 +31,21 @@ warnings.simplefilter(action='ignore', category=Warning)
 
 class FinancialStatus:
     """
-    A class to encapsulate and manage the financial status.
+    A class to encapsulate and manage the financial status of a single query.
+
+    Besides the flag, it strips the financial marker ("QQ") from the streamed text segments. The marker
+    may be split across two segments, so a trailing "Q" is held back until the next segment shows
+    whether it starts a marker.
 
     Attributes:
         _is_financial (bool): A flag indicating whether the financial status is set.
+        _held_back (str): The trailing text of the last segment that may be the start of a marker.
     """
 
     def __init__(self):
         """Initializes the financial status to False by default."""
         self._is_financial = False
+        self._held_back = ""
 
     def set_financial(self, status: bool):
         """
@@ -50,25 +65,90 @@ class FinancialStatus:
         """
         return self._is_financial
 
+    def strip_marker(self, text: str) -> str:
+        """
+        Removes the financial marker from a streamed text segment, setting the flag if it is found.
+
+        Args:
+            text (str): The next text segment of the stream.
+
+        Returns:
+            str: The text that can be sent, without the marker. A trailing "Q" is held back until
+                 the next call, or `flush`.
+        """
+        text = self._held_back + text
+        self._held_back = ""
+        if "QQ" in text:
+            self.set_financial(True)
+            text = text.replace("QQ", "")
+        if text.endswith("Q"):
+            self._held_back = "Q"
+            text = text[:-1]
+        return text
+
+    def flush(self) -> str:
+        """
+        Returns the text held back at the end of the stream.
+
+        Returns:
+            str: The held back text, which turned out not to be a marker.
+        """
+        text, self._held_back = self._held_back, ""
+        return text
+
 class QueryStorage:
     """
     A class for storing and retrieving queries in a thread-safe manner.
 
+    Entries expire after a time-to-live and the storage never holds more than a maximum number of
+    entries, evicting the oldest first, so results that are never retrieved don't accumulate. A query
+    can be registered as pending when it starts, which lets a caller wait for its result instead of polling.
+
     Attributes:
-        _storage (dict): A dictionary storing the queries with their IDs as keys.
-        _lock (Lock): An asyncio lock to ensure thread-safe access to the storage.
+        _storage (OrderedDict): The stored queries keyed by ID, as (financial, urls, expires_at) tuples, oldest first.
+        _pending (OrderedDict): The asyncio events of queries whose results are not stored yet, as (event, expires_at)
+                                tuples keyed by ID, oldest first.
+        _max_size (int): The maximum number of stored queries, and of pending queries.
+        _ttl (float): The number of seconds a query stays retrievable, or pending.
+        _lock (asyncio.Lock): An asyncio lock to ensure thread-safe access to the storage.
     """
 
-    def __init__(self):
-        """Initializes an empty storage for queries and an asyncio lock for synchronization."""
-        self._storage = {}
-        self._lock = Lock()
+    def __init__(self, max_size: int = 10000, ttl: float = 600):
+        """
+        Initializes an empty storage for queries and an asyncio lock for synchronization.
+
+        Args:
+            max_size (int): The maximum number of stored queries, and of pending queries.
+            ttl (float): The number of seconds after which an entry expires.
+        """
+        self._storage = OrderedDict()
+        self._pending = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = asyncio.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+    async def register_query(self, query_id: str):
+        """
+        Registers a query whose results will be stored later, so callers can wait for them.
+
+        Args:
+            query_id (str): The unique identifier for the query.
+        """
+        async with self._lock:
+            self._pending[query_id] = (asyncio.Event(), time.monotonic() + self._ttl)
+            while len(self._pending) > self._max_size:
+                _, (event, _) = self._pending.popitem(last=False)
+                event.set()
+                self._evictions += 1
 
     async def store_query(self, query_id: str, financial: bool, urls: List[str]):
         """
         Stores a query with its associated financial status and URLs in the storage.
 
         This method is thread-safe and uses an asyncio lock to protect the access to the storage.
+        Callers waiting for the query are woken up.
         
         Args:
             query_id (str): The unique identifier for the query.
@@ -76,23 +156,866 @@ class QueryStorage:
             urls (List[str]): A list of URLs associated with the query.
         """
         async with self._lock:
-            self._storage[query_id] = (financial, urls)
+            self._storage[query_id] = (financial, urls, time.monotonic() + self._ttl)
+            self._storage.move_to_end(query_id)
+            while len(self._storage) > self._max_size:
+                self._storage.popitem(last=False)
+                self._evictions += 1
+            pending = self._pending.pop(query_id, None)
+        if pending:
+            pending[0].set()
+
+    async def discard_query(self, query_id: str):
+        """
+        Drops a pending query whose results will never be stored, waking up its waiters.
 
-    async def retrieve_query(self, query_id: str) -> tuple:
+        Args:
+            query_id (str): The unique identifier for the query.
+        """
+        async with self._lock:
+            pending = self._pending.pop(query_id, None)
+        if pending:
+            pending[0].set()
+
+    async def retrieve_query(self, query_id: str, timeout: float = 0) -> tuple:
         """
         Retrieves and deletes a query from the storage.
 
         This method safely pops the query information based on the query ID, if it exists,
-        and returns the financial status and associated URLs. Otherwise, returns (None, None).
+        and returns the financial status and associated URLs. If the query is still pending, it
+        waits up to `timeout` seconds for its results to be stored. Otherwise, returns (None, None).
         
         Args:
             query_id (str): The unique identifier for the query to be retrieved.
+            timeout (float): The maximum number of seconds to wait for a pending query.
         
         Returns:
             tuple: A tuple containing the financial status and list of URLs for the query, or (None, None) if not found.
         """
         async with self._lock:
-            return self._storage.pop(query_id, (None, None))
+            result = self._pop_live(query_id)
+            pending = self._pending.get(query_id)
+        if result is not None or pending is None or timeout <= 0:
+            return result or (None, None)
+
+        try:
+            await asyncio.wait_for(pending[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            return (None, None)
+
+        async with self._lock:
+            return self._pop_live(query_id) or (None, None)
+
+    def _pop_live(self, query_id: str):
+        """
+        Pops a stored query, returning (financial, urls) or None if it is missing or expired.
+
+        Call with the lock held.
+        """
+        entry = self._storage.pop(query_id, None)
+        if entry is None or entry[2] < time.monotonic():
+            return None
+        return entry[0], entry[1]
+
+    async def sweep(self) -> int:
+        """
+        Removes expired queries and expired pending registrations.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        now = time.monotonic()
+        async with self._lock:
+            expired = [query_id for query_id, entry in self._storage.items() if entry[2] < now]
+            for query_id in expired:
+                del self._storage[query_id]
+            expired_pending = [query_id for query_id, entry in self._pending.items() if entry[1] < now]
+            events = [self._pending.pop(query_id)[0] for query_id in expired_pending]
+            self._expirations += len(expired) + len(expired_pending)
+        for event in events:
+            event.set()
+        return len(expired) + len(expired_pending)
+
+    async def run_sweeper(self, interval: float):
+        """
+        Sweeps expired entries every `interval` seconds until cancelled.
+
+        Args:
+            interval (float): The number of seconds between two sweeps.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            removed = await self.sweep()
+            if removed:
+                print(f"Swept {removed} expired queries from storage", flush=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the storage counters.
+
+        Returns:
+            dict: The number of stored and pending queries, and of entries evicted or expired.
+        """
+        return {
+            "stored": len(self._storage),
+            "pending": len(self._pending),
+            "max_size": self._max_size,
+            "evictions": self._evictions,
+            "expirations": self._expirations
+        }
+
+class QueryEngineRegistry:
+    """
+    A class for reusing query engines across RAG queries.
+
+    The Weaviate vector store, index and prompt template are built once when the registry is created.
+    Query engines filtered to a (website, timestamp) snapshot are created on demand and kept in a bounded
+    LRU, so repeated questions about the same snapshot skip the setup entirely.
+
+    Attributes:
+        _index (VectorStoreIndex): The shared index backed by the Weaviate 'Pages' class.
+        _qa_template (PromptTemplate): The shared question-answering prompt template.
+        _engines (OrderedDict): Query engines keyed by (website, timestamp), least recently used first.
+        _max_engines (int): The maximum number of query engines kept in the registry.
+        _lock (threading.Lock): A lock protecting the engines and counters, since engines may be
+                                requested from worker threads.
+    """
+
+    def __init__(self, client, max_engines: int = 64):
+        """
+        Builds the shared index and prompt template.
+
+        Args:
+            client: A Weaviate client instance used to interact with the Weaviate vector store.
+            max_engines (int): The maximum number of query engines to keep before evicting the least recently used.
+        """
+        self._index = helper.build_weaviate_index(client)
+        self._qa_template = helper.build_qa_template()
+        self._engines = OrderedDict()
+        self._max_engines = max_engines
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_engine(self, website: str, timestamp: str):
+        """
+        Returns the query engine for a website snapshot, creating it if needed.
+
+        Args:
+            website (str): The website address used as an exact match filter.
+            timestamp (str): The timestamp used as an exact match filter.
+
+        Returns:
+            A streaming query engine restricted to the given snapshot.
+        """
+        key = (website, timestamp)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+                self._hits += 1
+                return engine
+            self._misses += 1
+
+        # Build outside of the lock so a slow build doesn't hold up other snapshots
+        engine = helper.build_query_engine(self._index, self._qa_template, website, timestamp)
+
+        with self._lock:
+            # Another request may have built the same engine in the meantime
+            engine = self._engines.setdefault(key, engine)
+            self._engines.move_to_end(key)
+            while len(self._engines) > self._max_engines:
+                self._engines.popitem(last=False)
+                self._evictions += 1
+        return engine
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Computes the embedding of a question with the embedding model of the shared index.
+
+        Args:
+            query (str): The question.
+
+        Returns:
+            List[float]: The embedding of the question.
+        """
+        return self._index.service_context.embed_model.get_query_embedding(query)
+
+    def stats(self) -> dict:
+        """
+        Returns the registry counters.
+
+        Returns:
+            dict: The number of cached engines, cache hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                "size": len(self._engines),
+                "max_size": self._max_engines,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
+class CachedAnswer:
+    """
+    A class holding a generated answer kept in the answer cache.
+
+    Attributes:
+        text (str): The answer text, without the financial marker.
+        urls (List[str]): The unique source URLs of the answer.
+        financial (bool): The financial flag of the answer.
+        embedding (List[float]): The embedding of the question, or None if similarity matching is disabled.
+        expires_at (float): The monotonic time after which the answer is stale.
+    """
+
+    def __init__(self, text: str, urls: List[str], financial: bool, embedding: List[float], expires_at: float):
+        """Initializes the cached answer."""
+        self.text = text
+        self.urls = urls
+        self.financial = financial
+        self.embedding = embedding
+        self.expires_at = expires_at
+
+class CachedStreamingResponse:
+    """
+    A class replaying a cached answer with the interface of a LlamaIndex streaming response.
+
+    The answer is split into word-sized segments and, for a financial answer, followed by the "QQ"
+    marker, so it goes through exactly the same processing as a freshly generated answer.
+
+    Attributes:
+        response_gen: A generator yielding the text segments of the answer.
+        source_urls (List[str]): The unique source URLs of the answer.
+    """
+
+    def __init__(self, answer: CachedAnswer):
+        """
+        Prepares the replay of a cached answer.
+
+        Args:
+            answer (CachedAnswer): The answer to replay.
+        """
+        segments = re.findall(r"\s*\S+\s*", answer.text)
+        if answer.financial:
+            segments.append("QQ")
+        self.response_gen = (segment for segment in segments)
+        self.source_urls = answer.urls
+
+class AnswerCache:
+    """
+    A class for reusing generated answers to repeated questions about the same snapshot.
+
+    Snapshots are immutable once ingested, so a question about a (website, timestamp) pair always retrieves
+    the same context. Answers are keyed by the snapshot and the normalized question (lowercase words only).
+    When an embedding function is provided, a question without an exact match can also match a cached
+    question of the same snapshot whose embedding has a cosine similarity above the threshold.
+
+    Attributes:
+        _entries (OrderedDict): Cached answers keyed by (website, timestamp, normalized query), least recently
+                                used first.
+        _snapshots (dict): The keys of the cached answers of each (website, timestamp) snapshot.
+        _max_size (int): The maximum number of cached answers.
+        _ttl (float): The number of seconds an answer stays valid.
+        _embed (Callable): A function returning the embedding of a question, or None to disable similarity matching.
+        _similarity_threshold (float): The minimum cosine similarity for a near-duplicate match.
+        _lock (threading.Lock): A lock protecting the cache, since it is used from worker threads.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 86400, embed: Callable = None,
+                 similarity_threshold: float = 0.95):
+        """
+        Initializes an empty answer cache.
+
+        Args:
+            max_size (int): The maximum number of cached answers.
+            ttl (float): The number of seconds after which an answer expires.
+            embed (Callable, optional): A function returning the embedding of a question.
+            similarity_threshold (float): The minimum cosine similarity for a near-duplicate match.
+        """
+        self._entries = OrderedDict()
+        self._snapshots = {}
+        self._max_size = max_size
+        self._ttl = ttl
+        self._embed = embed
+        self._similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._similar_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Normalizes a question so that case, punctuation and spacing don't matter.
+
+        Args:
+            query (str): The question.
+
+        Returns:
+            str: The lowercase words of the question separated by single spaces.
+        """
+        return " ".join(re.findall(r"\w+", query.lower()))
+
+    @staticmethod
+    def _cosine_similarity(a: List[float], b: List[float]) -> float:
+        """Returns the cosine similarity of two vectors."""
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
+
+    def lookup(self, website: str, timestamp: str, query: str) -> tuple:
+        """
+        Looks up the answer to a question about a snapshot.
+
+        This method may call the embedding function, so it should run off the event loop.
+
+        Args:
+            website (str): The website address of the snapshot.
+            timestamp (str): The timestamp of the snapshot.
+            query (str): The question.
+
+        Returns:
+            tuple: The cached answer (or None on a miss) and the embedding of the question (or None
+                   if it wasn't needed), to be passed back to `store` on a miss.
+        """
+        key = (website, timestamp, self.normalize_query(query))
+        now = time.monotonic()
+        with self._lock:
+            answer = self._entries.get(key)
+            if answer is not None and answer.expires_at >= now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return answer, None
+            if self._embed is None:
+                self._misses += 1
+                return None, None
+
+        embedding = self._embed(query)
+        with self._lock:
+            best, best_similarity = None, self._similarity_threshold
+            for other_key in self._snapshots.get((website, timestamp), ()):
+                candidate = self._entries[other_key]
+                if candidate.embedding is None or candidate.expires_at < now:
+                    continue
+                similarity = self._cosine_similarity(embedding, candidate.embedding)
+                if similarity >= best_similarity:
+                    best, best_similarity = other_key, similarity
+            if best is not None:
+                self._entries.move_to_end(best)
+                self._similar_hits += 1
+                return self._entries[best], embedding
+            self._misses += 1
+        return None, embedding
+
+    def store(self, website: str, timestamp: str, query: str, text: str, urls: List[str], financial: bool,
+              embedding: List[float] = None):
+        """
+        Stores the answer to a question about a snapshot, evicting the least recently used answers if full.
+
+        Args:
+            website (str): The website address of the snapshot.
+            timestamp (str): The timestamp of the snapshot.
+            query (str): The question.
+            text (str): The answer text, without the financial marker.
+            urls (List[str]): The unique source URLs of the answer.
+            financial (bool): The financial flag of the answer.
+            embedding (List[float], optional): The embedding of the question returned by `lookup`.
+        """
+        key = (website, timestamp, self.normalize_query(query))
+        with self._lock:
+            self._entries[key] = CachedAnswer(text, urls, financial, embedding, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            self._snapshots.setdefault((website, timestamp), set()).add(key)
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        """Removes a cached answer. Call with the lock held."""
+        del self._entries[key]
+        snapshot_keys = self._snapshots[key[:2]]
+        snapshot_keys.discard(key)
+        if not snapshot_keys:
+            del self._snapshots[key[:2]]
+
+    def invalidate_snapshot(self, website: str, timestamp: str):
+        """
+        Removes every cached answer of a snapshot, for instance because it was re-ingested.
+
+        Args:
+            website (str): The website address of the snapshot.
+            timestamp (str): The timestamp of the snapshot.
+        """
+        with self._lock:
+            for key in list(self._snapshots.get((website, timestamp), ())):
+                self._remove(key)
+                self._invalidations += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: The number of cached answers, exact and similar hits, misses and invalidated answers.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self._hits,
+                "similar_hits": self._similar_hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations
+            }
+
+class SnapshotCatalog:
+    """
+    A class for serving the website and timestamp lists without querying Weaviate on each request.
+
+    The full website to timestamps map is built with Aggregate queries when the catalog is first used
+    and refreshed periodically, to pick up snapshots ingested outside of this service. Snapshots ingested
+    through /scrape_sitemap are added incrementally right away. The lists are kept sorted and replaced,
+    never mutated, so they can be returned as they are.
+
+    Attributes:
+        _client: The Weaviate client used to build the catalog.
+        _timestamps (dict): The timestamps of each website address, most recent first.
+        _websites (list): The sorted website addresses.
+        _loaded (bool): Whether the catalog has been built at least once.
+        _lock (threading.Lock): A lock protecting the catalog, since it is read from worker threads.
+    """
+
+    def __init__(self, client):
+        """
+        Initializes an empty catalog.
+
+        Args:
+            client: A Weaviate client instance used to build the catalog.
+        """
+        self._client = client
+        self._timestamps = {}
+        self._websites = []
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refreshes = 0
+        self._incremental_updates = 0
+        self._refreshed_at = None
+
+    def refresh(self):
+        """Rebuilds the whole catalog from Weaviate."""
+        catalog = helper.get_snapshot_catalog(self._client)
+        with self._lock:
+            self._timestamps = catalog
+            self._websites = sorted(catalog)
+            self._loaded = True
+            self._refreshes += 1
+            self._refreshed_at = datetime.now().isoformat()
+
+    def _ensure_loaded(self):
+        """Builds the catalog if it has never been built."""
+        if not self._loaded:
+            self.refresh()
+
+    def add_snapshot(self, website: str, timestamp: str):
+        """
+        Adds a newly ingested snapshot to the catalog.
+
+        Args:
+            website (str): The website address of the snapshot.
+            timestamp (str): The timestamp of the snapshot.
+        """
+        with self._lock:
+            if website not in self._timestamps:
+                self._websites = sorted(self._websites + [website])
+            timestamps = self._timestamps.get(website, [])
+            if timestamp in timestamps:
+                return
+            self._timestamps[website] = sorted(timestamps + [timestamp], reverse=True)
+            self._incremental_updates += 1
+
+    def websites(self) -> List[str]:
+        """
+        Returns the website addresses that have at least one snapshot.
+
+        Returns:
+            List[str]: The sorted website addresses.
+        """
+        self._ensure_loaded()
+        return self._websites
+
+    def timestamps(self, website: str) -> List[str]:
+        """
+        Returns the snapshot timestamps of a website address.
+
+        Args:
+            website (str): The website address.
+
+        Returns:
+            List[str]: The timestamps, most recent first, or an empty list for an unknown website.
+        """
+        self._ensure_loaded()
+        return self._timestamps.get(website, [])
+
+    async def run_refresher(self, interval: float):
+        """
+        Rebuilds the catalog now and then every `interval` seconds until cancelled.
+
+        The rebuild runs in a worker thread so it doesn't block the event loop. Failures are logged
+        and the previous catalog is kept.
+
+        Args:
+            interval (float): The number of seconds between two rebuilds.
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"Could not refresh the snapshot catalog: {e}", flush=True)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        """
+        Returns the catalog counters.
+
+        Returns:
+            dict: The number of websites and snapshots, of full refreshes and incremental updates,
+                  and the time of the last full refresh.
+        """
+        with self._lock:
+            return {
+                "websites": len(self._websites),
+                "snapshots": sum(len(timestamps) for timestamps in self._timestamps.values()),
+                "refreshes": self._refreshes,
+                "incremental_updates": self._incremental_updates,
+                "refreshed_at": self._refreshed_at
+            }
+
+class InFlightQuery:
+    """
+    A class sharing one retrieval and LLM generation between concurrent identical queries.
+
+    The generation runs in its own task, independent of any single client. Each subscriber replays the
+    segments generated so far and then follows the live stream, so a request joining late still receives
+    the whole answer. The upstream generation is only cancelled once every subscriber has left.
+
+    Attributes:
+        streaming_response: The streaming response of the query, set once retrieval is done.
+        error (BaseException): The error raised by retrieval or generation, if any.
+        ready (asyncio.Event): Set once retrieval is done or has failed.
+        cancel_event (threading.Event): Set to stop the upstream generation.
+        task (asyncio.Task): The task running the query.
+        _segments (list): The raw text segments generated so far.
+        _done (bool): Whether the generation has ended.
+        _changed (asyncio.Event): Set, and replaced, whenever a segment is added or the generation ends.
+        _subscribers (int): The number of requests following the generation.
+    """
+
+    def __init__(self):
+        """Initializes a query that has not started yet."""
+        self.streaming_response = None
+        self.error = None
+        self.ready = asyncio.Event()
+        self.cancel_event = threading.Event()
+        self.task = None
+        self._segments = []
+        self._done = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+
+    def _notify(self):
+        """Wakes up the subscribers waiting for a change."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self, retrieve: Callable, executor: ThreadPoolExecutor):
+        """
+        Runs retrieval, then consumes the generation and shares its segments with the subscribers.
+
+        Args:
+            retrieve (Callable): A coroutine function returning the streaming response and a function to
+                                 call with the raw answer text once the generation has completed (or None).
+            executor (ThreadPoolExecutor): The executor used to consume the 'response_gen' generator.
+        """
+        try:
+            self.streaming_response, on_complete = await retrieve()
+        except BaseException as e:
+            self.error = e
+            self._done = True
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        finally:
+            self.ready.set()
+
+        try:
+            async for segment in iterate_in_executor(executor, self.streaming_response.response_gen, self.cancel_event):
+                self._segments.append(segment)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done = True
+            self._notify()
+
+        if self.error is None and not self.cancel_event.is_set() and on_complete is not None:
+            on_complete("".join(self._segments))
+
+    def join(self):
+        """Registers a new subscriber."""
+        self._subscribers += 1
+
+    def leave(self):
+        """Unregisters a subscriber, stopping the upstream generation if it was the last one."""
+        self._subscribers -= 1
+        if self._subscribers <= 0 and not self._done:
+            self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the upstream generation was stopped before its end."""
+        return self.cancel_event.is_set()
+
+    async def subscribe(self):
+        """
+        Yields every raw segment of the generation, from the first one, as it becomes available.
+
+        Yields:
+            str: The raw text segments, including financial markers.
+
+        Raises:
+            BaseException: The error raised by the generation, if any.
+        """
+        index = 0
+        while True:
+            if index < len(self._segments):
+                index += 1
+                yield self._segments[index - 1]
+                continue
+            if self._done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class QueryCoalescer:
+    """
+    A class coalescing identical in-flight RAG queries into a single retrieval and LLM generation.
+
+    Queries are identified by their snapshot and normalized question. A query arriving while an identical
+    one is still running subscribes to it instead of starting its own generation. The entry is dropped once
+    the query ends, after which the answer cache takes over.
+
+    Attributes:
+        _flights (dict): The running queries keyed by (website, timestamp, normalized query).
+    """
+
+    def __init__(self):
+        """Initializes the coalescer without any running query."""
+        self._flights = {}
+        self._started = 0
+        self._coalesced = 0
+
+    def join(self, key: tuple, start: Callable) -> InFlightQuery:
+        """
+        Subscribes to the running query with the given key, starting it if there is none.
+
+        Must be called from the event loop. The caller must call `leave` on the returned query once done.
+
+        Args:
+            key (tuple): The (website, timestamp, normalized query) key of the query.
+            start (Callable): A function taking the new InFlightQuery and returning the coroutine running it.
+
+        Returns:
+            InFlightQuery: The query to follow.
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.cancelled:
+            flight = InFlightQuery()
+            self._flights[key] = flight
+            self._started += 1
+            flight.task = asyncio.create_task(start(flight))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self._coalesced += 1
+        flight.join()
+        return flight
+
+    def _forget(self, key: tuple, flight: InFlightQuery):
+        """Removes a finished query, unless it was already replaced."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        """
+        Returns the coalescer counters.
+
+        Returns:
+            dict: The number of running queries, of queries started and of requests coalesced into a running query.
+        """
+        return {
+            "in_flight": len(self._flights),
+            "started": self._started,
+            "coalesced": self._coalesced
+        }
+
+class PredictionBatcher:
+    """
+    A class for sending concurrent sentiment predictions to a Vertex AI endpoint in micro-batches.
+
+    Requests are queued and collected into a batch until it holds `max_batch_size` texts or `max_wait`
+    seconds have passed since its first text. Each batch is sent as a single `predict(instances=[...])` call
+    in a worker thread, and the predictions are handed back to the waiting requests in order.
+
+    Attributes:
+        _endpoint: The Vertex AI endpoint, created once at startup (or a local fake endpoint).
+        _queue (asyncio.Queue): The pending (text, future) pairs.
+        _max_batch_size (int): The maximum number of texts sent in one call.
+        _max_wait (float): The maximum number of seconds the first text of a batch waits for others.
+        _semaphore (asyncio.Semaphore): Bounds the number of batches sent concurrently.
+    """
+
+    def __init__(self, endpoint, max_batch_size: int = 32, max_wait: float = 0.01, max_concurrent_batches: int = 4):
+        """
+        Initializes the batcher.
+
+        Args:
+            endpoint: The endpoint to send the batches to. It must have a `predict(instances=...)` method.
+            max_batch_size (int): The maximum number of texts sent in one call.
+            max_wait (float): The maximum number of seconds the first text of a batch waits for others.
+            max_concurrent_batches (int): The maximum number of calls in progress at the same time.
+        """
+        self._endpoint = endpoint
+        self._queue = asyncio.Queue()
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrent_batches)
+        self._batches = 0
+        self._instances = 0
+        self._errors = 0
+
+    async def predict(self, text: str) -> tuple:
+        """
+        Queues a text for prediction and waits for its result.
+
+        Args:
+            text (str): The text to classify.
+
+        Returns:
+            tuple: The predicted sentiment class (int) and the class probabilities.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def run(self):
+        """Collects queued texts into batches and sends them until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._semaphore.acquire()
+            asyncio.create_task(self._send(batch))
+
+    async def _send(self, batch: List[tuple]):
+        """Sends a batch in a worker thread and resolves the futures of its requests."""
+        try:
+            response = await asyncio.to_thread(self._endpoint.predict, instances=[text for text, _ in batch])
+            sentiments, probabilities = response.predictions
+            self._batches += 1
+            self._instances += len(batch)
+            for index, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((int(sentiments[index]), probabilities[index]))
+        except Exception as e:
+            self._errors += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        """
+        Returns the batcher counters.
+
+        Returns:
+            dict: The number of batches and instances sent, the average batch size, failed batches and queued texts.
+        """
+        return {
+            "batches": self._batches,
+            "instances": self._instances,
+            "average_batch_size": self._instances / self._batches if self._batches else 0,
+            "errors": self._errors,
+            "queued": self._queue.qsize()
+        }
+
+class StreamStats:
+    """
+    A class for counting how RAG streams end, to measure the work saved by cancelling abandoned streams.
+
+    Attributes:
+        _completed (int): The number of streams that delivered their full answer.
+        _cancelled (int): The number of streams stopped because the client went away.
+        _tokens_before_cancel (int): The number of text segments delivered by streams before they were cancelled.
+        _skipped_extractions (int): The number of URL extractions skipped for cancelled queries.
+        _lock (threading.Lock): A lock protecting the counters.
+    """
+
+    def __init__(self):
+        """Initializes all counters to zero."""
+        self._completed = 0
+        self._cancelled = 0
+        self._tokens_before_cancel = 0
+        self._skipped_extractions = 0
+        self._lock = threading.Lock()
+
+    def record_completed(self):
+        """Counts a stream that delivered its full answer."""
+        with self._lock:
+            self._completed += 1
+
+    def record_cancelled(self, tokens: int):
+        """
+        Counts a stream that was stopped before the answer was complete.
+
+        Args:
+            tokens (int): The number of text segments delivered before the stream was stopped.
+        """
+        with self._lock:
+            self._cancelled += 1
+            self._tokens_before_cancel += tokens
+
+    def record_skipped_extraction(self):
+        """Counts a URL extraction that was skipped because its query was cancelled."""
+        with self._lock:
+            self._skipped_extractions += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the stream counters.
+
+        Returns:
+            dict: The number of completed and cancelled streams, the text segments delivered before
+                  cancellation and the URL extractions skipped.
+        """
+        with self._lock:
+            return {
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "tokens_before_cancel": self._tokens_before_cancel,
+                "skipped_url_extractions": self._skipped_extractions
+            }
 
 
 # Test using this line of curl:
@@ -104,6 +1027,62 @@ os.environ["OPENAI_API_KEY"] = os.environ.get('OPENAI_APIKEY')
 # Current Weaviate IP
 WEAVIATE_IP_ADDRESS = "34.42.138.162"
 
+# Number of (website, timestamp) query engines kept alive between requests
+QUERY_ENGINE_CACHE_SIZE = int(os.environ.get("QUERY_ENGINE_CACHE_SIZE", 64))
+
+# Bounds of the query storage backing /get_urls, and how often expired entries are swept (in seconds)
+QUERY_STORAGE_MAX_SIZE = int(os.environ.get("QUERY_STORAGE_MAX_SIZE", 10000))
+QUERY_STORAGE_TTL = float(os.environ.get("QUERY_STORAGE_TTL", 600))
+QUERY_STORAGE_SWEEP_INTERVAL = float(os.environ.get("QUERY_STORAGE_SWEEP_INTERVAL", 60))
+
+# Bounds of the cache of generated answers. Setting ANSWER_CACHE_SIMILARITY to a cosine similarity
+# (e.g. 0.95) also matches near-duplicate questions, at the cost of an embedding request per cache miss.
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 86400))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0))
+
+# How often the website/timestamp catalog is rebuilt from Weaviate (in seconds)
+CATALOG_REFRESH_INTERVAL = float(os.environ.get("CATALOG_REFRESH_INTERVAL", 600))
+
+# Longest time /get_urls may wait for the background URL extraction (in seconds)
+GET_URLS_MAX_WAIT = 30
+
+# Vertex AI endpoint serving the fine-tuned BERT sentiment model. Set VERTEX_FAKE_ENDPOINT=1 to use the
+# local fake endpoint from api/dummy.py instead, e.g. to test batching offline.
+VERTEX_ENDPOINT_ID = "7054451210648027136"
+VERTEX_PROJECT_ID = "rag-detective"
+VERTEX_SERVICE_ACCOUNT_FILE = './secrets/ml-workflow.json'
+VERTEX_FAKE_ENDPOINT = os.environ.get("VERTEX_FAKE_ENDPOINT") == "1"
+
+# Micro-batching of /vertexai_predict: texts per call, and how long a text waits for others (in seconds)
+VERTEX_MAX_BATCH_SIZE = int(os.environ.get("VERTEX_MAX_BATCH_SIZE", 32))
+VERTEX_MAX_BATCH_WAIT = float(os.environ.get("VERTEX_MAX_BATCH_WAIT", 0.01))
+
+# Concurrency of /scrape_sitemap: pages fetched at the same time, overall and per host
+SCRAPE_WORKERS = int(os.environ.get("SCRAPE_WORKERS", 8))
+SCRAPE_PER_HOST_LIMIT = int(os.environ.get("SCRAPE_PER_HOST_LIMIT", 4))
+
+# Whether /scrape_sitemap only fetches and embeds the pages that changed since the previous snapshot,
+# unless the request says otherwise
+SCRAPE_INCREMENTAL = os.environ.get("SCRAPE_INCREMENTAL", "true").lower() == "true"
+
+# How often /scrape_sitemap reports the queue depths and throughputs of its ingestion pipeline, in seconds
+PIPELINE_REPORT_INTERVAL = float(os.environ.get("PIPELINE_REPORT_INTERVAL", 5.0))
+# How long an abandoned ingestion waits for its stages to stop before deleting what they wrote, in seconds
+PIPELINE_STOP_TIMEOUT = float(os.environ.get("PIPELINE_STOP_TIMEOUT", 60.0))
+
+# Framings supported by /rag_query and their media types. "text" streams bare tokens; "ndjson" and "sse"
+# stream token events followed by a final event carrying the source URLs and the financial flag.
+STREAM_FORMATS = {
+    "text": "text/plain",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+# Number of worker threads running retrieval and LLM streaming off the event loop.
+# Each active /rag_query stream holds one worker until its last token is generated.
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", 32))
+
 # Setup FastAPI app
 app = FastAPI(title="API Server", description="API Server", version="v1")
 
@@ -116,6 +1095,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def create_vertex_endpoint():
+    """
+    Authenticates with Google Cloud and creates the Vertex AI endpoint client.
+
+    Returns:
+        The Vertex AI endpoint, or the local fake endpoint if VERTEX_FAKE_ENDPOINT is set.
+
+    Raises:
+        exceptions.DefaultCredentialsError: If the service account credentials can't be loaded.
+    """
+    if VERTEX_FAKE_ENDPOINT:
+        return dummy.FakeVertexEndpoint()
+
+    # Load credentials from the service account file
+    credentials = service_account.Credentials.from_service_account_file(VERTEX_SERVICE_ACCOUNT_FILE)
+    aiplatform.init(credentials=credentials)
+    return aiplatform.Endpoint(f'projects/{VERTEX_PROJECT_ID}/locations/us-central1/endpoints/{VERTEX_ENDPOINT_ID}')
+
 @app.on_event("startup")
 async def startup_event():
     """
@@ -128,21 +1125,72 @@ async def startup_event():
     The Weaviate client is created using the IP address specified by the WEAVIATE_IP_ADDRESS environment variable
     and is stored in the application state for accessibility throughout the application lifecycle.
     
-    Two instances of custom classes, QueryStorage and FinancialStatus, are also created and stored in the application's
-    state. These instances handle financial flag status checks and URL storage management, respectively, enabling thread-safe
-    encapsulation of functionality across API endpoints.
+    An instance of QueryStorage is also created and stored in the application's state. It handles URL storage
+    management, enabling thread-safe encapsulation of functionality across API endpoints. A QueryEngineRegistry
+    builds the vector store index once and hands out per-snapshot query engines to every RAG query. The financial
+    status is tracked by a FinancialStatus instance per query, so concurrent streams never share a flag.
 
     Note:
     - The WEAVIATE_IP_ADDRESS environment variable must be set prior to starting the application.
-    - QueryStorage encapsulates the storage and retrieval of query-related information.
-    - FinancialStatus encapsulates the checking and setting of the financial status associated with query processing.
+    - QueryStorage encapsulates the storage and retrieval of query-related information. A background task
+      sweeps its expired entries every QUERY_STORAGE_SWEEP_INTERVAL seconds.
+    - QueryEngineRegistry caches up to QUERY_ENGINE_CACHE_SIZE query engines.
+    - PredictionBatcher holds the Vertex AI endpoint client and groups concurrent predictions into batches.
+    - QueryCoalescer shares one generation between identical concurrent queries.
+    - AnswerCache replays answers to repeated questions about the same snapshot.
+    - SnapshotCatalog answers /websites and /timestamps from memory and is rebuilt every
+      CATALOG_REFRESH_INTERVAL seconds.
+    - The query executor runs retrieval and LLM streaming in up to QUERY_WORKERS threads, so a
+      long generation never blocks the event loop for other requests.
+    - The rendering strategies the scraper learned for websites in earlier crawls are loaded in the background.
 
     Example usage:
     This function is not meant to be triggered manually; it is an event handler for application startup.
     """
     app.state.weaviate_client = weaviate.Client(url=f"http://{WEAVIATE_IP_ADDRESS}:8080")
-    app.state.query_storage = QueryStorage()
-    app.state.financial_status = FinancialStatus()
+    app.state.query_storage = QueryStorage(QUERY_STORAGE_MAX_SIZE, QUERY_STORAGE_TTL)
+    app.state.query_storage_sweeper = asyncio.create_task(
+        app.state.query_storage.run_sweeper(QUERY_STORAGE_SWEEP_INTERVAL))
+    app.state.query_engines = QueryEngineRegistry(app.state.weaviate_client, QUERY_ENGINE_CACHE_SIZE)
+    app.state.query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="rag-query")
+    app.state.stream_stats = StreamStats()
+    app.state.query_coalescer = QueryCoalescer()
+
+    # Authenticate and create the AI Platform (Unified) client once for all predictions
+    app.state.prediction_batcher = None
+    app.state.prediction_batcher_task = None
+    try:
+        endpoint = create_vertex_endpoint()
+        app.state.prediction_batcher = PredictionBatcher(endpoint, VERTEX_MAX_BATCH_SIZE, VERTEX_MAX_BATCH_WAIT)
+        app.state.prediction_batcher_task = asyncio.create_task(app.state.prediction_batcher.run())
+    except (exceptions.DefaultCredentialsError, OSError, ValueError) as e:
+        print(f"Couldn't authenticate with Google Cloud: {e}", flush=True)
+    app.state.answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL,
+                                         app.state.query_engines.embed_query if ANSWER_CACHE_SIMILARITY else None,
+                                         ANSWER_CACHE_SIMILARITY)
+    app.state.snapshot_catalog = SnapshotCatalog(app.state.weaviate_client)
+    app.state.snapshot_catalog_refresher = asyncio.create_task(
+        app.state.snapshot_catalog.run_refresher(CATALOG_REFRESH_INTERVAL))
+    # The rendering strategies learned in earlier crawls are read from the bucket without delaying the startup
+    app.state.render_strategies_loader = asyncio.create_task(asyncio.to_thread(helper.load_render_strategies))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Releases the application components created at startup.
+
+    The background tasks are cancelled and the query executor is shut down without waiting,
+    so in-flight streams don't hold up the shutdown. The idle Chrome sessions of the scraper are quit
+    and its extraction processes are stopped.
+    """
+    app.state.query_storage_sweeper.cancel()
+    app.state.snapshot_catalog_refresher.cancel()
+    if app.state.prediction_batcher_task:
+        app.state.prediction_batcher_task.cancel()
+    app.state.query_executor.shutdown(wait=False)
+    await asyncio.to_thread(helper.browser_pool.close)
+    if helper.extraction_pool:
+        helper.extraction_pool.shutdown(wait=False, cancel_futures=True)
 
 
 # Routes
@@ -189,47 +1237,204 @@ async def streaming_endpoint():
             await asyncio.sleep(0.1)
     return StreamingResponse(event_generator(), media_type="text/plain")
 
-async def process_streaming_response(local_streaming_response, financial_status: FinancialStatus):
+class _StreamError:
+    """Wraps an exception raised by a producer thread so it can be re-raised on the event loop."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_STREAM_END = object()
+
+async def iterate_in_executor(executor: ThreadPoolExecutor, iterable, cancel_event: threading.Event = None):
+    """
+    Iterates a blocking iterable in a worker thread and yields its items on the event loop.
+
+    The worker thread pushes each item into an asyncio queue through `call_soon_threadsafe` as soon as
+    it is produced, so the items reach the caller as they arrive while the event loop stays free to
+    serve other requests. Exceptions raised in the worker are re-raised in the caller.
+
+    If the caller stops iterating before the end (for instance because the task is cancelled), the
+    cancel event is set. The worker then stops pulling items and closes the iterable, which for a
+    generator also closes the upstream stream it reads from.
+
+    Args:
+        executor (ThreadPoolExecutor): The executor running the blocking iteration.
+        iterable: A blocking iterable, such as the 'response_gen' generator of a streaming response.
+        cancel_event (threading.Event, optional): An event that stops the worker when set. One is
+                                                  created if not provided.
+
+    Yields:
+        The items of the iterable, in order.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if cancel_event.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except BaseException as e:
+            if not cancel_event.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, _StreamError(e))
+                return
+        finally:
+            # The generator can only be closed from the thread iterating it
+            if cancel_event.is_set() and hasattr(iterable, "close"):
+                iterable.close()
+        # Also sent when cancelled, in case the cancel event was set by someone other than the caller
+        loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+    producer = loop.run_in_executor(executor, produce)
+    finished = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                finished = True
+                break
+            if isinstance(item, _StreamError):
+                finished = True
+                raise item.error
+            yield item
+    finally:
+        if not finished:
+            cancel_event.set()
+    await producer
+
+async def process_streaming_response(flight: InFlightQuery, financial_status: FinancialStatus, request: Request,
+                                     cancel_event: threading.Event, stream_stats: StreamStats):
     """
     Processes streaming response from a local source, checks for financial markers, 
     and yields processed text segments.
 
-    This asynchronous function iterates over a generator of streaming responses,
+    This asynchronous function iterates over the segments of a running query,
     examining each text segment for a specific marker ("QQ"). "QQ" was chosen since for
     reasons only known to itself, GPT-3.5 seems to struggle with more complex flags.
     If such a marker is found, it indicates a financial context and the financial status 
     is set to True using the financial_status instance provided. The marker is then removed
-    from the text.
+    from the text, including when it is split across two segments.
 
-    The function yields each processed text segment. It handles `asyncio.CancelledError` to
-    gracefully manage the cancellation of the streaming.
+    The generation itself runs in the query executor, driven by the InFlightQuery, and may be shared
+    with identical concurrent requests. The function yields each processed text segment. If the client
+    disconnects, or the streaming is cancelled, the cancel event is set, this request leaves the query
+    and the URL extraction for it is skipped. The upstream completion stream is closed once no request
+    follows the query anymore.
 
     Args:
-        local_streaming_response: An instance of a streaming response object with a 'response_gen'
-                                  generator attribute, which is a generator yielding text segments.
-        financial_status (FinancialStatus): An instance of FinancialStatus to manage the financial
-                                            status throughout the processing.
+        flight (InFlightQuery): The running query, joined by this request.
+        financial_status (FinancialStatus): The FinancialStatus instance of this query, managing the
+                                            financial status throughout the processing.
+        request (Request): The incoming HTTP request, polled to detect a client disconnect.
+        cancel_event (threading.Event): The event set when the stream is abandoned before its end.
+        stream_stats (StreamStats): The counters updated when the stream completes or is cancelled.
 
     Yields:
         str: Processed text segments without the financial marker.
     
     Raises:
-        asyncio.CancelledError: If the streaming process is cancelled. This is caught and handled 
-                                to allow for a graceful shutdown of the generator.
+        asyncio.CancelledError: If the streaming process is cancelled. The request leaves the query
+                                before the error is propagated.
     """
+    tokens = 0
+    completed = False
     try:
-        for text in local_streaming_response.response_gen:
-            # Check for the financial flag at the end of the text
-            if "QQ" in text:
-                financial_status.set_financial(True)
-                text = text.replace("QQ", "")  # remove the "%%"
+        async for text in flight.subscribe():
+            if await request.is_disconnected():
+                print('Client disconnected', flush=True)
+                break
+            # Check for the financial flag and remove it from the text
+            text = financial_status.strip_marker(text)
             if text:   # Check for null character or empty string
                 print(f"Yielding: [{text}]")
+                tokens += 1
                 yield text  
+        else:
+            completed = True
+            text = financial_status.flush()
+            if text:
+                yield text
         if financial_status.is_financial():
             print(" Financial flag set!", flush=True)
-    except asyncio.CancelledError as e:
+    except asyncio.CancelledError:
         print('Streaming cancelled', flush=True)
+        raise
+    finally:
+        flight.leave()
+        if completed:
+            stream_stats.record_completed()
+        else:
+            cancel_event.set()
+            stream_stats.record_cancelled(tokens)
+
+def get_source_urls(streaming_response) -> List[str]:
+    """
+    Returns the unique source URLs of a streaming response, fresh or replayed from the answer cache.
+
+    Args:
+        streaming_response: A LlamaIndex streaming response or a CachedStreamingResponse.
+
+    Returns:
+        List[str]: The unique source URLs, in order of first appearance.
+    """
+    if isinstance(streaming_response, CachedStreamingResponse):
+        return streaming_response.source_urls
+    return helper.extract_unique_document_urls(streaming_response)
+
+def format_stream_event(stream_format: str, event: Dict) -> str:
+    """
+    Frames an event of the /rag_query stream in the given format.
+
+    Args:
+        stream_format (str): Either "ndjson" (one JSON object per line) or "sse" (server-sent events).
+        event (Dict): The event to frame. Its 'type' key is used as the SSE event name.
+
+    Returns:
+        str: The framed event.
+    """
+    payload = json.dumps(event)
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return f"{payload}\n"
+
+async def process_framed_response(query_id: str, flight: InFlightQuery, financial_status: FinancialStatus,
+                                  request: Request, cancel_event: threading.Event, stream_stats: StreamStats,
+                                  stream_format: str):
+    """
+    Streams the answer as framed token events followed by a final event with the sources.
+
+    Each text segment produced by `process_streaming_response` is sent as a 'token' event. Once the
+    answer is complete, a 'final' event carries the query ID, the de-duplicated source URLs and the
+    financial flag, so the client doesn't need to call /get_urls. No final event is sent if the
+    stream was cancelled.
+
+    Args:
+        query_id (str): The unique identifier for the query.
+        flight (InFlightQuery): The running query, joined by this request.
+        financial_status (FinancialStatus): The FinancialStatus instance of this query.
+        request (Request): The incoming HTTP request, polled to detect a client disconnect.
+        cancel_event (threading.Event): The event set when the stream is abandoned before its end.
+        stream_stats (StreamStats): The counters updated when the stream completes or is cancelled.
+        stream_format (str): Either "ndjson" or "sse".
+
+    Yields:
+        str: Framed 'token' events, then one framed 'final' event.
+    """
+    async for text in process_streaming_response(flight, financial_status, request, cancel_event, stream_stats):
+        yield format_stream_event(stream_format, {"type": "token", "text": text})
+
+    if cancel_event.is_set():
+        return
+
+    yield format_stream_event(stream_format, {
+        "type": "final",
+        "query_id": query_id,
+        "urls": get_source_urls(flight.streaming_response),
+        "financial_flag": financial_status.is_financial()
+    })
 
 def check_required(data: Dict[str, str], keys: List[str]):
     """
@@ -262,7 +1467,17 @@ async def rag_query(request: Request, background_tasks: BackgroundTasks):
     This asynchronous endpoint accepts a JSON payload containing the parameters 'website', 'timestamp',
     and 'query'. It generates a unique ID for the query, performs a query using Weaviate, and initiates
     the URL processing in the background. The response is streamed back to the client, with updates on the
-    processing progress.
+    processing progress. Retrieval and token generation run in the query executor, so other requests on
+    the same worker are served while the LLM is generating.
+
+    The optional 'stream_format' parameter selects the framing of the stream. With the default "text",
+    bare tokens are streamed and the sources are fetched afterwards from /get_urls. With "ndjson" or "sse",
+    tokens are sent as events and a final event carries the source URLs and the financial flag, so no
+    second request (and no background URL processing) is needed.
+
+    Answers are cached per snapshot and question. A repeated question is replayed from the answer cache
+    through the same streaming path, without retrieval or LLM call. Identical questions arriving while
+    one is still being answered share its retrieval and generation, each with its own query ID.
 
     Args:
         request (Request): The incoming HTTP request containing the query parameters.
@@ -272,16 +1487,20 @@ async def rag_query(request: Request, background_tasks: BackgroundTasks):
         StreamingResponse: A streaming response that provides real-time updates of the query processing.
 
     Raises:
-        HTTPException: If any required fields are missing in the request.
+        HTTPException: If any required fields are missing in the request, or the stream format is unknown.
 
     Note:
-        The endpoint interacts with the `financial_status` instance during URL processing to manage the financial flag.
+        Each query gets its own FinancialStatus instance, whose final flag is stored with the query's URLs
+        or sent in the final event.
         The response includes a custom 'X-Query-ID' header to track the query ID for reference retrieval.
 
     Example usage:
     curl -X POST http://localhost:9000/rag_query \
      -H "Content-Type: application/json" \
      -d {"website": "example.com", "timestamp": "2021-01-01T12:00:00", "query": "example query"}
+    curl -N -X POST http://localhost:9000/rag_query \
+     -H "Content-Type: application/json" \
+     -d {"website": "example.com", "timestamp": "2021-01-01T12:00:00", "query": "example query", "stream_format": "ndjson"}
     """
     data = await request.json()
 
@@ -291,18 +1510,55 @@ async def rag_query(request: Request, background_tasks: BackgroundTasks):
     website = data.get('website')
     timestamp = data.get('timestamp')
     query = data.get('query')
+    stream_format = data.get('stream_format', 'text')
+    if stream_format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown stream_format: '{stream_format}'")
 
     # Generate a unique ID for this specific query
     query_id = str(uuid.uuid4())
     print("Query ID:", query_id)
 
-    # Query Weaviate
-    streaming_response = helper.query_weaviate(app.state.weaviate_client, website, timestamp, query)
-
-    financial_status_instance = request.app.state.financial_status
+    loop = asyncio.get_running_loop()
+    executor = request.app.state.query_executor
+    answer_cache = request.app.state.answer_cache
+    stream_stats = request.app.state.stream_stats
+
+    # Scoped to this query, so concurrent streams don't race on the flag
+    financial_status_instance = FinancialStatus()
+
+    async def retrieve():
+        # Replay the answer if the same question was already answered for this snapshot
+        cached_answer, query_embedding = await loop.run_in_executor(executor, answer_cache.lookup, website,
+                                                                    timestamp, query)
+        if cached_answer is not None:
+            print("Answer cache hit")
+            return CachedStreamingResponse(cached_answer), None
+
+        # Query Weaviate with the cached engine for this snapshot. Building the engine and retrieval
+        # are blocking calls, so they run in the query executor instead of on the event loop.
+        query_engine = await loop.run_in_executor(executor, request.app.state.query_engines.get_engine, website,
+                                                  timestamp)
+        streaming_response = await loop.run_in_executor(executor, helper.execute_query, query_engine, query)
+
+        def on_complete(raw_text: str):
+            answer_cache.store(website, timestamp, query, raw_text.replace("QQ", ""),
+                               get_source_urls(streaming_response), "QQ" in raw_text, query_embedding)
+
+        return streaming_response, on_complete
+
+    # Share the retrieval and generation with identical queries that are already running
+    key = (website, timestamp, AnswerCache.normalize_query(query))
+    flight = request.app.state.query_coalescer.join(key, lambda flight: flight.run(retrieve, executor))
+    try:
+        await flight.ready.wait()
+        if flight.error is not None:
+            raise flight.error
+    except BaseException:
+        flight.leave()
+        raise
 
-    # Add the URL processing function as a background task
-    background_tasks.add_task(process_url_extraction, query_id, streaming_response, financial_status_instance, request.app.state.query_storage)
+    # Set when the client goes away, to stop generation and skip the URL extraction
+    cancel_event = threading.Event()
 
     # Generate the streaming response and return it
     headers = {
@@ -311,39 +1567,60 @@ async def rag_query(request: Request, background_tasks: BackgroundTasks):
         'X-Query-ID': query_id  # set the header to track the query_id for the reference retrieval
     }
 
+    if stream_format != "text":
+        # The sources travel in the final event of the stream, so nothing is kept for /get_urls
+        return StreamingResponse(
+            process_framed_response(query_id, flight, financial_status_instance, request,
+                                    cancel_event, stream_stats, stream_format),
+            media_type=STREAM_FORMATS[stream_format],
+            headers=headers
+        )
+
+    # Let /get_urls wait for this query instead of answering 404 until the extraction is done
+    await request.app.state.query_storage.register_query(query_id)
+
+    # Add the URL processing function as a background task
+    background_tasks.add_task(process_url_extraction, query_id, flight.streaming_response, financial_status_instance,
+                              request.app.state.query_storage, cancel_event, stream_stats)
+
     return StreamingResponse(
-        process_streaming_response(streaming_response, financial_status_instance),
-        media_type="text/plain",
+        process_streaming_response(flight, financial_status_instance, request, cancel_event, stream_stats),
+        media_type=STREAM_FORMATS[stream_format],
         headers=headers
     )
 
-async def process_url_extraction(query_id: str, streaming_response, financial_status: FinancialStatus, query_storage: QueryStorage):
+async def process_url_extraction(query_id: str, streaming_response, financial_status: FinancialStatus,
+                                 query_storage: QueryStorage, cancel_event: threading.Event,
+                                 stream_stats: StreamStats):
     """
     Processes the given streaming response to extract and store unique URLs.
 
     This asynchronous function takes a streaming response, extracts URLs from the
     documents in the stream, and uses the `query_storage` instance to store them. It ensures
     that the URLs are unique and maintains their order. The extracted URLs, along with the financial
-    status, are associated with the provided `query_id`.
+    status, are associated with the provided `query_id`. Nothing is stored if the client disconnected
+    before the answer was complete, since nobody will ask for the URLs.
 
     Args:
         query_id (str): The unique identifier for the query.
         streaming_response: The streaming response object to process.
-        financial_status (FinancialStatus): An instance representing the financial status checker.
+        financial_status (FinancialStatus): The FinancialStatus instance of this query.
         query_storage (QueryStorage): An instance for managing query-related URL storage.
+        cancel_event (threading.Event): The event set when the stream of the query was cancelled.
+        stream_stats (StreamStats): The counters updated when the extraction is skipped.
 
     Note:
         URLs extraction and storage are managed by a `query_storage` instance which employs an asynchronous
         lock to ensure thread-safe operations. The storage format for each query is a tuple
         of the financial flag and the list of unique URLs.
     """
-    extracted_urls = helper.extract_document_urls(streaming_response)
-    unique_urls = []
-    # Use a loop to maintain order and avoid duplicates
-    for url in extracted_urls:
-        if url not in unique_urls:
-            unique_urls.append(url)
-    
+    if cancel_event.is_set():
+        stream_stats.record_skipped_extraction()
+        await query_storage.discard_query(query_id)
+        return
+
+    unique_urls = get_source_urls(streaming_response)
+
     # Use the provided instance to store the ordered, unique URLs
     await query_storage.store_query(query_id, financial_status.is_financial(), unique_urls)
 
@@ -352,21 +1629,20 @@ def read_websites():
     """
     Retrieves a list of website addresses.
 
-    This endpoint calls a helper function to fetch website addresses from a Weaviate client,
-    which is stored in the application's state. It returns a list of strings, each representing
-    a website address.
+    This endpoint reads the website addresses from the snapshot catalog stored in the application's
+    state, without querying Weaviate. It returns a list of strings, each representing a website address.
 
     Returns:
         List[str]: A list of website addresses as strings.
 
     Note:
-        The actual fetching of website addresses is handled by the `helper.get_website_addresses`
-        function, which interacts with the Weaviate client.
+        The catalog is built by the `helper.get_snapshot_catalog` function, which interacts with the
+        Weaviate client, and is kept up to date by the catalog refresher and by /scrape_sitemap.
 
     Example usage:
         curl -X 'GET' 'http://localhost:9000/websites' -H 'accept: application/json'
     """
-    return helper.get_website_addresses(app.state.weaviate_client)
+    return app.state.snapshot_catalog.websites()
 
 @app.get("/timestamps/{website_address}", response_model=List[str])
 def read_timestamps(website_address: str):
@@ -374,8 +1650,8 @@ def read_timestamps(website_address: str):
     Retrieves a list of timestamps associated with the specified website address.
 
     This endpoint accepts a website address as a path parameter and returns a list of timestamps
-    for that website. It uses a helper function that interacts with the Weaviate client (stored in the
-    application's state) to fetch the timestamps.
+    for that website. The timestamps are read from the snapshot catalog stored in the application's
+    state, without querying Weaviate.
 
     Args:
        website_address (str): The website address for which timestamps are requested.
@@ -384,27 +1660,30 @@ def read_timestamps(website_address: str):
        List[str]: A list of timestamp strings associated with the given website address.
 
     Note:
-       The actual data retrieval is managed by the `helper.get_all_timestamps_for_website` function.
+       The catalog is built by the `helper.get_snapshot_catalog` function.
 
     Example usage:
        curl -X 'GET' 'http://localhost:9000/timestamps/ai21.com' -H 'accept: application/json'
     """
 
-    return helper.get_all_timestamps_for_website(app.state.weaviate_client, website_address)
+    return app.state.snapshot_catalog.timestamps(website_address)
 
 @app.get("/get_urls/{query_id}")
-async def get_urls(request: Request, query_id: str):
+async def get_urls(request: Request, query_id: str, wait: float = Query(0, ge=0, le=GET_URLS_MAX_WAIT)):
     """
     Retrieves the URLs and financial flag associated with the provided query ID.
 
     This asynchronous endpoint takes a query ID as a path parameter, looks up the associated
-    URLs and financial flag within the application's query storage, and returns them. If the URLs 
-    are not available or the query ID is invalid, it responds with an error message and a 404 status code. 
-    The URLs and flag are deleted from storage after retrieval to maintain simplicity.
+    URLs and financial flag within the application's query storage, and returns them. If the query
+    is still being processed, the endpoint waits up to `wait` seconds for the background extraction
+    to finish. If the URLs are not available or the query ID is invalid, it responds with an error
+    message and a 404 status code. The URLs and flag are deleted from storage after retrieval to
+    maintain simplicity.
 
     Args:
         request (Request): The incoming HTTP request object.
         query_id (str): The unique identifier for the query.
+        wait (float): The maximum number of seconds to wait for a pending query (0 to answer immediately).
 
     Returns:
         JSONResponse: A response object containing the URLs and financial flag if available,
@@ -419,8 +1698,9 @@ async def get_urls(request: Request, query_id: str):
         an asynchronous lock to ensure thread-safe operations.
     Example usage:
         curl http://localhost:9000/get_urls/{query_id}
+        curl "http://localhost:9000/get_urls/{query_id}?wait=10"
     """
-    financial_flag, urls = await request.app.state.query_storage.retrieve_query(query_id)
+    financial_flag, urls = await request.app.state.query_storage.retrieve_query(query_id, wait)
     if urls is None:
         # Correctly format the response with a custom status code
         return JSONResponse(content={"error": "URLs not available yet or invalid query ID"}, status_code=404)
@@ -436,8 +1716,9 @@ async def vertexai_predict(request: Request):
     Performs sentiment analysis using Google Cloud's Vertex AI based on the provided text.
 
     This endpoint accepts a request containing text data and sends it to a pre-configured Vertex AI endpoint
-    for sentiment analysis. It requires authentication with Google Cloud using a service account. The response
-    from Vertex AI, including the sentiment and probabilities, is parsed and returned in a structured format.
+    for sentiment analysis. The endpoint client is authenticated with a service account once at startup.
+    Concurrent requests are collected into micro-batches by the PredictionBatcher and sent as a single
+    prediction call, and each request receives its own sentiment and probabilities.
 
     Args:
        request (Request): The incoming HTTP request containing the text data for prediction.
@@ -449,42 +1730,21 @@ async def vertexai_predict(request: Request):
        HTTPException: If authentication with Google Cloud fails or other request-related issues occur.
 
     Note:
-       The Vertex AI endpoint ID, project ID, and the location of the service account key are hard-coded in this
-       function. Ensure these values are correctly set before deployment.
+       The Vertex AI endpoint ID, project ID, and the location of the service account key are set by the
+       VERTEX_* constants. Ensure these values are correctly set before deployment.
 
     Example usage:
        curl -N -H "Content-Type: application/json" -d "{\"text\": \"Turnover surged to EUR61 .8 m from EUR47 .6 m due to increasing service demand , especially in the third quarter , and the overall growth of its business .\"}" "http://localhost:9000/vertexai_predict"
        """
-    ENDPOINT_ID = "7054451210648027136"
-    PROJECT_ID = "rag-detective"
-    SERVICE_ACCOUNT_FILE = './secrets/ml-workflow.json'
-
     # Load data received from your HTML file's JavaScript fetch function
     data = await request.json()
     text = data.get('text')
 
-    # Before sending to the AI Platform Prediction, convert to needed format
-    instances = [text]  # this is now a list with a single string
-
-    # Location of your service account key json file
-
-    # Authenticate and create the AI Platform (Unified) client
-    try:
-        # Load credentials from the service account file
-        credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
-        aiplatform.init(credentials=credentials)
-    except exceptions.DefaultCredentialsError:
+    batcher = request.app.state.prediction_batcher
+    if batcher is None:
         return {"error": "Couldn't authenticate with Google Cloud."}
 
-    endpoint = f'projects/{PROJECT_ID}/locations/us-central1/endpoints/{ENDPOINT_ID}'
-    response = aiplatform.Endpoint(endpoint).predict(instances=instances)
-
-    # Extract the sentiment and probabilities from the predictions
-    sentiment, probabilities = response.predictions
-
-    # Convert the sentiment to an integer
-    sentiment_value = int(sentiment[0])
-    probabilities_value = probabilities[0]
+    sentiment_value, probabilities_value = await batcher.predict(text)
 
     # Construct the response structure
     response_structure = {
@@ -514,7 +1774,8 @@ def sitemap(website:str = Query(...)):
 
     Note:
         The endpoint assumes that the sitemap is located at '[website]/sitemap.xml'. If the provided
-        URL does not follow this format, the endpoint attempts to correct it.
+        URL does not follow this format, the endpoint attempts to correct it. The parsed sitemap is kept
+        in helper.sitemap_cache, so the following /scrape_sitemap doesn't download and parse it again.
 
     Example usage:
     1. curl "http://localhost:9000/sitemap?website=ai21.com"
@@ -522,15 +1783,7 @@ def sitemap(website:str = Query(...)):
     3. curl "http://localhost:9000/sitemap?website=https://ai21.com/sitemap.xml"
     4. curl "http://localhost:9000/sitemap?website=ai21.com/"
     """
-    sitemap = website
-    if "https://" not in sitemap:
-        sitemap = f"https://{website}"
-
-    if "sitemap.xml" not in sitemap:
-        if sitemap[-1] != '/':
-            sitemap = f"{sitemap}/sitemap.xml"
-        else:
-            sitemap = f"{sitemap}sitemap.xml"
+    sitemap = helper.normalize_sitemap_url(website)
     print(sitemap)
     attribute_dict = helper.get_sitemap_attributes(sitemap)
     response_dict = {}
@@ -558,9 +1811,33 @@ async def scrape_sitemap(request: Request):
     Scrapes the sitemap of a given website and processes the scraped data.
 
     This asynchronous endpoint accepts a request containing a website URL, constructs the sitemap URL,
-    and initiates a scraping process. The sitemap is scraped, and the data is saved to Google Cloud Platform (GCP).
-    If successful, the data is also stored in a vector store (Weaviate). The function yields real-time updates of the
-    scraping process through a streaming response.
+    and initiates a scraping process. The sitemap is scraped, and the pages are stored in a vector store (Weaviate)
+    while the crawl goes on, then saved to Google Cloud Platform (GCP) as a Parquet snapshot in the background. The
+    function yields real-time updates of the scraping process through a streaming response, ending with the time
+    the ingestion and the upload took after the crawl.
+
+    The scraped pages go through a helper.build_ingestion_pipeline pipeline: chunk, embed and insert stages
+    running concurrently with the scraping and connected by bounded queues. A full queue holds back the stage
+    before it, down to the scraper, so memory stays flat whatever the size of the website; the rows of the
+    snapshot file are written to disk as they come. The snapshot becomes selectable once all its pages are
+    written, unchanged ones included; if some couldn't be, or the client goes away before the end, the
+    pipeline is stopped and the objects of the snapshot are deleted from the vector store. Every
+    PIPELINE_REPORT_INTERVAL seconds, the progress reports the depth of each queue, the throughput of each
+    stage and the number of pages queryable.
+
+    The sitemap is resolved as a stream by helper.sitemap_resolver, and its pages are scraped as soon as they
+    are found, by a ConcurrentScraper with up to SCRAPE_WORKERS pages at once and at most SCRAPE_PER_HOST_LIMIT
+    per host. Progress lines and the saved rows keep the sitemap order. While the sitemap is still being
+    resolved, the page total of the progress lines ends with a '+'.
+
+    In incremental mode (the "incremental" field of the request, SCRAPE_INCREMENTAL by default), each page is
+    compared with the most recent snapshot of the website: by its sitemap <lastmod>, by a conditional GET with
+    its previous ETag/Last-Modified, and by the hash of its extracted text. Unchanged pages are reported as
+    skipped and carried forward in the vector store without being embedded again; only new and changed pages
+    are inserted. The progress reports the new, changed and skipped counts.
+
+    The rendering strategy of the website (see helper.render_strategies) is reported once it is known, and
+    the strategies learned during the crawl are saved for the next snapshots.
 
     Args:
         request (Request): The incoming HTTP request containing the website URL.
@@ -573,69 +1850,177 @@ async def scrape_sitemap(request: Request):
 
     Note:
         The function assumes the sitemap is located at '[website]/sitemap.xml'. The scraping results are saved
-        as a CSV file in a GCP bucket. Ensure GCP credentials and Weaviate settings are properly configured.
+        as a Parquet snapshot in a GCP bucket. Ensure GCP credentials and Weaviate settings are properly configured.
 
     Example usage:
         1. curl -X POST http://localhost:9000/scrape_sitemap -H "Content-Type: application/json" -d '{"text": "bland.ai"}'
         2. curl -X POST http://localhost:9000/scrape_sitemap -H "Content-Type: application/json" -d '{"text": "chooch.com"}'
         3. curl -X POST http://localhost:9000/scrape_sitemap -H "Content-Type: application/json" -d '{"text": "https://arvinas.com/"}'
+        4. curl -X POST http://localhost:9000/scrape_sitemap -H "Content-Type: application/json" -d '{"text": "ai21.com", "incremental": false}'
     """
     data = await request.json()
-    sitemap = data.get('text')
-
-    if "https://" not in sitemap:
-        sitemap = f"https://{sitemap}"
-
-    if "sitemap.xml" not in sitemap:
-        if sitemap[-1] != '/':
-            sitemap = f"{sitemap}/sitemap.xml"
-        else:
-            sitemap = f"{sitemap}sitemap.xml"
+    sitemap = helper.normalize_sitemap_url(data.get('text'))
     print(sitemap)
-    attribute_dict = helper.get_sitemap_attributes(sitemap)
     link_split = sitemap.split('/')
     print(link_split)
     if link_split:
         website_name = link_split[2]
 
-    async def scraping_process():
-        if attribute_dict['df'].shape[0] ==0:
-            yield f"Found 0 pages to scrape in {sitemap}\n"
-
-        else:
-            text_dict = {}
-            i = 0
-            for item in list(attribute_dict['df']):
-                # Check if the item is a relative link and prepend the base URL
-                if item.startswith('/'):
-                    item = f"https://{website_name}{item}"
-                i += 1
-                yield f"{i} of {attribute_dict['df'].shape[0]}: {item}\n"
-                try:
-                    scraped_data = helper.scrape_link(item)
-                    text_dict[item] = scraped_data[item]
-                except Exception as e:
-                    yield f"Failed to scrape {item}: {e}\n"
-                    continue  # Skip this link and continue with the next one
-
-            timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
-            df = pd.DataFrame(list(text_dict.items()), columns=['key', 'text'])
-            output_file = f"{website_name}_{timestamp}.csv"
-            flag = helper.save_to_gcloud(df, output_file)
-            if flag:
-                yield f"Finished saving to GCP Bucket\n"
-                success = helper.download_blob_from_gcloud(output_file)
-                if success:
-                    yield f"Chunking and preparing documents to insert into vector store.\n"
-
-                    # Store to Weaviate and yield progress updates
-                    for update in helper.store_to_weaviate(output_file):
-                        yield update
+    incremental = data.get('incremental', SCRAPE_INCREMENTAL)
+
+    # A plain generator: StreamingResponse iterates it in a worker thread, so scraping doesn't block the event loop
+    def scraping_process():
+        # In incremental mode, pages are compared with the most recent snapshot of the website
+        previous_pages, previous_timestamp = {}, None
+        if incremental:
+            previous_timestamps = app.state.snapshot_catalog.timestamps(website_name)
+            if previous_timestamps:
+                previous_timestamp = previous_timestamps[0]
+                previous_pages = helper.load_snapshot_pages(website_name, previous_timestamp)
+                yield f"Comparing with the snapshot {previous_timestamp} of {len(previous_pages)} pages\n"
+            if not previous_pages:
+                previous_timestamp = None
+
+        # Pages are scraped while the sitemap is still being resolved; the total grows until resolution is done
+        resolution = {}
+        lastmods = {}
+        links = helper.sitemap_resolver.resolve(sitemap, resolution, lastmods)
+
+        def scrape_page(link):
+            return helper.scrape_link_incremental(link, previous_pages.get(link), lastmods.get(link))
+
+        # Pages are ingested while the crawl goes on, so the snapshot is known from the start
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+        output_file = snapshots.snapshot_filename(website_name, timestamp)
+        columns = ['text'] + helper.PAGE_STATE_COLUMNS
+        pipeline = helper.build_ingestion_pipeline()
+        yield f"Chunking and preparing documents to insert into vector store as they are scraped.\n"
+
+        # The rows of the snapshot are written to a local Parquet file a row group at a time, rather than kept in memory
+        snapshot_fd, snapshot_path = tempfile.mkstemp(suffix=snapshots.SNAPSHOT_EXTENSION)
+        os.close(snapshot_fd)
+        writer = snapshots.SnapshotWriter(snapshot_path)
+
+        # Pages are fetched concurrently, but reported and kept in sitemap order
+        scraper = ConcurrentScraper(scrape_page, SCRAPE_WORKERS, SCRAPE_PER_HOST_LIMIT)
+        statuses = {}
+        counts = {'new': 0, 'changed': 0, 'skipped': 0}
+        announced_strategies = set()
+        registered = False
+        upload = None
+        last_report = time.perf_counter()
+        try:
+            try:
+                for i, (item, page, error) in enumerate(scraper.scrape(links), start=1):
+                    total = f"{resolution['urls']}" if resolution['done'] else f"{resolution['urls']}+"
+                    try:
+                        if error is not None:
+                            raise error
+                        writer.write({'key': item, **{column: page.get(column) for column in columns}})
+                        statuses[item] = page['status']
+                        counts[page['status']] += 1
+                        yield f"{i} of {total}: {item} ({page['status']})\n"
+                        domain = urlparse(item).netloc
+                        if domain not in announced_strategies and helper.render_strategies.is_committed(domain):
+                            announced_strategies.add(domain)
+                            yield f"Rendering strategy for {domain}: {helper.render_strategies.describe(domain)}\n"
+                    except Exception as e:
+                        yield f"{i} of {total}: {item}\n"
+                        yield f"Failed to scrape {item}: {e}\n"
+                        continue  # Skip this link and continue with the next one
+
+                    # Skipped pages aren't embedded again, their chunks are copied from the previous snapshot
+                    if page['status'] != 'skipped':
+                        # Waits while the pipeline is full, so the crawl keeps to the pace of the embedding
+                        pipeline.put(helper.make_document(item, page['text'], website_name, timestamp))
+
+                    if time.perf_counter() - last_report >= PIPELINE_REPORT_INTERVAL:
+                        last_report = time.perf_counter()
+                        yield pipeline.describe() + "\n"
+            except (requests.RequestException, etree.XMLSyntaxError) as e:
+                yield f"Failed to read the sitemap {sitemap}: {helper.extract_error_message_from_exception(e)}\n"
+            writer.close()
+            crawl_finished = time.perf_counter()
+
+            # Keep the rendering strategies learned during this crawl for the next snapshots
+            helper.save_render_strategies()
+
+            if not resolution.get('urls'):
+                pipeline.finish()
+                yield f"Found 0 pages to scrape in {sitemap}\n"
 
+            else:
+                yield f"{counts['new']} new, {counts['changed']} changed and {counts['skipped']} skipped pages\n"
+
+                # The archival upload runs while the pipeline finishes the last pages
+                upload_timing = {}
+
+                def upload_snapshot():
+                    started = time.perf_counter()
+                    try:
+                        return helper.save_file_to_gcloud(snapshot_path, output_file,
+                                                          content_type='application/vnd.apache.parquet')
+                    finally:
+                        upload_timing['seconds'] = time.perf_counter() - started
+
+                upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-upload")
+                upload = upload_executor.submit(upload_snapshot)
+                upload_executor.shutdown(wait=False)
+
+                # Wait for the last pages to be written, reporting the pipeline meanwhile
+                while not pipeline.finish(timeout=PIPELINE_REPORT_INTERVAL):
+                    yield pipeline.describe() + "\n"
+                yield pipeline.describe() + "\n"
+                yield helper.describe_ingestion_result(pipeline)
+                ingestion_seconds = time.perf_counter() - crawl_finished
+
+                complete = not pipeline.failed and not pipeline.refused
+                if complete and previous_timestamp:
+                    skipped_keys = {key for key, status in statuses.items() if status == 'skipped'}
+                    try:
+                        for update in helper.carry_forward_pages(website_name, previous_timestamp, timestamp,
+                                                                 skipped_keys):
+                            yield update
+                    except Exception as e:
+                        complete = False
+                        yield (f"Failed to carry the unchanged pages forward: "
+                               f"{helper.extract_error_message_from_exception(e)}\n")
+
+                # Make the new snapshot selectable once it is complete, and drop answers cached for an earlier
+                # ingestion. An incomplete snapshot is left out of the catalog, and the previous one stays current.
+                if complete:
+                    app.state.snapshot_catalog.add_snapshot(website_name, timestamp)
+                    app.state.answer_cache.invalidate_snapshot(website_name, timestamp)
+                    registered = True
+                else:
+                    yield (f"The snapshot {timestamp} is incomplete: it wasn't added to the snapshots and its "
+                           f"pages are removed from the vector store.\n")
+
+                waited_started = time.perf_counter()
+                flag = upload.result()
+                upload_wait = time.perf_counter() - waited_started
+                if flag:
+                    yield f"Finished saving to GCP Bucket\n"
                 else:
-                    print("Error occured while downloading file to gcloud bucket.\n")
+                    yield f"Could not save the snapshot {output_file} to the GCP Bucket\n"
+                yield (f"Ingestion finished {ingestion_seconds:.1f}s after the crawl; the upload ran alongside it in "
+                       f"{upload_timing['seconds']:.1f}s and was waited for {upload_wait:.1f}s after it\n")
+        finally:
+            # An abandoned or incomplete snapshot is removed from the vector store, once the stages have stopped
+            if not registered:
+                if not pipeline.stop(timeout=PIPELINE_STOP_TIMEOUT):
+                    print(f"The ingestion of {website_name} {timestamp} didn't stop in {PIPELINE_STOP_TIMEOUT}s")
+                if pipeline.documents or previous_timestamp:
+                    try:
+                        deleted = helper.delete_snapshot_objects(website_name, timestamp)
+                        print(f"Deleted {deleted} objects of the incomplete snapshot {website_name} {timestamp}")
+                    except Exception as e:
+                        print(f"Error deleting the incomplete snapshot {website_name} {timestamp}", e)
+            writer.close()
+            if upload is not None and not upload.done():
+                upload.add_done_callback(lambda _: helper.cleanup_files(snapshot_path))
             else:
-                yield f"The scraping process did not complete as expected for {sitemap}\n"
+                helper.cleanup_files(snapshot_path)
         yield f"All steps completed successfully.\n" 
     return StreamingResponse(scraping_process(), media_type="text/plain")
 
@@ -657,3 +2042,33 @@ async def get_api_status():
     return {
         "version": "1.1"
     }
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """
+    Retrieves runtime counters of the API service.
+
+    This endpoint reports the counters kept by the long-lived components in the application state,
+    such as the query engine registry hit and miss counts.
+
+    Returns:
+       dict: A dictionary of counters grouped by component.
+
+    Example usage:
+    curl http://localhost:9000/metrics
+    """
+    return {
+        "query_engines": request.app.state.query_engines.stats(),
+        "streams": request.app.state.stream_stats.stats(),
+        "query_storage": request.app.state.query_storage.stats(),
+        "snapshot_catalog": request.app.state.snapshot_catalog.stats(),
+        "answer_cache": request.app.state.answer_cache.stats(),
+        "query_coalescer": request.app.state.query_coalescer.stats(),
+        "prediction_batcher": (request.app.state.prediction_batcher.stats()
+                               if request.app.state.prediction_batcher else None),
+        "browser_pool": helper.browser_pool.stats(),
+        "http_client": helper.http_client.stats(),
+        "sitemap_cache": helper.sitemap_cache.stats(),
+        "render_strategies": helper.render_strategies.stats(),
+        "downloads": helper.download_stats.stats()
+    }
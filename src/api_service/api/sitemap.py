@@ -0,0 +1,399 @@
+import gzip
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from lxml import etree
+
+# The number of page URLs handed over from a parsing thread at once
+URL_BATCH_SIZE = 500
+
+# Marks the end of the parsing of a sitemap in the results queue
+_SITEMAP_DONE = object()
+
+
+class StopResolving(Exception):
+    """Raised in a parsing thread when the resolution was abandoned by its caller."""
+
+
+class _PeekableStream:
+    """
+    A file-like wrapper of a response stream whose first bytes can be looked at before parsing.
+
+    io.BufferedReader can't be used because urllib3 reports the stream closed as soon as the body was
+    read into the buffer.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._head = b''
+
+    def peek(self, size: int) -> bytes:
+        """Returns the first `size` bytes of the stream without consuming them."""
+        while len(self._head) < size:
+            chunk = self._raw.read(size - len(self._head))
+            if not chunk:
+                break
+            self._head += chunk
+        return self._head[:size]
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads from the stream, starting with the peeked bytes."""
+        if not self._head:
+            return self._raw.read(size)
+        if size < 0:
+            head, self._head = self._head, b''
+            return head + self._raw.read()
+        head, self._head = self._head[:size], self._head[size:]
+        return head
+
+
+def _localname(tag) -> str:
+    """Returns the tag of an element without its namespace."""
+    return etree.QName(tag).localname if isinstance(tag, str) else ""
+
+
+def is_sitemap_link(link: str) -> bool:
+    """Returns whether a link found in a sitemap points to another sitemap rather than to a page."""
+    link = link.lower()
+    return link.endswith('.xml') or link.endswith('.xml.gz')
+
+
+class CachedSitemap:
+    """
+    The parsed content of a sitemap document with the validators of the response it was parsed from.
+
+    Attributes:
+        pages (list): The (URL, lastmod) pairs of the pages listed by the sitemap, without the skipped ones.
+        child_sitemaps (list): The URLs of the sitemaps it links to.
+        etag (str): The ETag of the response, or None.
+        last_modified (str): The Last-Modified header of the response, or None.
+        validated_at (float): When the content was last fetched or revalidated (time.time()).
+    """
+
+    def __init__(self, pages: list, child_sitemaps: list, etag: str, last_modified: str):
+        self.pages = pages
+        self.child_sitemaps = child_sitemaps
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = time.time()
+
+
+class SitemapCache:
+    """
+    A class for caching parsed sitemap documents between resolutions.
+
+    The frontend previews a sitemap with /sitemap and then scrapes it with /scrape_sitemap, so every sitemap
+    would otherwise be downloaded and parsed twice. An entry younger than the TTL is used without any request.
+    An older one is revalidated with a conditional GET (If-None-Match / If-Modified-Since), and reused on a
+    304 Not Modified. Entries are keyed by the sitemap URL and evicted least recently used first.
+
+    Attributes:
+        _entries (OrderedDict): Cached sitemaps keyed by URL, least recently used first.
+        _max_size (int): The maximum number of cached sitemap documents.
+        _ttl (float): The number of seconds an entry is used without revalidation.
+        _lock (threading.Lock): A lock protecting the cache, since it is used from the resolver threads.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 600):
+        """
+        Initializes an empty sitemap cache.
+
+        Args:
+            max_size (int): The maximum number of cached sitemap documents.
+            ttl (float): The number of seconds an entry is used without revalidation.
+        """
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._fresh_hits = 0
+        self._revalidated = 0
+        self._misses = 0
+
+    def get(self, url: str):
+        """
+        Looks up a sitemap.
+
+        Args:
+            url (str): The URL of the sitemap.
+
+        Returns:
+            tuple: The cached sitemap (or None) and whether it is still fresh, i.e. usable without revalidation.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                self._misses += 1
+                return None, False
+            self._entries.move_to_end(url)
+            fresh = time.time() - entry.validated_at < self._ttl
+            if fresh:
+                self._fresh_hits += 1
+            return entry, fresh
+
+    def store(self, url: str, entry: CachedSitemap):
+        """Caches a freshly parsed sitemap, evicting the least recently used one when full."""
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def mark_revalidated(self, entry: CachedSitemap):
+        """Records that the server confirmed a cached sitemap is unchanged."""
+        with self._lock:
+            entry.validated_at = time.time()
+            self._revalidated += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The number of cached sitemaps, fresh hits, 304 revalidations and misses.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "fresh_hits": self._fresh_hits,
+                "revalidated": self._revalidated,
+                "misses": self._misses,
+            }
+
+
+class SitemapResolver:
+    """
+    A class for resolving a sitemap into the URLs of its pages, following sitemap indexes to any depth.
+
+    The child sitemaps of an index are fetched concurrently by a thread pool, and each document is parsed
+    incrementally with lxml's iterparse straight from the response stream, clearing the parsed elements, so
+    no DOM of the whole sitemap is ever built. Gzipped sitemaps (.xml.gz) are decompressed on the fly. A
+    sitemap already visited during a resolution is skipped, so cyclic indexes terminate. Page URLs are
+    yielded as soon as they are parsed, so scraping can start before the resolution finishes. When a cache
+    is given, parsed documents are kept in it and revalidated with conditional GETs on later resolutions.
+
+    Attributes:
+        _http_client (HttpClient): The client fetching the sitemaps.
+        _max_workers (int): The maximum number of sitemaps fetched and parsed at the same time.
+        _max_depth (int): The maximum nesting depth of sitemap indexes followed.
+        _skip_url (Callable): A predicate of the page URLs to leave out, e.g. images.
+        _cache (SitemapCache): The cache of parsed sitemaps, or None.
+    """
+
+    def __init__(self, http_client, max_workers: int = 8, max_depth: int = 10, skip_url=None,
+                 cache: SitemapCache = None):
+        """
+        Initializes the resolver.
+
+        Args:
+            http_client (HttpClient): The client fetching the sitemaps.
+            max_workers (int): The maximum number of sitemaps fetched and parsed at the same time.
+            max_depth (int): The maximum nesting depth of sitemap indexes followed.
+            skip_url (Callable): A predicate of the page URLs to leave out. Defaults to keeping all of them.
+            cache (SitemapCache, optional): The cache of parsed sitemaps.
+        """
+        self._http_client = http_client
+        self._max_workers = max_workers
+        self._max_depth = max_depth
+        self._skip_url = skip_url or (lambda url: False)
+        self._cache = cache
+
+    def _parse(self, url: str, on_urls, on_sitemap):
+        """
+        Fetches and parses a sitemap incrementally, reporting its page URLs in batches and its child sitemaps.
+
+        A fresh cached copy is replayed without any request, and a stale one is revalidated with a conditional
+        GET and replayed if the server answers 304 Not Modified.
+
+        Args:
+            url (str): The URL of the sitemap.
+            on_urls (Callable): Called with each batch of (page URL, lastmod) pairs, lastmod being None if absent.
+            on_sitemap (Callable): Called with the URL of each child sitemap.
+
+        Raises:
+            requests.RequestException: If the sitemap can't be fetched.
+            etree.XMLSyntaxError: If the sitemap is not well-formed XML.
+        """
+        cached, fresh = self._cache.get(url) if self._cache else (None, False)
+        if cached is not None and fresh:
+            self._replay(cached, on_urls, on_sitemap)
+            return
+
+        conditional_headers = {}
+        if cached is not None:
+            if cached.etag:
+                conditional_headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                conditional_headers['If-Modified-Since'] = cached.last_modified
+
+        with self._http_client.get(url, stream=True, headers=conditional_headers) as response:
+            if cached is not None and response.status_code == 304:
+                self._cache.mark_revalidated(cached)
+                self._replay(cached, on_urls, on_sitemap)
+                return
+            response.raise_for_status()
+            stream = _PeekableStream(self._http_client.raw_reader(response))
+            # The document itself may be gzipped, e.g. sitemap.xml.gz served as application/octet-stream
+            if stream.peek(2) == b'\x1f\x8b':
+                stream = gzip.GzipFile(fileobj=stream)
+
+            pages, child_sitemaps = [], []
+            is_index = None
+            batch = []
+            loc, lastmod = None, None
+
+            def add_page():
+                nonlocal batch
+                if is_sitemap_link(loc):
+                    child_sitemaps.append(loc)
+                    on_sitemap(loc)
+                elif not self._skip_url(loc):
+                    pages.append((loc, lastmod))
+                    batch.append((loc, lastmod))
+                    if len(batch) >= URL_BATCH_SIZE:
+                        on_urls(batch)
+                        batch = []
+
+            parser = etree.iterparse(stream, events=('start', 'end'), resolve_entities=False,
+                                     no_network=True, huge_tree=True)
+            for event, element in parser:
+                name = _localname(element.tag)
+                if event == 'start':
+                    if is_index is None:
+                        is_index = name == 'sitemapindex'
+                    continue
+                if name == 'loc':
+                    link = (element.text or '').strip()
+                    if not link:
+                        continue
+                    if is_index:
+                        child_sitemaps.append(link)
+                        on_sitemap(link)
+                    else:
+                        if loc is not None:
+                            # A <loc> without a <url> around it
+                            add_page()
+                            lastmod = None
+                        loc = link
+                elif name == 'lastmod':
+                    lastmod = (element.text or '').strip() or None
+                elif name in ('url', 'sitemap'):
+                    if name == 'url' and loc is not None:
+                        add_page()
+                    loc, lastmod = None, None
+                    # Drop the parsed entries so memory stays flat on huge sitemaps
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+            if loc is not None:
+                add_page()
+            if batch:
+                on_urls(batch)
+
+            if self._cache is not None:
+                self._cache.store(url, CachedSitemap(pages, child_sitemaps, response.headers.get('ETag'),
+                                                     response.headers.get('Last-Modified')))
+
+    @staticmethod
+    def _replay(cached: CachedSitemap, on_urls, on_sitemap):
+        """Reports the page URLs and child sitemaps of a cached sitemap as if it was just parsed."""
+        for i in range(0, len(cached.pages), URL_BATCH_SIZE):
+            on_urls(cached.pages[i:i + URL_BATCH_SIZE])
+        for link in cached.child_sitemaps:
+            on_sitemap(link)
+
+    def resolve(self, url: str, stats: dict = None, lastmods: dict = None):
+        """
+        Resolves a sitemap into the URLs of its pages, yielding them as they are parsed.
+
+        The root sitemap must be fetched successfully, otherwise its error is raised. A child sitemap that
+        fails is reported and skipped. The page URLs are unique and in the order they were parsed, which
+        follows the document order within each sitemap. Relative URLs, e.g. '/pricing', are resolved against
+        the URL of the sitemap listing them, so the yielded URLs and the keys of `lastmods` are absolute.
+
+        Args:
+            url (str): The URL of the root sitemap or sitemap index.
+            stats (dict): An optional dictionary updated while resolving with the number of 'sitemaps'
+                          parsed, whether the root was 'nested' and the 'urls' found so far.
+            lastmods (dict): An optional dictionary filled with the <lastmod> of the page URLs that have one.
+                             A URL's entry is set before the URL is yielded.
+
+        Yields:
+            str: The URL of each page.
+
+        Raises:
+            requests.RequestException: If the root sitemap can't be fetched.
+
+        Example usage:
+            for page_url in helper.sitemap_resolver.resolve("https://ai21.com/sitemap.xml"):
+                print(page_url)
+        """
+        stats = stats if stats is not None else {}
+        stats.update({'sitemaps': 0, 'nested': False, 'urls': 0, 'done': False})
+        results = queue.Queue()
+        visited = {url}
+        visited_lock = threading.Lock()
+        pending = 1
+        cancelled = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="sitemap")
+
+        def parse(sitemap_url, depth):
+            def on_sitemap(child_url):
+                child_url = urljoin(sitemap_url, child_url)
+                if depth >= self._max_depth:
+                    print(f"Skipping sitemap {child_url}: deeper than {self._max_depth} levels")
+                    return
+                with visited_lock:
+                    if child_url in visited:
+                        return
+                    visited.add(child_url)
+                # Counted before this sitemap reports done, so the resolution can't end early
+                results.put(('child', None))
+                pool.submit(parse, child_url, depth + 1)
+
+            def on_urls(batch):
+                if cancelled.is_set():
+                    # The caller stopped iterating, there is no point in parsing the rest
+                    raise StopResolving()
+                results.put(('urls', [(urljoin(sitemap_url, link), lastmod) for link, lastmod in batch]))
+
+            try:
+                if not cancelled.is_set():
+                    self._parse(sitemap_url, on_urls, on_sitemap)
+                results.put((_SITEMAP_DONE, (sitemap_url, depth, None)))
+            except Exception as e:
+                results.put((_SITEMAP_DONE, (sitemap_url, depth, e)))
+
+        seen = set()
+        try:
+            pool.submit(parse, url, 0)
+            while pending:
+                kind, value = results.get()
+                if kind == 'child':
+                    pending += 1
+                    stats['nested'] = True
+                elif kind == 'urls':
+                    for link, lastmod in value:
+                        if link not in seen:
+                            if lastmods is not None and lastmod:
+                                lastmods[link] = lastmod
+                            seen.add(link)
+                            stats['urls'] += 1
+                            yield link
+                else:
+                    pending -= 1
+                    sitemap_url, depth, error = value
+                    if error is not None:
+                        if depth == 0:
+                            raise error
+                        print(f"Error occurred while processing {sitemap_url}: {error}")
+                    else:
+                        stats['sitemaps'] += 1
+            stats['done'] = True
+        finally:
+            cancelled.set()
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# The extension of the snapshot files written since the Parquet format. Older snapshots are CSV files.
+SNAPSHOT_EXTENSION = ".parquet"
+LEGACY_SNAPSHOT_EXTENSION = ".csv"
+
+# The columns of a Parquet snapshot: the page URL ('key') and its text, then the metadata of the scraped
+# version of the page. CSV snapshots only have 'key' and 'text', or those and the first four metadata columns.
+SNAPSHOT_SCHEMA = pa.schema([
+    ("key", pa.string()),
+    ("text", pa.string()),
+    ("lastmod", pa.string()),
+    ("etag", pa.string()),
+    ("last_modified", pa.string()),
+    ("content_hash", pa.string()),
+    ("fetched_at", pa.timestamp("s", tz="UTC")),
+    ("extraction", pa.string()),
+    ("byte_size", pa.int64()),
+])
+
+# The number of pages per row group, i.e. per unit a reader streams
+SNAPSHOT_ROW_GROUP_SIZE = 500
+
+
+def snapshot_filename(website_name: str, timestamp: str, extension: str = SNAPSHOT_EXTENSION) -> str:
+    """
+    Returns the name of the snapshot file of a website.
+
+    Args:
+        website_name (str): The website address.
+        timestamp (str): The timestamp of the snapshot.
+        extension (str): SNAPSHOT_EXTENSION, or LEGACY_SNAPSHOT_EXTENSION for an older snapshot.
+
+    Returns:
+        str: The file name, e.g. 'ai21.com_2023-11-20T10-00-00.parquet'.
+    """
+    return f"{website_name}_{timestamp}{extension}"
+
+
+class SnapshotWriter:
+    """
+    A class for writing a Parquet snapshot a page at a time, without holding the whole website in memory.
+
+    Pages are buffered until a row group is full, then written as a zstd-compressed row group.
+
+    Attributes:
+        _writer (pyarrow.parquet.ParquetWriter): The writer of the file.
+        _row_group_size (int): The number of pages per row group.
+        _rows (list): The pages buffered for the next row group.
+        rows_written (int): The number of pages written so far.
+    """
+
+    def __init__(self, path: str, row_group_size: int = SNAPSHOT_ROW_GROUP_SIZE):
+        """
+        Opens a snapshot file for writing.
+
+        Args:
+            path (str): The path of the file, overwritten if it exists.
+            row_group_size (int): The number of pages per row group.
+        """
+        self._writer = pq.ParquetWriter(path, SNAPSHOT_SCHEMA, compression="zstd")
+        self._row_group_size = row_group_size
+        self._rows = []
+        self.rows_written = 0
+
+    def write(self, page: dict):
+        """
+        Adds a page to the snapshot.
+
+        Args:
+            page (dict): The page, with the columns of SNAPSHOT_SCHEMA. Missing columns are written as nulls.
+        """
+        self._rows.append(page)
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        """Writes the buffered pages as a row group."""
+        if self._rows:
+            table = pa.Table.from_pylist(self._rows, schema=SNAPSHOT_SCHEMA)
+            self._writer.write_table(table, row_group_size=self._row_group_size)
+            self.rows_written += len(self._rows)
+            self._rows = []
+
+    def close(self):
+        """Writes the last row group and closes the file."""
+        if self._writer is not None:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_snapshot(df: pd.DataFrame, path: str, row_group_size: int = SNAPSHOT_ROW_GROUP_SIZE):
+    """
+    Writes a DataFrame of pages as a Parquet snapshot.
+
+    Args:
+        df (pandas.DataFrame): The pages, with at least the 'key' and 'text' columns.
+        path (str or file-like): The path of the file, or a binary buffer to write to.
+        row_group_size (int): The number of pages per row group.
+    """
+    # Columns missing from the DataFrame, and missing values, are written as nulls
+    frame = df.reindex(columns=SNAPSHOT_SCHEMA.names).astype(object)
+    frame = frame.where(frame.notna(), None)
+    table = pa.Table.from_pandas(frame, schema=SNAPSHOT_SCHEMA, preserve_index=False)
+    pq.write_table(table, path, row_group_size=row_group_size, compression="zstd")
+
+
+def iter_snapshot_batches(path: str, columns: list = None, batch_size: int = SNAPSHOT_ROW_GROUP_SIZE):
+    """
+    Streams the pages of a snapshot file in batches, Parquet or CSV alike.
+
+    A Parquet snapshot is read a row group at a time, and only the requested columns are decoded. A CSV
+    snapshot, written before the Parquet format, is read in chunks of `batch_size` rows with every value as
+    a string and empty values as empty strings.
+
+    Args:
+        path (str): The path of the snapshot file, ending with SNAPSHOT_EXTENSION or LEGACY_SNAPSHOT_EXTENSION.
+        columns (list, optional): The columns to read. Defaults to all of them. The columns missing from an
+                                  older snapshot are left out of its pages.
+        batch_size (int): The maximum number of pages per batch.
+
+    Yields:
+        list: The pages of the batch, as dictionaries keyed by column.
+    """
+    if path.endswith(LEGACY_SNAPSHOT_EXTENSION):
+        usecols = None if columns is None else (lambda column: column in columns)
+        for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=batch_size, usecols=usecols):
+            yield chunk.to_dict('records')
+        return
+
+    parquet_file = pq.ParquetFile(path)
+    if columns is not None:
+        columns = [column for column in columns if column in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pylist()
@@ -0,0 +1,183 @@
+"""
+Benchmarks ingesting a website into the vector store: the IngestionPipeline with its BatchIngestor against
+the per-document path it replaced, `index.insert(document)` for one page after the other.
+
+Weaviate is replaced by a local stand-in, an http.server answering the REST calls of the Weaviate client
+(meta, schema and batch objects) after a latency per request and per object. The embedding model is replaced
+by a fake one waiting a latency per request and per text, like the OpenAI embeddings. Both paths write
+through the real weaviate.Client and llama_index index, and the benchmark checks they write the same objects.
+
+Usage, from src/api_service:
+    python benchmarks/bench_ingestion.py --pages 200 --embed-latency 0.2 --write-latency 0.02
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import weaviate
+from llama_index import Document, ServiceContext, VectorStoreIndex
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.vector_stores import WeaviateVectorStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_APIKEY", "benchmark")
+from api import helper  # noqa: E402
+from api.ingestion import BatchIngestor, IngestionPipeline  # noqa: E402
+
+
+class WeaviateStandIn(BaseHTTPRequestHandler):
+    """Answers the REST calls of weaviate.Client used by the ingestion, keeping the objects written."""
+
+    def _reply(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/meta"):
+            self._reply({"version": "1.22.0"})
+        elif self.path.startswith("/v1/schema"):
+            self._reply({"classes": [{"class": "Pages", "properties": []}]})
+        elif self.path.startswith("/v1/nodes"):
+            # Without batch statistics, the client keeps its batch size as configured
+            self._reply({"nodes": [{"name": "stand-in", "status": "HEALTHY", "stats": {}}]})
+        elif self.path.startswith("/v1/.well-known"):
+            self._reply({}, 404 if "openid" in self.path else 200)
+        else:
+            self._reply({}, 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.startswith("/v1/batch/objects"):
+            objects = body["objects"]
+            time.sleep(self.server.write_latency + self.server.object_latency * len(objects))
+            with self.server.lock:
+                self.server.requests += 1
+                self.server.objects.extend(objects)
+            self._reply([{**obj, "result": {}} for obj in objects])
+        else:
+            self._reply({}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(write_latency: float, object_latency: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WeaviateStandIn)
+    server.daemon_threads = True
+    server.write_latency = write_latency
+    server.object_latency = object_latency
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.objects = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeEmbedding(BaseEmbedding):
+    """An embedding model waiting like a remote one, with vectors derived from the texts."""
+
+    latency: float = 0.2
+    text_latency: float = 0.001
+    requests: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _get_text_embeddings(self, texts):
+        self.requests += 1
+        time.sleep(self.latency + self.text_latency * len(texts))
+        return [[float(len(text)), float(sum(map(ord, text[:32]))), 1.0] for text in texts]
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query):
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_text_embedding(query)
+
+
+def build_index(client, embed_latency: float):
+    embed_model = FakeEmbedding(latency=embed_latency, embed_batch_size=helper.INGEST_EMBED_BATCH_SIZE)
+    service_context = ServiceContext.from_defaults(embed_model=embed_model, llm=None)
+    vector_store = WeaviateVectorStore(weaviate_client=client, index_name="Pages", text_key="text")
+    return VectorStoreIndex.from_vector_store(vector_store, service_context=service_context), embed_model
+
+
+def make_documents(pages: int):
+    # Pages of a few hundred to a few thousand words, i.e. one to several chunks
+    return [helper.make_document(f"https://example.com/page/{i}",
+                                 " ".join(f"word{i}-{j}" for j in range(300 + 700 * (i % 4))),
+                                 "example.com", "2023-11-20T10-00-00")
+            for i in range(pages)]
+
+
+def ingest_per_document(client, embed_latency: float, pages: int):
+    """The ingestion before BatchIngestor: each page chunked, embedded and written on its own."""
+    index, embed_model = build_index(client, embed_latency)
+    for document in make_documents(pages):
+        index.insert(document)
+    return embed_model.requests
+
+
+def ingest_pipeline(client, embed_latency: float, pages: int):
+    index, embed_model = build_index(client, embed_latency)
+    ingestor = BatchIngestor(client, index,
+                             embed_batch_size=helper.INGEST_EMBED_BATCH_SIZE, embed_workers=helper.INGEST_EMBED_WORKERS,
+                             batch_size=helper.INGEST_BATCH_SIZE, batch_workers=helper.INGEST_BATCH_WORKERS)
+    pipeline = IngestionPipeline(ingestor, queue_size=helper.INGEST_QUEUE_SIZE,
+                                 flush_interval=helper.INGEST_FLUSH_INTERVAL)
+    pipeline.start()
+    for document in make_documents(pages):
+        pipeline.put(document)
+    pipeline.finish()
+    assert pipeline.inserted == pages and not pipeline.failed, pipeline.describe()
+    return embed_model.requests
+
+
+def run(path, args):
+    server = start_stand_in(args.write_latency, args.object_latency)
+    client = weaviate.Client(url=f"http://127.0.0.1:{server.server_address[1]}")
+    started = time.perf_counter()
+    embed_requests = path(client, args.embed_latency, args.pages)
+    seconds = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+    written = sorted((obj["properties"]["ref_doc_id"], obj["properties"]["text"], tuple(obj["vector"]))
+                     for obj in server.objects)
+    return seconds, embed_requests, server.requests, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--embed-latency", type=float, default=0.2, help="Seconds per embedding request")
+    parser.add_argument("--write-latency", type=float, default=0.02, help="Seconds per Weaviate batch request")
+    parser.add_argument("--object-latency", type=float, default=0.0002, help="Seconds per object written")
+    args = parser.parse_args()
+
+    per_document = run(ingest_per_document, args)
+    pipeline = run(ingest_pipeline, args)
+    assert per_document[3] == pipeline[3], "the two paths wrote different objects"
+
+    print(f"{args.pages} pages, {len(pipeline[3])} chunks; embedding {args.embed_latency}s per request, "
+          f"Weaviate {args.write_latency}s per batch request")
+    for name, (seconds, embed_requests, write_requests, _) in (("per-document", per_document),
+                                                                ("pipeline", pipeline)):
+        print(f"{name:>12}: {seconds:6.2f}s, {args.pages / seconds:6.1f} pages/s, "
+              f"{embed_requests} embedding requests, {write_requests} Weaviate requests")
+    print(f"{per_document[0] / pipeline[0]:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmarks the wait of the Selenium fallback before reading a rendered page: wait_until_ready (one in-page
+readiness script) against the waits it replaced, the WebDriverWait polling is_displayed() on every div of
+the scraper, and no wait at all beyond the implicit one, as the API did.
+
+The pages are served by a local fixture HTTP server (http.server):
+    - /static: a server-rendered page with many divs, where per-div polling costs a WebDriver round trip per div;
+    - /late: a client-rendered page whose text is inserted by a script after LATE_MS milliseconds, which a
+      read right after the load misses.
+Every page is rendered in a warm session of a BrowserPool, so Chrome's start is not measured. The benchmark
+reports the median render time and the words read for each wait and page. It needs Chrome and chromedriver.
+
+Usage, from src/api_service:
+    python benchmarks/bench_rendering.py --divs 2000 --late-ms 1500 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from selenium.webdriver.chrome.options import ChromiumOptions
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.wait import WebDriverWait
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.browser_pool import BrowserPool, wait_until_ready  # noqa: E402
+from api.extraction import extract_html_text  # noqa: E402
+
+
+def static_page(divs: int) -> bytes:
+    return ("<html><body>" + "".join(f"<div><p>Paragraph {i} of the page.</p></div>" for i in range(divs))
+            + "</body></html>").encode()
+
+
+def late_page(late_ms: int) -> bytes:
+    text = " ".join(f"word{i}" for i in range(300))
+    return ("<html><body><div id='app'>Loading</div><script>"
+            f"setTimeout(function () {{ document.getElementById('app').innerHTML = '<p>{text}</p>'; }}, {late_ms});"
+            "</script></body></html>").encode()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.pages.get(self.path)
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body or b"")))
+        self.end_headers()
+        self.wfile.write(body or b"")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def wait_none(browser):
+    """The API's fallback before wait_until_ready: the page was read as soon as get() returned."""
+
+
+def wait_div_polling(browser):
+    """The scraper's wait before wait_until_ready: is_displayed() on the html element and on every div."""
+    WebDriverWait(browser, timeout=30).until(
+        lambda driver: driver.find_element(By.TAG_NAME, 'html').is_displayed()
+        and all(div.is_displayed() for div in driver.find_elements(By.TAG_NAME, 'div')))
+
+
+def wait_readiness(browser):
+    wait_until_ready(browser, quiet_period=0.5, timeout=10)
+
+
+WAITS = {"none": wait_none, "div polling": wait_div_polling, "readiness": wait_readiness}
+
+
+def render(pool: BrowserPool, url: str, wait):
+    with pool.page() as browser:
+        started = time.perf_counter()
+        browser.get(url)
+        wait(browser)
+        page_source = browser.page_source
+        seconds = time.perf_counter() - started
+    return seconds, len(extract_html_text(page_source).split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--divs", type=int, default=2000)
+    parser.add_argument("--late-ms", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    server.pages = {"/static": static_page(args.divs), "/late": late_page(args.late_ms)}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    options = ChromiumOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    pool = BrowserPool(options, size=1, max_pages=1000)
+    try:
+        # Starts the session before timing
+        render(pool, f"{base}/static", wait_none)
+        print(f"/static: {args.divs} divs; /late: text inserted after {args.late_ms}ms; median of {args.repeat}")
+        print(f"{'page':>8} {'wait':>12} {'seconds':>8} {'words':>6}")
+        for path in ("/static", "/late"):
+            for name, wait in WAITS.items():
+                runs = [render(pool, base + path, wait) for _ in range(args.repeat)]
+                print(f"{path:>8} {name:>12} {statistics.median(s for s, _ in runs):>8.2f} "
+                      f"{min(w for _, w in runs):>6}")
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmarks scraping the pages of a sitemap: ConcurrentScraper (SCRAPE_WORKERS threads, at most
+SCRAPE_PER_HOST_LIMIT per host) against the sequential loop it replaced, both calling helper.scrape_link.
+
+The pages are served by a local fixture HTTP server (http.server) answering after an artificial delay, on two
+host names (127.0.0.1 and localhost) so the per-host limit applies. The pages have enough text for requests,
+so nothing is rendered.
+
+Usage, from src/api_service:
+    python benchmarks/bench_scraping.py --pages 200 --delay 0.1 --workers 8 --per-host 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_APIKEY", "benchmark")
+from api import helper  # noqa: E402
+from api.scraping import ConcurrentScraper  # noqa: E402
+
+PAGE = ("<html><head><title>Fixture</title></head><body><nav>Home About</nav><main>"
+        + "<p>" + " ".join(f"word{i}" for i in range(300)) + "</p>"
+        + "</main><footer>Footer</footer></body></html>").encode()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves the same HTML page at every path, after the delay of the server."""
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(delay: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def scrape_sequentially(links):
+    """The loop of /scrape_sitemap before ConcurrentScraper: one page after the other."""
+    return [helper.scrape_link(link)[link] for link in links]
+
+
+def scrape_concurrently(links, workers: int, per_host: int):
+    scraper = ConcurrentScraper(helper.scrape_link, workers, per_host)
+    return [page[link] for link, page, error in scraper.scrape(links)]
+
+
+def timed(function, *args):
+    # scrape_link prints every link it fetches
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        texts = function(*args)
+        return time.perf_counter() - started, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.1, help="Seconds the server waits before each answer")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=4)
+    args = parser.parse_args()
+
+    server = start_fixture_server(args.delay)
+    port = server.server_address[1]
+    links = [f"http://{host}:{port}/page/{i}" for i in range(args.pages // 2) for host in ("127.0.0.1", "localhost")]
+
+    # Starts the extraction processes and the connections before timing
+    timed(scrape_sequentially, links[:2])
+
+    sequential_s, sequential_texts = timed(scrape_sequentially, links)
+    concurrent_s, concurrent_texts = timed(scrape_concurrently, links, args.workers, args.per_host)
+    server.shutdown()
+    server.server_close()
+    assert sequential_texts == concurrent_texts and all(sequential_texts)
+
+    print(f"{len(links)} pages on 2 hosts, {args.delay}s per response, {args.workers} workers, "
+          f"{args.per_host} per host")
+    print(f"sequential: {sequential_s:.2f}s ({len(links) / sequential_s:.1f} pages/s)")
+    print(f"concurrent: {concurrent_s:.2f}s ({len(links) / concurrent_s:.1f} pages/s), "
+          f"{sequential_s / concurrent_s:.1f}x faster")
+    print(f"connections opened: {helper.http_client.stats()['connections_opened']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmarks concurrent token streams on a single uvicorn worker: the executor bridge of /rag_query
+(service.iterate_in_executor) against the blocking generator iterated on the event loop, as before.
+
+Each stream is a fake LLM generation yielding TOKENS tokens with a blocking pause between them. Every mode
+starts its own uvicorn server with one worker, opens the streams concurrently and reports the wall time,
+the time to the first token of the streams and the latency of a /status request sent mid-way.
+
+Usage, from src/api_service:
+    python benchmarks/bench_streaming.py --streams 10 50 100 --tokens 20 --delay 0.05
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_APIKEY", "benchmark")
+from api.service import QUERY_WORKERS, iterate_in_executor  # noqa: E402
+
+
+def fake_generation(tokens: int, delay: float):
+    """A blocking token generator, like the 'response_gen' of a llama_index streaming response."""
+    for i in range(tokens):
+        time.sleep(delay)
+        yield f"token{i} "
+
+
+def build_app(mode: str, tokens: int, delay: float) -> FastAPI:
+    app = FastAPI()
+    executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS)
+
+    @app.get("/status")
+    async def status():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        if mode == "executor":
+            async def segments():
+                async for text in iterate_in_executor(executor, fake_generation(tokens, delay)):
+                    yield text
+        else:
+            # The generator before the executor bridge: each token blocks the event loop
+            async def segments():
+                for text in fake_generation(tokens, delay):
+                    yield text
+        return StreamingResponse(segments(), media_type="text/plain")
+
+    return app
+
+
+def run_server(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, workers=1, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def open_stream(url: str):
+    """Reads a stream, returning the times of its first token and of its end, from the request."""
+    started = time.perf_counter()
+    first = None
+    with requests.get(url, stream=True, timeout=600) as response:
+        for chunk in response.iter_content(chunk_size=None):
+            if first is None and chunk:
+                first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def run_mode(mode: str, streams: int, tokens: int, delay: float, port: int) -> dict:
+    server = run_server(build_app(mode, tokens, delay), port)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=streams + 1) as clients:
+            futures = [clients.submit(open_stream, f"{base}/stream") for _ in range(streams)]
+            # A request for another endpoint while the streams are running
+            time.sleep(tokens * delay / 2)
+            probe_started = time.perf_counter()
+            requests.get(f"{base}/status", timeout=600)
+            status_latency = time.perf_counter() - probe_started
+            results = [future.result() for future in futures]
+        wall = time.perf_counter() - started
+    finally:
+        server.should_exit = True
+    first_tokens = sorted(first for first, _ in results)
+    return {
+        "mode": mode,
+        "streams": streams,
+        "wall_s": round(wall, 2),
+        "first_token_median_s": round(statistics.median(first_tokens), 2),
+        "first_token_max_s": round(first_tokens[-1], 2),
+        "status_latency_s": round(status_latency, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds between two tokens")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    print(f"{args.tokens} tokens per stream, {args.delay}s apart: {args.tokens * args.delay:.1f}s per stream alone")
+    print(f"{'mode':>9} {'streams':>7} {'wall_s':>7} {'ttft_med':>8} {'ttft_max':>8} {'status_s':>8}")
+    port = args.port
+    for streams in args.streams:
+        for mode in ("blocking", "executor"):
+            result = run_mode(mode, streams, args.tokens, args.delay, port)
+            port += 1
+            print(f"{result['mode']:>9} {result['streams']:>7} {result['wall_s']:>7} "
+                  f"{result['first_token_median_s']:>8} {result['first_token_max_s']:>8} "
+                  f"{result['status_latency_s']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the service as the container runs it, from src/api_service
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The service copies the OpenAI key into the environment at import time
+os.environ.setdefault("OPENAI_APIKEY", "test")
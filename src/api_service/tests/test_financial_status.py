@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.service import FinancialStatus, InFlightQuery
+
+# The token streams of the test: the financial marker whole, split across two tokens, at the start and at the
+# end, and the non-financial streams with a lone "Q", including a trailing one that is held back until the end
+STREAMS = [
+    (["QQ", "Revenue", " grew", " 12%."], True),
+    (["Revenue", " grew", " 12%.", "QQ"], True),
+    (["Revenue", " grew", "Q", "Q", " 12%."], True),
+    (["Revenue", " grew Q", "Q 12%."], True),
+    (["The", " Q3", " report", " is", " out."], False),
+    (["The", " answer", " is", " Q"], False),
+    (["Q"], False),
+    (["Ask", " about", " Q", "uarterly", " results"], False),
+    (["Plain", " answer", " without", " marker."], False),
+]
+
+
+class FakeStreamingResponse:
+    """A streaming response whose generation yields the tokens from a worker thread, with short pauses."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    @property
+    def response_gen(self):
+        for token in self.tokens:
+            time.sleep(random.uniform(0, 0.002))
+            yield token
+
+
+async def consume(flight):
+    """Follows a query like process_streaming_response, returning the sent text and the financial flag."""
+    financial_status = FinancialStatus()
+    flight.join()
+    sent = []
+    try:
+        async for segment in flight.subscribe():
+            text = financial_status.strip_marker(segment)
+            if text:
+                sent.append(text)
+            # Lets the other streams interleave with this one
+            await asyncio.sleep(0)
+        sent.append(financial_status.flush())
+    finally:
+        flight.leave()
+    return "".join(sent), financial_status.is_financial()
+
+
+async def run_streams(count, subscribers):
+    executor = ThreadPoolExecutor(max_workers=32)
+    try:
+        cases = [STREAMS[i % len(STREAMS)] for i in range(count)]
+        flights = []
+        for tokens, _ in cases:
+            flight = InFlightQuery()
+
+            async def retrieve(tokens=tokens):
+                return FakeStreamingResponse(tokens), None
+
+            flight.task = asyncio.create_task(flight.run(retrieve, executor))
+            flights.append(flight)
+        results = await asyncio.gather(*(consume(flight) for flight in flights for _ in range(subscribers)))
+        await asyncio.gather(*(flight.task for flight in flights))
+    finally:
+        executor.shutdown()
+    return [(case, results[i * subscribers:(i + 1) * subscribers]) for i, case in enumerate(cases)]
+
+
+def test_concurrent_streams_flag_and_strip_the_marker():
+    for (tokens, financial), results in asyncio.run(run_streams(count=400, subscribers=1)):
+        for text, flag in results:
+            assert flag is financial, tokens
+            assert text == "".join(tokens).replace("QQ", ""), tokens
+
+
+def test_shared_streams_flag_each_subscriber():
+    for (tokens, financial), results in asyncio.run(run_streams(count=150, subscribers=3)):
+        for text, flag in results:
+            assert flag is financial, tokens
+            assert text == "".join(tokens).replace("QQ", ""), tokens
+
+
+def test_trailing_q_is_held_back_until_flushed():
+    financial_status = FinancialStatus()
+    assert financial_status.strip_marker("The answer is Q") == "The answer is "
+    assert financial_status.flush() == "Q"
+    assert not financial_status.is_financial()
+
+    financial_status = FinancialStatus()
+    assert financial_status.strip_marker("grew Q") == "grew "
+    assert financial_status.strip_marker("Q 12%") == " 12%"
+    assert financial_status.flush() == ""
+    assert financial_status.is_financial()
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+from api.ingestion import IngestionPipeline
+
+
+class FakeBatch:
+    """A Weaviate batch sending its objects on flush and on exit, refusing the objects of some documents."""
+
+    def __init__(self, on_results, refused_docs, fail_on_exit):
+        self._on_results = on_results
+        self._refused_docs = refused_docs
+        self._fail_on_exit = fail_on_exit
+        self.nodes = []
+
+    def flush(self):
+        if self._fail_on_exit:
+            # The requests fail, so no results come back
+            return
+        results = [{"id": node.node_id,
+                    "result": {"errors": {"error": [{"message": "refused"}]}} if node.ref_doc_id in self._refused_docs
+                    else {}}
+                   for node in self.nodes]
+        self.nodes = []
+        self._on_results(results)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._fail_on_exit:
+            raise ConnectionError("Weaviate is down")
+        self.flush()
+
+
+class FakeIngestor:
+    """A BatchIngestor chunking a document into `document.chunks` nodes, without any model or vector store."""
+
+    embed_batch_size = 3
+    embed_workers = 2
+    failed = 0
+
+    def __init__(self, refused_docs=(), fail_on_exit=False):
+        self._refused_docs = set(refused_docs)
+        self._fail_on_exit = fail_on_exit
+        self.batch = None
+
+    def chunk(self, document):
+        return [SimpleNamespace(node_id=f"{document.doc_id}-{i}", ref_doc_id=document.doc_id)
+                for i in range(document.chunks)]
+
+    def embed(self, nodes):
+        return nodes
+
+    def open_batch(self, on_results=None):
+        self.batch = FakeBatch(on_results, self._refused_docs, self._fail_on_exit)
+        return self.batch
+
+    def write(self, batch, node):
+        batch.nodes.append(node)
+
+
+def ingest(ingestor, chunks):
+    """Runs documents with the given numbers of chunks through a pipeline, and returns it once finished."""
+    pipeline = IngestionPipeline(ingestor, queue_size=2, flush_interval=0.05)
+    pipeline.start()
+    for i, count in enumerate(chunks):
+        pipeline.put(SimpleNamespace(doc_id=f"doc{i}", chunks=count))
+    assert pipeline.finish(timeout=10)
+    return pipeline
+
+
+def test_documents_count_as_inserted_once_confirmed():
+    pipeline = ingest(FakeIngestor(), [1, 4, 0, 2])
+    assert pipeline.inserted == 4
+    assert pipeline.failed == 0
+    assert pipeline.progress()["stages"]["insert"]["processed"] == 7
+
+
+def test_refused_chunk_fails_its_document():
+    pipeline = ingest(FakeIngestor(refused_docs={"doc1"}), [2, 3, 2])
+    assert pipeline.inserted == 2
+    assert pipeline.progress()["stages"]["insert"]["failed"] == 1
+
+
+def test_unconfirmed_documents_fail_when_the_batch_fails():
+    pipeline = ingest(FakeIngestor(fail_on_exit=True), [2, 2])
+    assert pipeline.inserted == 0
+    assert pipeline.failed == 2
+    assert "0 of 2 pages queryable" in pipeline.describe()
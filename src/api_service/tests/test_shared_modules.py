@@ -0,0 +1,18 @@
+import filecmp
+import os
+
+import pytest
+
+API_DIR = os.path.join(os.path.dirname(__file__), "..", "api")
+SHARED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "scraper", "shared")
+
+# The modules the scraper vendors from the API service (src/scraper/sync_shared.py)
+SHARED_MODULES = ["browser_pool.py", "http_client.py", "scraping.py", "snapshots.py"]
+
+
+@pytest.mark.skipif(not os.path.isdir(SHARED_DIR), reason="the scraper isn't part of this checkout")
+@pytest.mark.parametrize("name", SHARED_MODULES)
+def test_scraper_copy_matches(name):
+    """The scraper's copy of a shared module is the same as the API's, so a change can't reach only one."""
+    assert filecmp.cmp(os.path.join(API_DIR, name), os.path.join(SHARED_DIR, name), shallow=False), \
+        f"src/scraper/shared/{name} is out of date, run python sync_shared.py from src/scraper"
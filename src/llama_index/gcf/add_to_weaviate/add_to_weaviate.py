@@ -1,8 +1,12 @@
 import functions_framework
 import os
+import gc
+import time
+import resource
 from google.cloud import storage
 import weaviate
 import pandas as pd
+import pyarrow.parquet as pq
 from datetime import datetime, timezone
 from llama_index import Document
 # Suppress Pydantic warnings since it's based in llamaindex
@@ -19,6 +23,68 @@ from google.cloud import storage
 
 WEAVIATE_IP_ADDRESS = "34.133.13.119"
 
+# The snapshot is ingested a chunk of CHUNK_ROWS pages at a time, each chunk being parsed, embedded and
+# written before the next one is read. Chunks shrink when the memory of the function nears MEMORY_CEILING_MB.
+CHUNK_ROWS = int(os.environ.get("CHUNK_ROWS", 100))
+MEMORY_CEILING_MB = int(os.environ.get("MEMORY_CEILING_MB", 512))
+# Pages in a chunk also stop being added once their text reaches CHUNK_MAX_BYTES
+CHUNK_MAX_BYTES = int(os.environ.get("CHUNK_MAX_BYTES", 20 * 1024 * 1024))
+# The number of rows read from the snapshot at a time, below the chunk size
+READ_BATCH_ROWS = 50
+
+
+def current_rss_mb():
+    """
+    Returns the resident memory of the function, in megabytes.
+
+    Returns:
+    float: The current resident set size, or the peak one where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def iter_row_chunks(snapshot, filename, chunk_rows):
+    """
+    Reads a snapshot in chunks of pages, without loading it whole.
+
+    A Parquet snapshot is read with its 'key' and 'text' columns only, a few rows of a row group at a time;
+    a CSV snapshot, written before the Parquet format, READ_BATCH_ROWS rows at a time. The rows are grouped
+    into chunks of up to chunk_rows() pages and CHUNK_MAX_BYTES of text.
+
+    Args:
+    snapshot: The snapshot, as a seekable binary file object.
+    filename (str): The name of the snapshot, whose extension tells its format.
+    chunk_rows (callable): Returns the current maximum number of pages per chunk.
+
+    Yields:
+    list: The pages of a chunk, as dictionaries with 'key' and 'text'.
+    """
+    if filename.endswith('.parquet'):
+        batches = (batch.to_pylist()
+                   for batch in pq.ParquetFile(snapshot).iter_batches(batch_size=READ_BATCH_ROWS,
+                                                                     columns=['key', 'text']))
+    else:
+        batches = (chunk.to_dict('records')
+                   for chunk in pd.read_csv(snapshot, dtype=str, keep_default_na=False,
+                                            usecols=['key', 'text'], chunksize=READ_BATCH_ROWS))
+    chunk = []
+    chunk_bytes = 0
+    for rows in batches:
+        for row in rows:
+            chunk.append(row)
+            chunk_bytes += len(row['text'] or "")
+            if len(chunk) >= chunk_rows() or chunk_bytes >= CHUNK_MAX_BYTES:
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+    if chunk:
+        yield chunk
+
+
 # Triggered by a change in a storage bucket
 @functions_framework.cloud_event
 def add_to_weaviate(data, context):
@@ -55,38 +121,54 @@ def add_to_weaviate(data, context):
     # Get the GCS bucket
     bucket = gs_client.get_bucket(bucket_name)
 
-    # Define the path to the CSV file in the GCS bucket
+    # Define the path to the snapshot file (Parquet or CSV) in the GCS bucket
     blob = bucket.blob(csv_file)
 
-    # Download the CSV file to a local temporary file
-    local_temp_file = "/tmp/temp_file.csv"  # You can change this path as needed
-    blob.download_to_filename(local_temp_file)
-
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(local_temp_file)
-
-    # Manually assemble the documents
-    documents = []
-    for _, row in df.iterrows():
-        document = Document(
-            text=row['text'],
-            metadata={
-                'websiteAddress': websiteAddress,
-                'timestamp': timestamp
-            }
-        )
-        document.doc_id = row['key']
-        documents.append(document)
-
-    # Create the parser and nodes
+    # Stream the snapshot from the bucket rather than downloading it: /tmp is in memory on Cloud Functions
     parser = SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20)
-    nodes = parser.get_nodes_from_documents(documents)
-
     # construct vector store
     vector_store = WeaviateVectorStore(weaviate_client = client, index_name="Pages", text_key="text")
     # setting up the storage for the embeddings
     storage_context = StorageContext.from_defaults(vector_store = vector_store)
-    # set up the index
-    index = VectorStoreIndex(nodes, storage_context=storage_context)
-
-    return(f"Successfully added {csv_file} to Weaviate.")
+    # set up the index, empty: the chunks of pages are inserted into it one after the other
+    index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+
+    chunk_rows = CHUNK_ROWS
+    total_pages = 0
+    total_nodes = 0
+    with blob.open("rb") as snapshot:
+        for chunk_number, rows in enumerate(iter_row_chunks(snapshot, csv_file, lambda: chunk_rows), start=1):
+            started = time.perf_counter()
+
+            # Parse and embed the chunk, and batch-write it to Weaviate
+            documents = []
+            for row in rows:
+                document = Document(
+                    text=row['text'] or "",
+                    metadata={
+                        'websiteAddress': websiteAddress,
+                        'timestamp': timestamp
+                    }
+                )
+                document.doc_id = row['key']
+                documents.append(document)
+            nodes = parser.get_nodes_from_documents(documents)
+            index.insert_nodes(nodes)
+            total_pages += len(documents)
+            total_nodes += len(nodes)
+
+            # Release the chunk before reading the next one. The reader still refers to the list of rows
+            # until it resumes, so the list is emptied rather than just dropped.
+            rows.clear()
+            del documents, nodes
+            gc.collect()
+            rss_mb = current_rss_mb()
+            print(f"Chunk {chunk_number}: {total_pages} pages and {total_nodes} nodes inserted so far, "
+                  f"{time.perf_counter() - started:.1f}s, {rss_mb:.0f} MB of {MEMORY_CEILING_MB} MB")
+
+            # Smaller chunks near the memory ceiling
+            if rss_mb > MEMORY_CEILING_MB * 0.8 and chunk_rows > 1:
+                chunk_rows = max(1, chunk_rows // 2)
+                print(f"Memory above 80% of the ceiling, reading {chunk_rows} pages per chunk")
+
+    return(f"Successfully added {csv_file} to Weaviate: {total_pages} pages, {total_nodes} nodes.")
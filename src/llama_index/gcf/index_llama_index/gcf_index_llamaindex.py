@@ -1,6 +1,7 @@
 import functions_framework
 import weaviate
 import pandas as pd
+import pyarrow.parquet as pq
 import os
 from datetime import datetime, timezone
 from llama_index import Document
@@ -62,38 +63,43 @@ def index_llamaindex(request):
     # Get the GCS bucket
     bucket = gs_client.get_bucket(bucket_name)
 
-    # Define the path to the CSV file in the GCS bucket
+    # Define the path to the snapshot file (Parquet or CSV) in the GCS bucket
     blob = bucket.blob(csv_file)
 
-    # Download the CSV file to a local temporary file
-    local_temp_file = "/tmp/temp_file.csv"  # You can change this path as needed
+    # Download the snapshot to a local temporary file, keeping its extension
+    local_temp_file = "/tmp/temp_file" + os.path.splitext(csv_file)[1]  # You can change this path as needed
     blob.download_to_filename(local_temp_file)
 
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(local_temp_file)
-
-    # Manually assemble the documents
-    documents = []
-    for _, row in df.iterrows():
-        document = Document(
-            text=row['text'],
-            metadata={
-                'websiteAddress': websiteAddress,
-                'timestamp': timestamp
-            }
-        )
-        document.doc_id = row['key']
-        documents.append(document)
-
-    # Create the parser and nodes
-    parser = SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20)
-    nodes = parser.get_nodes_from_documents(documents)
+    # Read the snapshot a row group at a time: Parquet since the columnar format, CSV for older snapshots
+    if local_temp_file.endswith('.parquet'):
+        batches = (batch.to_pylist() for batch in pq.ParquetFile(local_temp_file).iter_batches(columns=['key', 'text']))
+    else:
+        batches = (chunk.to_dict('records') for chunk in pd.read_csv(local_temp_file, dtype=str, keep_default_na=False, chunksize=500))
 
+    # Create the parser
+    parser = SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20)
     # construct vector store
     vector_store = WeaviateVectorStore(weaviate_client = client, index_name="Pages", text_key="text")
     # setting up the storage for the embeddings
     storage_context = StorageContext.from_defaults(vector_store = vector_store)
-    # set up the index
-    index = VectorStoreIndex(nodes, storage_context=storage_context)
-
-    return(f"Successfully added {csv_file} to Weaviate.")
\ No newline at end of file
+    # set up the index, empty: the pages of each row group are inserted into it one after the other
+    index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+
+    # Manually assemble the documents of a row group, then parse and insert them before reading the next one
+    for rows in batches:
+        documents = []
+        for row in rows:
+            document = Document(
+                text=row['text'] or "",
+                metadata={
+                    'websiteAddress': websiteAddress,
+                    'timestamp': timestamp
+                }
+            )
+            document.doc_id = row['key']
+            documents.append(document)
+        nodes = parser.get_nodes_from_documents(documents)
+        index.insert_nodes(nodes)
+        del documents, nodes
+
+    return(f"Successfully added {csv_file} to Weaviate.")
@@ -44,7 +44,7 @@ def main():
 
         timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
 
-        output_file =   f"{website_name}_{timestamp}.csv"
+        output_file =   f"{website_name}_{timestamp}.parquet"
 
         flag, stored_message =save_file(scraped_df, output_file)
         if not log_df.empty:
@@ -53,6 +53,7 @@ def main():
 
         if flag:
             print(f"Finished scraping.{stored_message}")
+        print(f"HTTP client: {http_client.stats()}")
 
 
 if __name__ == "__main__":
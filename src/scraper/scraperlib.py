@@ -1,16 +1,17 @@
 import pandas as pd
-import numpy as np
 from bs4 import BeautifulSoup
-from datetime import datetime
+from datetime import datetime, timezone
 import requests
-from selenium import webdriver
 from selenium.webdriver.chrome.options import ChromiumOptions
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import os
+import io
+import hashlib
 from pathlib import Path
 from google.cloud import storage
+from shared.browser_pool import BrowserPool
+from shared.http_client import HttpClient
+from shared.scraping import ConcurrentScraper
+from shared import snapshots
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
@@ -18,6 +19,19 @@ headers = {
 
 bucket_name = "ac215_scraper_bucket"
 
+# Warm Chrome sessions for the Selenium fallback. Each one takes a few hundred MB of memory.
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+BROWSER_MAX_PAGES = int(os.environ.get("BROWSER_MAX_PAGES", 50))
+
+# A rendered page is read once it has been quiet (no DOM or network activity) for RENDER_QUIET_PERIOD
+# seconds, or after RENDER_TIMEOUT seconds at the latest
+RENDER_QUIET_PERIOD = float(os.environ.get("RENDER_QUIET_PERIOD", 0.5))
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 10))
+
+# The number of pages per row group of a Parquet snapshot, i.e. per unit its readers stream
+SNAPSHOT_ROW_GROUP_SIZE = int(os.environ.get("SNAPSHOT_ROW_GROUP_SIZE", 500))
+
+
 def set_chrome_options() -> ChromiumOptions:
     """Sets chrome options for Selenium.Chrome options for headless browser is enabled.
     Args: None
@@ -35,6 +49,9 @@ def set_chrome_options() -> ChromiumOptions:
     return chrome_options
 
 
+http_client = HttpClient(headers, pool_maxsize=int(os.environ.get("HTTP_POOL_SIZE", 16)))
+
+
 def scrape_sitemap(url):
     """
     Extracts all the links from a company's sitemap.xml.
@@ -46,7 +63,7 @@ def scrape_sitemap(url):
     pd.Series: A pandas Series with all the links, or None if no links found.
     """
     try:
-        with requests.get(url, headers=headers) as response:
+        with http_client.get(url) as response:
             response.raise_for_status()  # Check if the request was successful
             soup = BeautifulSoup(response.text, 'lxml-xml')
             urls = [link.text.strip() for link in soup.find_all('loc') if link]
@@ -58,7 +75,7 @@ def scrape_sitemap(url):
             for link in urls:
                 if link.endswith('xml'):
                     try:
-                        with requests.get(link, headers=headers) as response:
+                        with http_client.get(link) as response:
                             response.raise_for_status()  # Check if the request was successful
                             nested_soup = BeautifulSoup(response.text, 'lxml')
                             nested_urls = [url.text.strip() for url in nested_soup.find_all \
@@ -79,76 +96,110 @@ def scrape_sitemap(url):
         return None  # Return None if the initial request fails
 
 
-def scrape_website(all_links, options):
+def scrape_page(link, browser_pool):
     """
-    Extracts all the text data from the webpages of a company.
+    Extracts the text data from a single webpage, falling back to Selenium when requests returns too little text.
 
     Args:
-    all_links (pd.Series): A pandas Series with all the links in the company's website.
-    options: Chrome options to apply to the browser
+    link (str): The webpage link.
+    browser_pool (BrowserPool): The pool of Chrome sessions the Selenium fallback renders the page in.
 
     Returns:
-    pd.DataFrame: A pandas DataFrame with the columns 'key' (webpage link), 'text' (includes
-                  the text of the webpage), and 'timestamp' (when the data was scraped).
-
-    pd.DataFrame : A pandas dataframe with columns 'key' (webpage link), 'error with timestamp' .
+    tuple: The text of the webpage (or None if nothing was extracted), an error entry for the log
+           (or None if the page was scraped cleanly), and the snapshot metadata of the page: when it was
+           fetched, how its text was extracted ('requests' or 'rendered') and the size of its body in bytes.
     """
-    log_dict = {}
-    text_dict = {}
-    wait_condition = (By.TAG_NAME, ['html', 'div', 'body'])
+    text = None
+    log_entry = None
+    metadata = {'fetched_at': datetime.now(timezone.utc), 'extraction': 'requests', 'byte_size': None}
+    try:
+        # First, scrape the page using requests
+        with http_client.get(link) as response:
+            metadata['byte_size'] = len(response.content)
+            text_only_requests = ""
+            if response.status_code == 200:
+                soup = BeautifulSoup(response.text, 'lxml')
 
-    for link in all_links.to_list():
-        try:
-            # First, scrape the page using requests
-            with requests.get(link, headers=headers) as response:
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'lxml')
-
-                    [tag.decompose() for tag in soup.find_all(['header', 'nav', 'footer'])]
-                    text_only_requests = soup.get_text(separator=' ', strip=True)
-                    print(link)
-
-                # If content seems too short or response code is not 200, use Selenium
-                if response.status_code != 200 or len(text_only_requests.split()) < 50:
-                    print("using selenium to scrape..\n")
-                    try:
-                        browser = webdriver.Chrome(options)
-                        browser.get(link)
-                        wait = WebDriverWait(browser, timeout=30)
+                [tag.decompose() for tag in soup.find_all(['header', 'nav', 'footer'])]
+                text_only_requests = soup.get_text(separator=' ', strip=True)
+                print(link)
 
-                        wait.until(lambda d: browser.find_element(By.TAG_NAME, 'html').is_displayed() \
-                            if browser.find_element(By.TAG_NAME, 'html') else True & \
-                          np.all(np.array([i.is_displayed() \
-                                           for i in
-                                           browser.find_elements(
-                                               By.TAG_NAME,
-                                               'div')])) \
-                        if browser.find_elements(By.TAG_NAME, 'div') else True)
+            # If content seems too short or response code is not 200, use Selenium
+            if response.status_code != 200 or len(text_only_requests.split()) < 50:
+                print("using selenium to scrape..\n")
+                metadata['extraction'] = 'rendered'
+                try:
+                    page_source = browser_pool.render(link, RENDER_QUIET_PERIOD, RENDER_TIMEOUT)
 
-                        soup_selenium = BeautifulSoup(browser.page_source, 'lxml')
+                    soup_selenium = BeautifulSoup(page_source, 'lxml')
 
-                        [tag.decompose() for tag in soup_selenium.find_all(['header', 'nav', 'footer'])]
-                        text_only_selenium = soup_selenium.get_text(separator=' ', strip=True).lower()
+                    [tag.decompose() for tag in soup_selenium.find_all(['header', 'nav', 'footer'])]
+                    text_only_selenium = soup_selenium.get_text(separator=' ', strip=True).lower()
 
-                        text_dict[link] = text_only_selenium
+                    text = text_only_selenium
 
-                        if len(text_only_selenium.lower().split()) < 20:
-                            log_dict[link] = str(pd.to_datetime(datetime.today().date())) + \
-                                             " " + text_only_selenium
+                    if len(text_only_selenium.lower().split()) < 20:
+                        log_entry = str(pd.to_datetime(datetime.today().date())) + \
+                                    " " + text_only_selenium
 
-                    except Exception as e:
-                        print(f"Error occurred while processing {link} in selenium: {e.with_traceback}")
-                        log_dict[link] = f'{pd.to_datetime(datetime.today().date())}  {e.with_traceback}'
+                except Exception as e:
+                    print(f"Error occurred while processing {link} in selenium: {e}")
+                    log_entry = f'{pd.to_datetime(datetime.today().date())} {e}'
 
-                    finally:
-                        browser.close()
+            else:
+                text = text_only_requests.lower()
 
-                else:
-                    text_dict[link] = text_only_requests.lower()
+    except requests.RequestException as e:
+        print(f"Error occurred while processing {link}: {e}")
+        log_entry = f'{pd.to_datetime(datetime.today().date())} {e}'
+
+    return text, log_entry, metadata
+
+
+def scrape_website(all_links, options, max_workers=8, per_host_limit=4):
+    """
+    Extracts all the text data from the webpages of a company.
+
+    The pages are scraped concurrently by up to `max_workers` threads, with no more than `per_host_limit`
+    requests to the same host at a time. The rows of the returned dataframes keep the order of `all_links`.
+    Pages needing Selenium share a pool of BROWSER_POOL_SIZE warm Chrome sessions, quit once all pages are done.
+
+    Args:
+    all_links (pd.Series): A pandas Series with all the links in the company's website.
+    options: Chrome options to apply to the browser
+    max_workers (int): The maximum number of pages scraped at the same time.
+    per_host_limit (int): The maximum number of pages of the same host scraped at the same time.
+
+    Returns:
+    pd.DataFrame: A pandas DataFrame with the columns 'key' (webpage link), 'text' (includes
+                  the text of the webpage), 'content_hash' (the SHA-256 of the text), 'fetched_at'
+                  (when the page was scraped), 'extraction' and 'byte_size'.
+
+    pd.DataFrame : A pandas dataframe with columns 'key' (webpage link), 'error with timestamp' .
+    """
+    log_dict = {}
+    text_dict = {}
+    metadata_dict = {}
+
+    browser_pool = BrowserPool(options, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES)
+    scraper = ConcurrentScraper(lambda link: scrape_page(link, browser_pool), max_workers=max_workers,
+                                per_host_limit=per_host_limit)
+    try:
+        # The results come in the order of the links
+        for link, result, error in scraper.scrape(all_links.to_list()):
+            if error is not None:
+                print(f"Error occurred while processing {link}: {error}")
+                log_dict[link] = f'{pd.to_datetime(datetime.today().date())} {error}'
+                continue
+            text, log_entry, metadata = result
+            if text is not None:
+                text_dict[link] = text
+                metadata_dict[link] = metadata
+            if log_entry is not None:
+                log_dict[link] = log_entry
+    finally:
+        browser_pool.close()
 
-        except requests.RequestException as e:
-            print(f"Error occurred while processing {link}: {e}")
-            log_dict[link] = f'pd.to_datetime(datetime.today().date())  {e.with_traceback}'
     if not log_dict:
         df_log = pd.DataFrame()
     else:
@@ -158,13 +209,37 @@ def scrape_website(all_links, options):
     if not text_dict:
         return pd.DataFrame(), df_log  # return empty DataFrame if no text is extracted
 
-    df = pd.DataFrame(list(text_dict.items()), columns=['key', 'text'])
+    df = pd.DataFrame([
+        {'key': link, 'text': text, 'content_hash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+         **metadata_dict[link]}
+        for link, text in text_dict.items()
+    ])
+    # Keep the byte sizes integers despite the pages without one
+    df['byte_size'] = df['byte_size'].astype('Int64')
 
     return df, df_log
 
+def write_snapshot(df, destination):
+    """
+    Writes the pages of a website as a snapshot file: a zstd-compressed Parquet file with row groups of
+    SNAPSHOT_ROW_GROUP_SIZE pages when the name ends with .parquet, a CSV file otherwise.
+
+    A Parquet snapshot has the columns and types of snapshots.SNAPSHOT_SCHEMA, the same as the API service
+    writes. The columns the scraper doesn't know, such as the HTTP validators, are written as nulls.
+
+    Args:
+    df (pd.DataFrame): The pages, with the 'key' and 'text' columns and the page metadata columns.
+    destination (str or file-like): The path of the file, or a binary buffer for a Parquet snapshot.
+    """
+    if isinstance(destination, str) and not destination.endswith('.parquet'):
+        df.to_csv(destination, index=False)
+    else:
+        snapshots.write_snapshot(df, destination, row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+
 def save_file(df, filename ):
     """
-    This method save a csv file with the following rules:
+    This method save a snapshot file (Parquet, or CSV depending on the extension of the filename) with the
+    following rules:
         1. If running on local computer , files are saved in the root  data/ folder.
         2. If running on a container locally , files are saved in the application data/ folder.
         3. If running gcp container , files are saved on google cloud bucket "ac215_scraper_bucket"
@@ -183,7 +258,7 @@ def save_file(df, filename ):
     path = str(Path('../../data'))
     #Check if we are running on local computer. Store file in the root data/ folder.
     if os.path.exists(path):
-        df.to_csv(f"{path}/{filename}",index=False)
+        write_snapshot(df, f"{path}/{filename}")
         stored_message = f"Stored in {path}/{filename}"
         flag = True
 
@@ -195,16 +270,20 @@ def save_file(df, filename ):
             goog_storage_client = storage.Client()
             bucket = goog_storage_client.bucket(bucket_name)
             if bucket:
-                csv_data = df.to_csv(index=False)
                 blob = bucket.blob(f'data/{filename}')
-                blob.upload_from_string(csv_data, content_type='text/csv')
+                if filename.endswith('.parquet'):
+                    buffer = io.BytesIO()
+                    write_snapshot(df, buffer)
+                    blob.upload_from_string(buffer.getvalue(), content_type='application/vnd.apache.parquet')
+                else:
+                    blob.upload_from_string(df.to_csv(index=False), content_type='text/csv')
                 flag = True
                 stored_message = f"Stored in google storage data/{filename}"
         except Exception as e:
             path = str(Path('data'))
             if not os.path.exists(path):
                 os.mkdir("data")
-            df.to_csv(f"{path}/{filename}", index=False)
+            write_snapshot(df, f"{path}/{filename}")
             flag = True
             stored_message = f"Stored in data/{filename}"
 
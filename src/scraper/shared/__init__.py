@@ -0,0 +1,8 @@
+"""
+The modules the scraper shares with the API service, vendored from src/api_service/api.
+
+The two services are built from separate Docker contexts, so the scraper can't import the API package. The
+files of this package are exact copies of their originals and must not be edited here: change the original
+in src/api_service/api, then run `python sync_shared.py` from src/scraper. `python sync_shared.py --check`
+fails when a copy no longer matches its original.
+"""
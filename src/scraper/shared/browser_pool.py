@@ -0,0 +1,242 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+# Resolves once the document has loaded and neither the DOM nor the network changed for `quietMs`,
+# or with false after `timeoutMs`. It runs entirely in the page, so a poll costs no WebDriver round trip.
+READINESS_SCRIPT = """
+var quietMs = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+var start = Date.now(), lastActivity = start;
+var resources = performance.getEntriesByType('resource').length;
+var observer = new MutationObserver(function () { lastActivity = Date.now(); });
+if (document.documentElement) {
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+function check() {
+    var now = Date.now();
+    var loaded = performance.getEntriesByType('resource').length;
+    if (loaded !== resources) { resources = loaded; lastActivity = now; }
+    if (document.readyState === 'complete' && now - lastActivity >= quietMs) {
+        observer.disconnect(); done(true);
+    } else if (now - start >= timeoutMs) {
+        observer.disconnect(); done(false);
+    } else {
+        setTimeout(check, 50);
+    }
+}
+check();
+"""
+
+
+def wait_until_ready(browser, quiet_period: float = 0.5, timeout: float = 10) -> bool:
+    """
+    Waits until the page loaded in a browser is ready to be read, in a single WebDriver call.
+
+    The page counts as ready once document.readyState is "complete" and no DOM mutation or new network
+    request happened for `quiet_period` seconds. The check runs inside the page, so unlike polling
+    `is_displayed()` element by element, its cost doesn't grow with the size of the page.
+
+    Args:
+        browser (webdriver.Chrome): The driver with the page loaded.
+        quiet_period (float): The seconds without DOM or network activity after which the page is ready.
+        timeout (float): The hard limit of the wait, in seconds.
+
+    Returns:
+        bool: True if the page became ready, False if the timeout was reached first. The page can still be
+              read after a timeout, it may just miss late content.
+    """
+    browser.set_script_timeout(timeout + 5)
+    return bool(browser.execute_async_script(READINESS_SCRIPT, int(quiet_period * 1000), int(timeout * 1000)))
+
+
+class BrowserPool:
+    """
+    A bounded pool of warm headless Chrome sessions for the Selenium fallback of the scraper.
+
+    Starting Chrome takes far longer than rendering most pages, so sessions are started lazily, up to `size`
+    of them, and handed back to the pool after each page instead of being closed. Every page is rendered in
+    a fresh tab which is closed afterwards, and the cookies are cleared, so pages don't leak state into each
+    other. A session is recycled (quit and replaced on the next checkout) after `max_pages` pages, or as soon
+    as the driver raises a WebDriverException, which is how a crashed or hung Chrome shows up.
+
+    Attributes:
+        _options (ChromiumOptions): The options every Chrome session is started with.
+        _size (int): The maximum number of Chrome sessions alive at the same time.
+        _max_pages (int): The number of pages a session renders before it is recycled.
+        _page_load_timeout (int): The implicit wait and page load timeout of the sessions, in seconds.
+        _idle (queue.Queue): The sessions waiting to be checked out, with the number of pages they rendered.
+        _slots (threading.BoundedSemaphore): A semaphore bounding the checked out and idle sessions to `size`.
+        _lock (threading.Lock): A lock protecting the counters.
+        _closed (bool): Whether the pool was closed.
+        _started (int): The number of Chrome sessions started.
+        _recycled (int): The number of Chrome sessions quit after `max_pages` pages.
+        _crashed (int): The number of Chrome sessions quit after an error.
+        _pages (int): The number of pages rendered.
+        _render_seconds (float): The total time spent loading pages until they were ready.
+        _render_timeouts (int): The number of pages that didn't become ready before the readiness timeout.
+    """
+
+    def __init__(self, options, size: int = 2, max_pages: int = 50, page_load_timeout: int = 30):
+        """
+        Initializes the pool. No Chrome session is started until the first page is checked out.
+
+        Args:
+            options (ChromiumOptions): The options every Chrome session is started with.
+            size (int): The maximum number of Chrome sessions alive at the same time. Each one costs a few
+                        hundred MB, so this should follow the memory of the container.
+            max_pages (int): The number of pages a session renders before it is recycled.
+            page_load_timeout (int): The implicit wait and page load timeout of the sessions, in seconds.
+        """
+        self._options = options
+        self._size = size
+        self._max_pages = max_pages
+        self._page_load_timeout = page_load_timeout
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._started = 0
+        self._recycled = 0
+        self._crashed = 0
+        self._pages = 0
+        self._render_seconds = 0.0
+        self._render_timeouts = 0
+
+    def _start_browser(self):
+        """Starts a new Chrome session."""
+        browser = webdriver.Chrome(self._options)
+        browser.implicitly_wait(self._page_load_timeout)
+        # A page that never finishes loading raises a TimeoutException, which recycles the session
+        browser.set_page_load_timeout(self._page_load_timeout)
+        with self._lock:
+            self._started += 1
+        return browser
+
+    @staticmethod
+    def _quit(browser):
+        """Quits a Chrome session, ignoring the errors of an already dead one."""
+        try:
+            browser.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def page(self):
+        """
+        Checks out a session for a single page, waiting for a free one when all `size` sessions are busy.
+
+        The yielded driver is switched to a new tab. When the block exits, the tab is closed and the session is
+        returned to the pool, unless it raised a WebDriverException or rendered `max_pages` pages, in which
+        case it is quit.
+
+        Yields:
+            webdriver.Chrome: The driver, switched to a tab of its own.
+
+        Example usage:
+            with browser_pool.page() as browser:
+                browser.get(link)
+                html = browser.page_source
+        """
+        self._slots.acquire()
+        browser, pages = None, 0
+        crashed = False
+        try:
+            try:
+                browser, pages = self._idle.get_nowait()
+            except queue.Empty:
+                browser = self._start_browser()
+
+            base_handle = browser.current_window_handle
+            browser.switch_to.new_window('tab')
+            try:
+                yield browser
+            except WebDriverException:
+                crashed = True
+                raise
+            finally:
+                # Close the page's tab and go back to the blank one the session idles on
+                try:
+                    browser.close()
+                    browser.switch_to.window(base_handle)
+                    browser.delete_all_cookies()
+                except WebDriverException:
+                    crashed = True
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            if browser is not None:
+                self._check_in(browser, pages + 1, crashed)
+            self._slots.release()
+
+    def _check_in(self, browser, pages: int, crashed: bool):
+        """Returns a session to the pool after a page, or quits it if it crashed or is due for recycling."""
+        with self._lock:
+            self._pages += 1
+            if crashed:
+                self._crashed += 1
+            elif pages >= self._max_pages:
+                self._recycled += 1
+        if self._closed or crashed or pages >= self._max_pages:
+            self._quit(browser)
+        else:
+            self._idle.put((browser, pages))
+
+    def render(self, link: str, quiet_period: float = 0.5, timeout: float = 10) -> str:
+        """
+        Loads a page in a session of the pool, waits until it is ready and returns its HTML.
+
+        Args:
+            link (str): The URL of the page.
+            quiet_period (float): The seconds without DOM or network activity after which the page is ready.
+            timeout (float): The hard limit of the readiness wait, in seconds.
+
+        Returns:
+            str: The HTML of the rendered page.
+        """
+        with self.page() as browser:
+            start_time = time.time()
+            browser.get(link)
+            ready = wait_until_ready(browser, quiet_period, timeout)
+            page_source = browser.page_source
+        elapsed = time.time() - start_time
+        with self._lock:
+            self._render_seconds += elapsed
+            if not ready:
+                self._render_timeouts += 1
+        print(f"Rendered {link} in {elapsed:.2f}s" + ("" if ready else " (readiness timeout)"))
+        return page_source
+
+    def close(self):
+        """Quits all the idle sessions. Sessions checked out at that time are quit when they are returned."""
+        self._closed = True
+        while True:
+            try:
+                browser, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(browser)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the pool.
+
+        Returns:
+            dict: The size of the pool, the idle sessions, the started, recycled and crashed sessions, the rendered
+                  pages and their average render time and readiness timeouts.
+        """
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": self._idle.qsize(),
+                "started": self._started,
+                "recycled": self._recycled,
+                "crashed": self._crashed,
+                "pages": self._pages,
+                "avg_render_seconds": self._render_seconds / self._pages if self._pages else 0.0,
+                "render_timeouts": self._render_timeouts,
+            }
@@ -0,0 +1,188 @@
+import threading
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+class _CountingPoolMixin:
+    """A connection pool calling `on_new_connection` for every connection it opens."""
+
+    def __init__(self, *args, on_new_connection=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_new_connection = on_new_connection
+
+    def _new_conn(self):
+        if self._on_new_connection is not None:
+            self._on_new_connection()
+        return super()._new_conn()
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CountingReader:
+    """A file-like reader of a raw response body calling `on_read` with the size of every chunk read."""
+
+    def __init__(self, raw, on_read):
+        self._raw = raw
+        self._on_read = on_read
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to `size` decoded bytes, or the whole remaining body if `size` is negative."""
+        chunk = self._raw.read(size if size >= 0 else None)
+        self._on_read(len(chunk))
+        return chunk
+
+
+class HttpClient:
+    """
+    The HTTP client shared by all the requests of the scraper.
+
+    It wraps a single requests.Session, so the connections to a host are kept alive and reused across pages
+    instead of paying a new TCP and TLS handshake (and DNS lookup) per page. Requests that fail with a 429 or
+    a 5xx status, or on a connection error, are retried with exponential backoff, honouring Retry-After. Every
+    request gets a (connect, read) timeout unless the caller passes its own. Responses are decompressed
+    transparently, including brotli when the brotli package is installed.
+
+    Attributes:
+        _session (requests.Session): The session holding the connection pools.
+        _adapter (HTTPAdapter): The adapter of the session, with the retry policy and the connection pools.
+        _timeout (tuple): The default (connect, read) timeout of the requests, in seconds.
+        _lock (threading.Lock): A lock protecting the counters.
+        _requests (int): The number of requests sent, not counting the retries.
+        _connections_opened (int): The number of connections opened, including those since closed or evicted.
+        _bytes_received (int): The number of decoded body bytes received, counted as they are consumed through
+                               iter_content, content or the reader returned by `raw_reader`.
+    """
+
+    def __init__(self, headers: dict, pool_maxsize: int = 16, retries: int = 3, backoff_factor: float = 0.5,
+                 connect_timeout: float = 5, read_timeout: float = 30):
+        """
+        Initializes the client.
+
+        Args:
+            headers (dict): The headers sent with every request, e.g. the User-Agent.
+            pool_maxsize (int): The number of connections kept alive per host. It should be at least the number
+                                of threads scraping the same host.
+            retries (int): The number of retries of a failed request.
+            backoff_factor (float): The base of the exponential backoff between retries, in seconds.
+            connect_timeout (float): The default connect timeout, in seconds.
+            read_timeout (float): The default read timeout, in seconds.
+        """
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "HEAD"],
+            respect_retry_after_header=True,
+            # Hand the last response back instead of raising, as a single request would
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_maxsize, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._session.headers.update(headers)
+        # gzip and deflate, plus br when a brotli decoder is available
+        self._session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        # Count the connections as they are opened, since the pools of evicted hosts take theirs away
+        self._adapter.poolmanager.pool_classes_by_scheme = {
+            "http": partial(_CountingHTTPConnectionPool, on_new_connection=self._count_connection),
+            "https": partial(_CountingHTTPSConnectionPool, on_new_connection=self._count_connection),
+        }
+        self._timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections_opened = 0
+        self._bytes_received = 0
+
+    def _count_connection(self):
+        """Counts a connection opened by one of the pools."""
+        with self._lock:
+            self._connections_opened += 1
+
+    def _count_bytes(self, size: int):
+        """Counts body bytes consumed by the caller."""
+        with self._lock:
+            self._bytes_received += size
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a GET request through the shared session.
+
+        Args:
+            url (str): The URL to fetch.
+            **kwargs: The keyword arguments of requests.get, e.g. stream or timeout.
+
+        Returns:
+            requests.Response: The response, which can be used as a context manager to release its connection.
+
+        Raises:
+            requests.RequestException: If the request fails after all the retries.
+        """
+        kwargs.setdefault("timeout", self._timeout)
+        response = self._session.get(url, **kwargs)
+        with self._lock:
+            self._requests += 1
+        if kwargs.get("stream"):
+            # A streamed body isn't read yet: its decoded chunks are counted as the caller reads them, through
+            # iter_content or content, which reads through iter_content
+            iter_content = response.iter_content
+
+            def counted_iter_content(*args, **iter_kwargs):
+                for chunk in iter_content(*args, **iter_kwargs):
+                    self._count_bytes(len(chunk))
+                    yield chunk
+
+            response.iter_content = counted_iter_content
+        else:
+            self._count_bytes(len(response.content))
+        return response
+
+    def raw_reader(self, response: requests.Response) -> _CountingReader:
+        """
+        Returns a file-like reader of the decoded body of a streamed response, for parsers reading a file.
+
+        The body is read from the raw urllib3 stream, which bypasses iter_content, so the reader counts the
+        bytes itself.
+
+        Args:
+            response (requests.Response): A response to a request sent with stream=True.
+
+        Returns:
+            _CountingReader: The reader of the body, decompressed according to its Content-Encoding.
+        """
+        # Undo the Content-Encoding of the transfer, as iter_content does
+        response.raw.decode_content = True
+        return _CountingReader(response.raw, self._count_bytes)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the client.
+
+        The connections opened are the TCP (and TLS) handshakes made since the client was created, so the
+        requests per connection show how well the keep-alive connections are reused. The open hosts are those
+        whose pool is currently kept by the pool manager.
+
+        Returns:
+            dict: The requests sent, the connections opened, the open hosts and the body bytes received.
+        """
+        # The pool container can't be iterated, only looked up by key
+        pools = self._adapter.poolmanager.pools
+        hosts = len([key for key in pools.keys() if pools.get(key) is not None])
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "connections_opened": self._connections_opened,
+                "hosts": hosts,
+                "bytes_received": self._bytes_received,
+            }
@@ -0,0 +1,90 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlparse
+
+
+class ConcurrentScraper:
+    """
+    A class for scraping many pages at once with a bounded thread pool.
+
+    Pages are fetched by up to `max_workers` threads, and no more than `per_host_limit` of them talk to
+    the same host at the same time, so a single website is not hammered. Results are returned in the
+    order of the input links, as soon as the next one in order is ready, so progress can be streamed
+    while later pages are still being fetched.
+
+    Attributes:
+        _scrape_fn (Callable): The function scraping a single link. It may raise on failure.
+        _max_workers (int): The maximum number of pages scraped at the same time.
+        _per_host_limit (int): The maximum number of pages of the same host scraped at the same time.
+        _host_semaphores (dict): A semaphore per host, bounding its concurrent requests.
+        _lock (threading.Lock): A lock protecting the creation of the host semaphores.
+    """
+
+    def __init__(self, scrape_fn, max_workers: int = 8, per_host_limit: int = 4):
+        """
+        Initializes the scraper.
+
+        Args:
+            scrape_fn (Callable): The function scraping a single link.
+            max_workers (int): The maximum number of pages scraped at the same time.
+            per_host_limit (int): The maximum number of pages of the same host scraped at the same time.
+        """
+        self._scrape_fn = scrape_fn
+        self._max_workers = max_workers
+        self._per_host_limit = per_host_limit
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, link: str) -> threading.BoundedSemaphore:
+        """Returns the semaphore bounding the concurrent requests to the host of a link."""
+        host = urlparse(link).netloc
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self._per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _scrape_one(self, link: str):
+        """Scrapes a link while holding a slot of its host."""
+        with self._host_semaphore(link):
+            return self._scrape_fn(link)
+
+    def scrape(self, links):
+        """
+        Scrapes the given links concurrently and yields the results in the order of the links.
+
+        The links may be any iterable, including a generator still discovering them, e.g. a sitemap being
+        resolved. Only a window of twice `max_workers` links is scheduled ahead of the one being yielded, so
+        scraping starts with the first links and doesn't wait for the iterable to be exhausted. If the caller
+        stops iterating early, the links that haven't started yet are cancelled.
+
+        Args:
+            links (Iterable): The links to scrape.
+
+        Yields:
+            tuple: The link, the result of the scrape function (or None on failure) and the exception
+                   raised by the scrape function (or None on success).
+        """
+        pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="scraper")
+        window = deque()
+        links = iter(links)
+        try:
+            for link in islice(links, 2 * self._max_workers):
+                window.append((link, pool.submit(self._scrape_one, link)))
+            while window:
+                link, future = window.popleft()
+                try:
+                    result = (link, future.result(), None)
+                except Exception as e:
+                    result = (link, None, e)
+                # Keep the window full before handing the result over
+                for next_link in islice(links, 1):
+                    window.append((next_link, pool.submit(self._scrape_one, next_link)))
+                yield result
+        finally:
+            for _, future in window:
+                future.cancel()
+            pool.shutdown(wait=False)
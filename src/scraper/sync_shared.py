@@ -0,0 +1,49 @@
+import argparse
+import filecmp
+import shutil
+import sys
+from pathlib import Path
+
+# The modules of the API service the scraper uses, copied verbatim into shared/
+SHARED_MODULES = ["browser_pool.py", "http_client.py", "scraping.py", "snapshots.py"]
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent / "api_service" / "api"
+SHARED_DIR = Path(__file__).resolve().parent / "shared"
+
+
+def stale_modules() -> list:
+    """
+    Returns the shared modules whose copy differs from their original in the API service.
+
+    Returns:
+        list: The file names of the modules missing from shared/ or differing from their original.
+    """
+    return [name for name in SHARED_MODULES
+            if not (SHARED_DIR / name).exists()
+            or not filecmp.cmp(SOURCE_DIR / name, SHARED_DIR / name, shallow=False)]
+
+
+def main():
+    """
+    Copies the shared modules from the API service into shared/, or with --check, only verifies that the
+    copies match their originals and exits with an error if they don't.
+    """
+    parser = argparse.ArgumentParser(description="Sync the modules the scraper shares with the API service")
+    parser.add_argument("--check", action="store_true", help="Only check that the copies are up to date")
+    args = parser.parse_args()
+
+    stale = stale_modules()
+    if args.check:
+        if stale:
+            print(f"Out of date in {SHARED_DIR}: {', '.join(stale)}. Run python sync_shared.py")
+            sys.exit(1)
+        print("Shared modules are up to date")
+        return
+
+    for name in stale:
+        shutil.copyfile(SOURCE_DIR / name, SHARED_DIR / name)
+        print(f"Copied {name}")
+
+
+if __name__ == "__main__":
+    main()